@@ -1,5 +1,6 @@
 """``pytest`` configuration."""
 
+import asyncio
 import os
 
 import pytest
@@ -54,3 +55,37 @@ def app(database_url, monkeypatch):
 
     with TestClient(app) as app:
         yield app
+
+
+@pytest.fixture
+def run_with_pool(app):
+    """Run `func(pool, *args, **kwargs)` in a new event loop with a one connection pool.
+
+    asyncpg pools are bound to their event loop: each call gets its own pool, closed
+    when `func` returns.
+    """
+    from timvt.db import create_pool
+
+    def _run(func, *args, **kwargs):
+        async def _main():
+            pool = await create_pool(min_size=1, max_size=1)
+            try:
+                return await func(pool, *args, **kwargs)
+            finally:
+                await pool.close()
+
+        return asyncio.run(_main())
+
+    return _run
+
+
+@pytest.fixture
+def execute(run_with_pool):
+    """Execute SQL queries in the test database."""
+
+    async def _execute(pool, *queries):
+        async with pool.acquire() as conn:
+            for query in queries:
+                await conn.execute(query)
+
+    return lambda *queries: run_with_pool(_execute, *queries)
@@ -0,0 +1,121 @@
+"""Test Archive layers."""
+
+import asyncio
+
+import mapbox_vector_tile
+import morecantile
+import pytest
+
+from timvt.layer import Archive, Layer
+from timvt.seed import seed_archive
+
+
+class Points(Layer):
+    """Layer with one point per tile."""
+
+    async def get_tile(self, pool, tile, tms, **kwargs):
+        """Return tile with a point (empty for odd columns)."""
+        if tile.x % 2:
+            return b""
+
+        return mapbox_vector_tile.encode(
+            [
+                {
+                    "name": "points",
+                    "features": [
+                        {"geometry": "POINT(2048 2048)", "properties": {"z": tile.z}}
+                    ],
+                }
+            ]
+        )
+
+
+@pytest.fixture
+def archives(app, tmp_path):
+    """Register MBTiles and PMTiles archives."""
+    tms = morecantile.tms.get("WebMercatorQuad")
+    layer = Points(id="points", minzoom=0, maxzoom=4, bounds=[-10, -10, 10, 10])
+
+    catalog = app.app.state.timvt_archive_catalog
+    for ext in ["mbtiles", "pmtiles"]:
+        path = str(tmp_path / f"points.{ext}")
+        asyncio.run(seed_archive(None, layer, tms, path))
+        catalog.register(Archive.from_file(id=f"points_{ext}", path=path))
+
+    yield
+
+    for ext in ["mbtiles", "pmtiles"]:
+        catalog.archives.pop(f"points_{ext}").close()
+
+
+@pytest.mark.parametrize("ext", ["mbtiles", "pmtiles"])
+def test_archive_tile(app, archives, ext):
+    """Test tiles from archive."""
+    response = app.get(f"/tiles/points_{ext}/4/8/7")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-protobuf"
+    decoded = mapbox_vector_tile.decode(response.content)
+    assert decoded["points"]["features"][0]["properties"]["z"] == 4
+
+    # gzip tiles from the archive are sent as is
+    response = app.get(
+        f"/tiles/points_{ext}/4/8/7", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+
+    response = app.get(
+        f"/tiles/points_{ext}/4/8/7", headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+    decoded = mapbox_vector_tile.decode(response.content)
+    assert decoded["points"]["features"][0]["properties"]["z"] == 4
+
+    # ETag from the archive's version
+    etag = response.headers["etag"]
+    assert etag.startswith('"v-')
+    response = app.get(f"/tiles/points_{ext}/4/8/7", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Empty tile
+    response = app.get(f"/tiles/points_{ext}/4/7/7")
+    assert response.status_code == 204
+    assert not response.content
+
+    # Outside the archive
+    response = app.get(f"/tiles/points_{ext}/4/0/0")
+    assert response.status_code == 204
+    assert not response.content
+
+    # Archive is only available in WebMercatorQuad
+    response = app.get(f"/tiles/WorldCRS84Quad/points_{ext}/0/0/0")
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("ext", ["mbtiles", "pmtiles"])
+def test_archive_tilejson(app, archives, ext):
+    """Test TileJSON from archive metadata."""
+    response = app.get(f"/points_{ext}/tilejson.json")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["minzoom"] == 0
+    assert body["maxzoom"] == 4
+    assert body["bounds"] == [-10, -10, 10, 10]
+
+
+def test_archive_metadata(app, archives):
+    """Test /archives.json and /archive/{layer}.json endpoints."""
+    response = app.get("/archives.json")
+    assert response.status_code == 200
+    body = response.json()
+    assert {archive["id"] for archive in body} == {"points_mbtiles", "points_pmtiles"}
+    assert body[0]["type"] == "Archive"
+    assert body[0]["tileurl"]
+    assert "path" not in body[0]
+
+    response = app.get("/archive/points_pmtiles.json")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["id"] == "points_pmtiles"
+    assert body["minzoom"] == 0
+    assert body["maxzoom"] == 4
+    assert "path" not in body
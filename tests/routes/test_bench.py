@@ -0,0 +1,31 @@
+"""Test synthetic tables."""
+
+from timvt.bench import create_synthetic_table, synthetic_table_name
+
+
+async def _create_tables(pool, rows):
+    tables = {}
+    for geometry_type in ["point", "linestring", "polygon"]:
+        table = synthetic_table_name(geometry_type, rows)
+        await create_synthetic_table(
+            pool, table, geometry_type=geometry_type, rows=rows, seed=0.5
+        )
+        async with pool.acquire() as conn:
+            tables[table] = await conn.fetchrow(
+                f"SELECT count(*), min(GeometryType(geom)), sum(ST_X(ST_Centroid(geom))) FROM {table}"
+            )
+            await conn.execute(f"DROP TABLE {table}")
+
+    return tables
+
+
+def test_synthetic_tables(app, run_with_pool):
+    """Synthetic tables should have random features of the geometry type."""
+    tables = run_with_pool(_create_tables, 100)
+    assert tables["public.timvt_bench_point_100"][0] == 100
+    assert tables["public.timvt_bench_point_100"][1] == "POINT"
+    assert tables["public.timvt_bench_linestring_100"][1] == "LINESTRING"
+    assert tables["public.timvt_bench_polygon_100"][1] == "POLYGON"
+
+    # Same seed, same features
+    assert run_with_pool(_create_tables, 100) == tables
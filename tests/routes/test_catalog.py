@@ -0,0 +1,134 @@
+"""Test lazy and incremental table catalog."""
+
+import asyncio
+
+from timvt.catalog import TableCatalog, drop_event_triggers, install_event_triggers
+from timvt.db import connect
+
+CREATE_TABLE = "CREATE TABLE public.catalog_test AS SELECT ogc_fid, path, geom FROM public.landsat_wrs LIMIT 10"
+DROP_TABLE = "DROP TABLE IF EXISTS public.catalog_test"
+
+
+async def _refresh(pool, *queries):
+    catalog = TableCatalog(pool)
+    await catalog.refresh()
+    before, loads = dict(catalog), catalog.stats["loads"]
+
+    async with pool.acquire() as conn:
+        for query in queries:
+            await conn.execute(query)
+
+    await catalog.refresh()
+    return before, dict(catalog), catalog.stats["loads"] - loads
+
+
+def test_catalog_refresh(app, execute, run_with_pool):
+    """Refreshes should only reload new and modified tables."""
+    try:
+        before, after, loads = run_with_pool(
+            _refresh,
+            CREATE_TABLE,
+            "ALTER TABLE public.catalog_test ADD COLUMN name text",
+        )
+    finally:
+        execute(DROP_TABLE)
+    assert "public.landsat_wrs" in before
+    assert "public.catalog_test" not in before
+    assert "name" in [p.name for p in after["public.catalog_test"].properties]
+    # Only the new table is loaded
+    assert loads == 1
+
+    before, after, _ = run_with_pool(_refresh, DROP_TABLE)
+    assert "public.catalog_test" not in after
+
+
+async def _get_table(pool, *queries):
+    catalog = TableCatalog(pool, missing_ttl=0)
+    assert await catalog.get_table("public.catalog_test") is None
+
+    async with pool.acquire() as conn:
+        for query in queries:
+            await conn.execute(query)
+
+    table = await catalog.get_table("public.catalog_test")
+    return table, list(catalog)
+
+
+def test_catalog_lazy(app, execute, run_with_pool):
+    """Tables should be loaded on first access."""
+    try:
+        table, loaded = run_with_pool(_get_table, CREATE_TABLE)
+    finally:
+        execute(DROP_TABLE)
+
+    assert table.id == "public.catalog_test"
+    assert table.geometry_column.name == "geom"
+    assert loaded == ["public.catalog_test"]
+
+
+def test_catalog_new_table(app, execute):
+    """New tables should be served without restart."""
+    catalog = app.app.state.table_catalog
+
+    # Catalogs loaded at startup and never refreshed don't look up the tables
+    assert not catalog.lookup
+    execute(CREATE_TABLE)
+    try:
+        response = app.get("/tiles/public.catalog_test/0/0/0")
+        assert response.status_code == 404
+    finally:
+        execute(DROP_TABLE)
+
+    catalog.lookup = True
+    try:
+        response = app.get("/tiles/public.catalog_test/0/0/0")
+        assert response.status_code == 404
+
+        execute(CREATE_TABLE)
+        # Tables not found are not looked up again during `missing_ttl`
+        response = app.get("/tiles/public.catalog_test/0/0/0")
+        assert response.status_code == 404
+
+        catalog._missing.clear()
+        response = app.get("/tiles/public.catalog_test/0/0/0")
+        assert response.status_code == 200
+        assert "public.catalog_test" in catalog
+
+    finally:
+        catalog.lookup = False
+        catalog.pop("public.catalog_test", None)
+        execute(DROP_TABLE)
+
+
+async def _listen(pool, *queries):
+    async with pool.acquire() as conn:
+        await install_event_triggers(conn)
+
+    catalog = TableCatalog(pool)
+    # Notifications are received on a dedicated connection, not the pool's one
+    await catalog.listen(connect, delay=0.1)
+    try:
+        async with pool.acquire() as conn:
+            for query in queries:
+                await conn.execute(query)
+
+        # Wait for the notifications
+        for _ in range(50):
+            if "public.catalog_test" in catalog:
+                break
+            await asyncio.sleep(0.1)
+    finally:
+        await catalog.stop()
+
+        async with pool.acquire() as conn:
+            await drop_event_triggers(conn)
+            await conn.execute(DROP_TABLE)
+
+    return catalog
+
+
+def test_catalog_listen(app, run_with_pool):
+    """Tables notified by the event triggers should be reloaded."""
+    catalog = run_with_pool(_listen, CREATE_TABLE)
+    assert catalog.stats["notifications"] >= 1
+    assert "public.catalog_test" in catalog
@@ -0,0 +1,61 @@
+"""Test change tracking triggers."""
+
+import asyncio
+
+import morecantile
+
+from timvt.changes import CallbackSink, ChangeTracker, drop_triggers, install_triggers
+from timvt.db import connect
+
+
+async def _track_changes(pool, *queries):
+    received = []
+    tracker = ChangeTracker(
+        [morecantile.tms.get("WebMercatorQuad")],
+        [CallbackSink(received.extend)],
+        minzoom=0,
+        maxzoom=4,
+    )
+
+    async with pool.acquire() as conn:
+        await install_triggers(conn, "public.landsat_wrs", "geom")
+
+    await tracker.start(connect)
+    try:
+        async with pool.acquire() as conn:
+            for query in queries:
+                await conn.execute(query)
+
+        # Wait for the notifications
+        for _ in range(50):
+            if tracker.stats["notifications"]:
+                break
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(0.5)
+        await tracker.join()
+    finally:
+        await tracker.stop()
+
+        async with pool.acquire() as conn:
+            await drop_triggers(conn, "public.landsat_wrs")
+
+    return tracker, received
+
+
+def test_change_tracking(app, run_with_pool):
+    """Modified rows should invalidate their tiles."""
+    tracker, received = run_with_pool(
+        _track_changes,
+        # `UPDATE` of one row (without changing its values)
+        "UPDATE public.landsat_wrs SET path = path WHERE ogc_fid = 1",
+        # No modified rows, no notification
+        "UPDATE public.landsat_wrs SET path = path WHERE false",
+    )
+    assert tracker.stats["notifications"] == 1
+    assert tracker.stats["errors"] == 0
+
+    invalidation = received[0]
+    assert invalidation.layer == "public.landsat_wrs"
+    assert invalidation.tms == "WebMercatorQuad"
+    assert morecantile.Tile(0, 0, 0) in invalidation.tiles
+    assert {tile.z for tile in invalidation.tiles} == {0, 1, 2, 3, 4}
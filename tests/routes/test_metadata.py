@@ -13,6 +13,17 @@ def test_table_index(app):
     assert body[0]["bounds"]
     assert body[0]["tileurl"]
 
+    # Metadata ETags, Server-Timing and Cache-Control from the middlewares
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    assert response.headers["server-timing"].startswith("total;dur=")
+    assert response.headers["cache-control"]
+
+    response = app.get("/tables.json", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert "content-encoding" not in response.headers
+    assert not response.content
+
 
 def test_table_info(app):
     """Test metadata endpoint."""
@@ -0,0 +1,74 @@
+"""Test Table overviews."""
+
+import mapbox_vector_tile
+import morecantile
+import pytest
+
+from timvt.dbmodel import get_table_index
+from timvt.layer import Table
+from timvt.overviews import create_overviews
+
+from .test_tiles import _parse_batch
+
+
+async def _create_overviews(pool, tms, zooms, **kwargs):
+    catalog = await get_table_index(pool, tables=["landsat_wrs"])
+    table = Table(**catalog["public.landsat_wrs"])
+    overviews = await create_overviews(pool, table, tms, zooms, **kwargs)
+    return overviews, await get_table_index(pool)
+
+
+@pytest.fixture
+def overviews(app, run_with_pool, execute):
+    """Create overviews for zoom 0 to 2 and update the table catalog."""
+    tms = morecantile.tms.get("WebMercatorQuad")
+    catalog = app.app.state.table_catalog
+    table = catalog["public.landsat_wrs"]
+
+    overviews, index = run_with_pool(
+        _create_overviews, tms, [(0, 1), (2, 2)], simplify=2.0, cluster=True
+    )
+    catalog["public.landsat_wrs"] = Table(**index["public.landsat_wrs"])
+
+    yield index
+
+    catalog["public.landsat_wrs"] = table
+    execute(
+        *[f"DROP TABLE {overview.table}" for overview in overviews],
+        "DROP TABLE public.timvt_overviews",
+    )
+
+
+def test_overviews_catalog(app, overviews):
+    """Overviews should be attached to their Table."""
+    assert "public.landsat_wrs_ovr_webmercatorquad_0_1" not in overviews
+    assert "public.landsat_wrs_ovr_webmercatorquad_2_2" not in overviews
+
+    table = Table(**overviews["public.landsat_wrs"])
+    assert len(table.overviews) == 2
+
+    tms = morecantile.tms.get("WebMercatorQuad")
+    overview = table._overview(tms, 1, "geom")
+    assert overview.table == "public.landsat_wrs_ovr_webmercatorquad_0_1"
+    assert overview.srid == 3857
+    assert table._overview(tms, 2, "geom").minzoom == 2
+    assert not table._overview(tms, 3, "geom")
+    assert not table._overview(morecantile.tms.get("WorldCRS84Quad"), 1, "geom")
+
+
+def test_overviews_tiles(app, overviews):
+    """Tiles should be rendered from the overviews."""
+    response = app.get("/tiles/public.landsat_wrs/1/0/0")
+    assert response.status_code == 200
+    decoded = mapbox_vector_tile.decode(response.content)
+    assert len(decoded["default"]["features"])
+    assert decoded["default"]["features"][0]["properties"]["pr"]
+
+    # Batch of tiles across overviews and the Table
+    body = {"tiles": ["1/0/0", "2/1/1", "3/2/2", "1/1/0"]}
+    response = app.post("/tiles/public.landsat_wrs/batch", json=body)
+    assert response.status_code == 200
+    tiles = _parse_batch(response.content)
+    assert sorted(tiles) == sorted(body["tiles"])
+    for tile, content in tiles.items():
+        assert app.get(f"/tiles/public.landsat_wrs/{tile}").content == content
@@ -1,7 +1,22 @@
 """Test Tiles endpoints."""
 
+import asyncio
+import struct
+
 import mapbox_vector_tile
+import morecantile
 import numpy as np
+import pytest
+
+from timvt.admission import AdmissionController
+from timvt.cache import MemoryCache
+from timvt.compression import decompress
+from timvt.dbmodel import get_table_index
+from timvt.etag import TableVersions
+from timvt.factory import BATCH_ERROR_ZOOM
+from timvt.layer import Function, Table
+from timvt.metrics import TileMetrics
+from timvt.occupancy import TileOccupancy, TileOccupancyIndexes
 
 
 def test_tilejson(app):
@@ -70,6 +85,87 @@ def test_tile(app):
     assert response.status_code == 404
 
 
+def test_tile_occupancy(app):
+    """Known empty tiles should return 204 without querying the database."""
+    tms = morecantile.tms.get("WebMercatorQuad")
+    indexes = app.app.state.tile_occupancy
+    app.app.state.tile_occupancy = {
+        "public.landsat_wrs": TileOccupancy(tms, 1, {(0, 0)}, "geom")
+    }
+    try:
+        response = app.get("/tiles/public.landsat_wrs/1/0/0")
+        assert response.status_code == 200
+
+        response = app.get("/tiles/public.landsat_wrs/1/1/1")
+        assert response.status_code == 204
+        assert not response.content
+
+        response = app.get("/tiles/public.landsat_wrs/5/31/31")
+        assert response.status_code == 204
+
+        # The index is only used for its TMS
+        response = app.get("/tiles/WorldCRS84Quad/public.landsat_wrs/1/1/0")
+        assert response.status_code == 200
+
+    finally:
+        app.app.state.tile_occupancy = indexes
+
+
+async def _occupancy_index(pool, table, tms):
+    indexes = TileOccupancyIndexes(
+        pool, tms, {"public_landsat_wrs": {"occupancy_zoom": 2}}
+    )
+    assert indexes.index(table) is None
+    await asyncio.gather(*indexes._tasks.values())
+    index = indexes.index(table)
+
+    # Tables reloaded by the catalog get a new index
+    assert indexes.index(table.copy()) is None
+    await indexes.close()
+    return index
+
+
+def test_tile_occupancy_lazy(app, run_with_pool):
+    """Occupancy indexes should be created on the tables' first request."""
+    table = app.app.state.table_catalog["public.landsat_wrs"]
+    tms = morecantile.tms.get("WebMercatorQuad")
+    index = run_with_pool(_occupancy_index, table, tms)
+    assert index is not None
+    assert index.zoom == 2
+    assert len(index)
+
+
+def test_tile_table_config(app):
+    """Test simplification, min area and feature priority options."""
+    catalog = app.app.state.table_catalog
+    table = catalog["public.landsat_wrs"]
+
+    response = app.get("/tiles/public.landsat_wrs/0/0/0")
+    full_size = len(response.content)
+
+    try:
+        catalog["public.landsat_wrs"] = table.copy(update={"simplify": 4.0})
+        response = app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert response.status_code == 200
+        decoded = mapbox_vector_tile.decode(response.content)
+        assert len(decoded["default"]["features"]) == 10000
+        assert len(response.content) < full_size
+
+        catalog["public.landsat_wrs"] = table.copy(update={"order_by": "-pr"})
+        response = app.get("/tiles/public.landsat_wrs/0/0/0?limit=10")
+        decoded = mapbox_vector_tile.decode(response.content)
+        prs = [f["properties"]["pr"] for f in decoded["default"]["features"]]
+        assert prs == sorted(prs, reverse=True)
+
+        # Landsat scenes are smaller than 1000x1000 pixels at zoom 0
+        catalog["public.landsat_wrs"] = table.copy(update={"min_area": 1000000.0})
+        response = app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert response.status_code == 204
+
+    finally:
+        catalog["public.landsat_wrs"] = table
+
+
 def test_tile_tms(app):
     """request a tile with specific TMS."""
     response = app.get("/tiles/WorldCRS84Quad/public.landsat_wrs/0/0/0")
@@ -132,3 +228,429 @@ def test_function_tile(app):
     assert response.status_code == 200
     decoded = mapbox_vector_tile.decode(response.content)
     assert len(decoded["default"]["features"]) == 16
+
+
+async def _function_tiles(pool, functions, tile, tms):
+    return [await function.get_tile(pool, tile, tms) for function in functions]
+
+
+def test_function_same_name(app, run_with_pool):
+    """Function layers with the same function name should not share their function."""
+    squares = app.app.state.timvt_function_catalog.get("squares")
+    # Same function, with 3x3 squares by default
+    squares3 = Function(
+        id="squares3",
+        sql=squares.sql.replace("'depth')::int, 2)", "'depth')::int, 3)"),
+        function_name="squares",
+    )
+    tms = morecantile.tms.get("WebMercatorQuad")
+    tiles = run_with_pool(
+        _function_tiles, [squares, squares3, squares], morecantile.Tile(0, 0, 0), tms
+    )
+    features = [len(mapbox_vector_tile.decode(t)["default"]["features"]) for t in tiles]
+    assert features == [4, 9, 4]
+
+
+async def _prepared_statements(pool, table, requests, tms):
+    for tile, kwargs in requests:
+        await table.get_tile(pool, tile, tms, **kwargs)
+
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT count(*) FROM pg_prepared_statements WHERE statement LIKE $1",
+            f"%FROM {table.id} t%",
+        )
+
+
+def test_tile_prepared_statements(app, run_with_pool):
+    """Tile queries with the same SQL should reuse the connection's prepared statement."""
+    table = app.app.state.table_catalog["public.landsat_wrs"]
+    tms = morecantile.tms.get("WebMercatorQuad")
+    count = run_with_pool(
+        _prepared_statements,
+        table,
+        [
+            (morecantile.Tile(0, 0, 0), {}),
+            (morecantile.Tile(1, 0, 1), {"layer_name": "landsat"}),
+            (morecantile.Tile(1, 1, 1), {"limit": "10"}),
+        ],
+        tms,
+    )
+    assert count == 1
+
+    count = run_with_pool(
+        _prepared_statements,
+        table,
+        [
+            (morecantile.Tile(0, 0, 0), {}),
+            (morecantile.Tile(0, 0, 0), {"columns": "path"}),
+            (morecantile.Tile(0, 0, 0), {"columns": "row"}),
+        ],
+        tms,
+    )
+    assert count == 3
+
+
+def test_multilayers_tile(app):
+    """request a tile with multiple layers."""
+    response = app.get("/tiles/public.landsat_wrs,squares/0/0/0?limit=10")
+    assert response.status_code == 200
+    decoded = mapbox_vector_tile.decode(response.content)
+    assert sorted(decoded) == ["default", "public.landsat_wrs"]
+    assert len(decoded["public.landsat_wrs"]["features"]) == 10
+    assert len(decoded["default"]["features"]) == 4
+
+    response = app.get("/tiles/WorldCRS84Quad/public.landsat_wrs,squares/0/0/0")
+    assert response.status_code == 200
+    decoded = mapbox_vector_tile.decode(response.content)
+    assert sorted(decoded) == ["default", "public.landsat_wrs"]
+
+    response = app.get("/tiles/public.landsat_wrs,public.notatable/0/0/0")
+    assert response.status_code == 404
+
+    # Function tiles would have the same MVT layer name
+    response = app.get("/tiles/squares,squares2/0/0/0")
+    assert response.status_code == 400
+
+    response = app.get("/tiles/public.landsat_wrs,public.landsat_wrs/0/0/0")
+    assert response.status_code == 400
+
+    # MVT layer names are not query parameters
+    response = app.get("/tiles/public.landsat_wrs,squares/0/0/0?layer_name=a&limit=1")
+    decoded = mapbox_vector_tile.decode(response.content)
+    assert sorted(decoded) == ["default", "public.landsat_wrs"]
+
+    response = app.get("/tiles/public.landsat_wrs/0/0/0?layer_name=a&limit=1")
+    assert list(mapbox_vector_tile.decode(response.content)) == ["default"]
+
+
+def _parse_batch(content):
+    """Split batch response in tiles."""
+    tiles = {}
+    offset = 0
+    while offset < len(content):
+        z, x, y, length = struct.unpack(">IIII", content[offset : offset + 16])
+        offset += 16
+        tiles[f"{z}/{x}/{y}"] = content[offset : offset + length]
+        offset += length
+
+    return tiles
+
+
+def test_tiles_batch(app):
+    """request multiple tiles at once."""
+    body = {"tiles": ["0/0/0", "1/0/0", "1/1/1"]}
+
+    response = app.post("/tiles/public.landsat_wrs/batch?limit=10", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.timvt.tile-batch"
+    tiles = _parse_batch(response.content)
+    assert sorted(tiles) == sorted(body["tiles"])
+    for content in tiles.values():
+        decoded = mapbox_vector_tile.decode(content)
+        assert len(decoded["default"]["features"]) == 10
+
+    # Same tile as the `tile` endpoint
+    response = app.get("/tiles/public.landsat_wrs/1/1/1?limit=10")
+    assert response.content == tiles["1/1/1"]
+
+    response = app.post("/tiles/WorldCRS84Quad/squares/batch?depth=4", json=body)
+    assert response.status_code == 200
+    tiles = _parse_batch(response.content)
+    assert sorted(tiles) == sorted(body["tiles"])
+    for content in tiles.values():
+        decoded = mapbox_vector_tile.decode(content)
+        assert len(decoded["default"]["features"]) == 16
+
+    response = app.post("/tiles/squares/batch", json={"tiles": ["0/a/0"]})
+    assert response.status_code == 422
+
+    response = app.post("/tiles/squares/batch", json={"tiles": []})
+    assert response.status_code == 422
+
+
+async def _table_index(pool):
+    return await get_table_index(pool, tables=["landsat_wrs"])
+
+
+def test_tile_transformed_geometry(app, execute, run_with_pool):
+    """Tiles should use geometries already in TMS's CRS."""
+    catalog = app.app.state.table_catalog
+    table = catalog["public.landsat_wrs"]
+
+    response = app.get("/tiles/public.landsat_wrs/1/0/0?limit=10")
+    assert response.status_code == 200
+    default = mapbox_vector_tile.decode(response.content)
+
+    # Expression index
+    execute(
+        "CREATE INDEX landsat_wrs_geom_3857 ON public.landsat_wrs USING GIST (ST_Transform(geom, 3857))"
+    )
+    try:
+        index = run_with_pool(_table_index)
+        assert index["public.landsat_wrs"]["geometry_column"]["transforms"] == {
+            3857: None
+        }
+        catalog["public.landsat_wrs"] = Table(**index["public.landsat_wrs"])
+
+        response = app.get("/tiles/public.landsat_wrs/1/0/0?limit=10")
+        assert response.status_code == 200
+        decoded = mapbox_vector_tile.decode(response.content)
+        assert len(decoded["default"]["features"]) == len(
+            default["default"]["features"]
+        )
+
+        # Generated column
+        execute(
+            "ALTER TABLE public.landsat_wrs ADD COLUMN geom_3857 geometry GENERATED ALWAYS AS (ST_Transform(geom, 3857)) STORED"
+        )
+        index = run_with_pool(_table_index)
+        assert index["public.landsat_wrs"]["geometry_column"]["transforms"] == {
+            3857: "geom_3857"
+        }
+        catalog["public.landsat_wrs"] = Table(**index["public.landsat_wrs"])
+
+        response = app.get("/tiles/public.landsat_wrs/1/0/0?limit=10&columns=pr,row")
+        assert response.status_code == 200
+        decoded = mapbox_vector_tile.decode(response.content)
+        assert len(decoded["default"]["features"]) == 10
+
+    finally:
+        catalog["public.landsat_wrs"] = table
+        execute(
+            "DROP INDEX IF EXISTS public.landsat_wrs_geom_3857",
+            "ALTER TABLE public.landsat_wrs DROP COLUMN IF EXISTS geom_3857",
+        )
+
+
+def test_tile_etag(app):
+    """Test ETag and conditional requests."""
+    response = app.get("/tiles/public.landsat_wrs/0/0/0")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = app.get(
+        "/tiles/public.landsat_wrs/0/0/0", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert not response.content
+
+    response = app.get(
+        "/tiles/public.landsat_wrs/0/0/0?limit=1", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    # ETags from the table's version
+    state = app.app.state
+    versions, cache = state.table_versions, state.tile_cache
+    app.app.state.table_versions = TableVersions({"public.landsat_wrs": "1"})
+    try:
+        response = app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert etag.startswith('"v-')
+
+        response = app.get(
+            "/tiles/public.landsat_wrs/0/0/0", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+
+        app.app.state.table_versions.bump("public.landsat_wrs")
+        response = app.get(
+            "/tiles/public.landsat_wrs/0/0/0", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+        # Function layers have no version
+        response = app.get("/tiles/public.landsat_wrs,squares/0/0/0")
+        assert response.status_code == 200
+        assert not response.headers["etag"].startswith('"v-')
+
+        # Cached tiles are not served under a new version
+        app.app.state.tile_cache = MemoryCache()
+        app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert len(app.app.state.tile_cache) == 1
+        app.app.state.table_versions.bump("public.landsat_wrs")
+        app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert len(app.app.state.tile_cache) == 2
+
+    finally:
+        state.table_versions, state.tile_cache = versions, cache
+
+
+def test_tile_compressed_cache(app):
+    """Cached tiles should be stored compressed and sent without re-compression."""
+    cache = MemoryCache()
+    cache.encoding = "br"
+    tile_cache = app.app.state.tile_cache
+    app.app.state.tile_cache = cache
+    try:
+        response = app.get(
+            "/tiles/public.landsat_wrs/0/0/0", headers={"Accept-Encoding": "br"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "br"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"].endswith('-br"')
+
+        (key,) = list(cache._data)
+        assert key.startswith("public.landsat_wrs/WebMercatorQuad/0/0/0?%40version=")
+        cached = asyncio.run(cache.get(key))
+        decoded = mapbox_vector_tile.decode(decompress(cached, "br"))
+        assert len(decoded["default"]["features"]) == 10000
+
+        # Decompressed when the client doesn't accept the cache's encoding
+        response = app.get(
+            "/tiles/public.landsat_wrs/0/0/0", headers={"Accept-Encoding": "identity"}
+        )
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        decoded = mapbox_vector_tile.decode(response.content)
+        assert len(decoded["default"]["features"]) == 10000
+
+        # Batch tiles are uncompressed
+        response = app.post(
+            "/tiles/public.landsat_wrs/batch", json={"tiles": ["0/0/0"]}
+        )
+        assert response.status_code == 200
+        assert mapbox_vector_tile.decode(response.content[16:])
+
+    finally:
+        app.app.state.tile_cache = tile_cache
+
+
+def test_tile_timeout(app):
+    """Tiles exceeding the layer's time budget should be empty and not cached."""
+    catalog = app.app.state.table_catalog
+    table = catalog["public.landsat_wrs"]
+    catalog["public.landsat_wrs"] = table.copy(update={"statement_timeout": 0.0001})
+    try:
+        response = app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert response.status_code == 204
+        assert response.headers["x-tile-timeout"] == "public.landsat_wrs"
+        assert response.headers["cache-control"] == "no-store"
+        assert "etag" not in response.headers
+
+        # Partial tile without the layer exceeding its budget
+        response = app.get("/tiles/public.landsat_wrs,squares/0/0/0")
+        assert response.status_code == 200
+        assert response.headers["x-tile-timeout"] == "public.landsat_wrs"
+        decoded = mapbox_vector_tile.decode(response.content)
+        assert list(decoded) == ["default"]
+
+        # Incomplete batches end with an error record
+        response = app.post(
+            "/tiles/public.landsat_wrs/batch", json={"tiles": ["0/0/0", "1/0/0"]}
+        )
+        assert response.status_code == 200
+        tiles = _parse_batch(response.content)
+        assert list(tiles) == [f"{BATCH_ERROR_ZOOM}/0/0"]
+        assert b"time budget" in tiles[f"{BATCH_ERROR_ZOOM}/0/0"]
+
+    finally:
+        catalog["public.landsat_wrs"] = table
+
+    response = app.get("/tiles/public.landsat_wrs/0/0/0")
+    assert response.status_code == 200
+    assert "x-tile-timeout" not in response.headers
+
+
+def test_tile_admission(app):
+    """Tile queries exceeding the layer's limits should be rejected."""
+    admission = app.app.state.admission
+    app.app.state.admission = AdmissionController(
+        layers={"public.landsat_wrs": 0}, max_queue=0, retry_after=5
+    )
+    try:
+        response = app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+
+        # Other layers are not limited
+        response = app.get("/tiles/squares/0/0/0")
+        assert response.status_code == 200
+
+        stats = app.app.state.admission.stats
+        assert stats["public.landsat_wrs"]["z0+"]["rejected"] == 1
+        assert stats["squares"]["z0+"]["admitted"] == 1
+
+    finally:
+        app.app.state.admission = admission
+
+
+def test_tile_metrics(app):
+    """Tile rendering stages and tiles should be recorded in the metrics."""
+    pytest.importorskip("prometheus_client")
+
+    metrics, app_metrics = TileMetrics(app.app), app.app.state.metrics
+    app.app.state.metrics = metrics
+    try:
+        response = app.get("/tiles/public.landsat_wrs/0/0/0")
+        assert response.status_code == 200
+
+        labels = {"layer": "public.landsat_wrs", "tms": "WebMercatorQuad", "zoom": "0"}
+        for stage in ["admission_wait", "pool_wait", "query", "render"]:
+            assert metrics.registry.get_sample_value(
+                "timvt_tile_stage_duration_seconds_count", {"stage": stage, **labels}
+            )
+
+        assert metrics.registry.get_sample_value(
+            "timvt_tiles_total", {"source": "rendered", "empty": "false", **labels}
+        )
+        assert metrics.registry.get_sample_value(
+            "timvt_tile_size_bytes_sum", labels
+        ) == len(response.content)
+        assert metrics.registry.get_sample_value(
+            "timvt_db_pool_connections", {"pool": "primary", "state": "max"}
+        )
+
+    finally:
+        app.app.state.metrics = app_metrics
+
+
+def test_tile_debug(app):
+    """Debug requests should get the tile rendering phases and query plans."""
+    response = app.get("/tiles/public.landsat_wrs/0/0/0")
+    assert response.status_code == 200
+    assert "query" not in response.headers["Server-Timing"]
+
+    response = app.get("/tiles/public.landsat_wrs/0/0/0/explain")
+    assert response.status_code == 403
+
+    token = app.app.state.debug_token
+    app.app.state.debug_token = "secret"
+    try:
+        headers = {"X-Debug-Token": "secret", "Accept-Encoding": "gzip"}
+        response = app.get("/tiles/public.landsat_wrs/0/0/0", headers=headers)
+        assert response.status_code == 200
+        timings = response.headers["Server-Timing"]
+        for phase in ["pool_wait", "query", "render", "compress"]:
+            assert f"{phase};" in timings
+        assert 'desc="public.landsat_wrs"' in timings
+
+        # Wrong token
+        response = app.get(
+            "/tiles/public.landsat_wrs/0/0/0/explain",
+            headers={"X-Debug-Token": "nope"},
+        )
+        assert response.status_code == 403
+
+        response = app.get("/tiles/public.landsat_wrs/0/0/0/explain", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "no-store"
+        body = response.json()
+        assert body["layer"] == "public.landsat_wrs"
+        assert body["tile"] == {"z": 0, "x": 0, "y": 0}
+        assert "ST_AsMVT" in body["query"]
+        assert body["plan"][0]["Plan"]
+        assert "Execution Time" in body["plan"][0]
+
+        response = app.get("/tiles/squares/0/0/0/explain", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["plan"][0]["Plan"]
+
+    finally:
+        app.app.state.debug_token = token
@@ -0,0 +1,107 @@
+"""Test timvt.admission."""
+
+import asyncio
+
+import pytest
+
+from timvt.admission import AdmissionController, Limiter
+from timvt.errors import DEFAULT_STATUS_CODES, TileOverloaded, add_exception_handlers
+
+from fastapi import FastAPI
+
+from starlette.testclient import TestClient
+
+
+@pytest.mark.asyncio
+async def test_limiter():
+    """Callers should wait for a slot and be rejected when the queue is full."""
+    limiter = Limiter(max_concurrency=1, max_queue=1, queue_timeout=1)
+    order = []
+
+    async def work(name):
+        await limiter.acquire()
+        try:
+            order.append(name)
+            await asyncio.sleep(0.05)
+        finally:
+            limiter.release()
+
+    results = await asyncio.gather(
+        work("a"), work("b"), work("c"), return_exceptions=True
+    )
+    assert order == ["a", "b"]
+    assert isinstance(results[2], TileOverloaded)
+    assert limiter.stats["active"] == 0
+    assert limiter.stats["waiting"] == 0
+    assert limiter.stats["admitted"] == 2
+    assert limiter.stats["rejected"] == 1
+    assert limiter.stats["wait_time_max"] > 0.01
+
+    # Waiting for too long
+    limiter = Limiter(max_concurrency=1, max_queue=10, queue_timeout=0.01)
+    results = await asyncio.gather(work("a"), work("b"), return_exceptions=True)
+    assert isinstance(results[1], TileOverloaded)
+    assert limiter.active == 0
+
+    # Cancelled waiters don't hold a slot
+    limiter = Limiter(max_concurrency=1, max_queue=10, queue_timeout=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.sleep(0.01)
+    limiter.release()
+    assert limiter.active == 0
+    assert limiter.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_controller():
+    """Layers and zoom bands should have their own limits."""
+    admission = AdmissionController(
+        max_concurrency=1,
+        layers={"heavy": 2},
+        zoom_bands=[0, 8, 14],
+        max_queue=0,
+        retry_after=3,
+    )
+    assert admission.band(0) == 0
+    assert admission.band(7) == 0
+    assert admission.band(8) == 1
+    assert admission.band(20) == 2
+    assert admission.band_name(0) == "z0-7"
+    assert admission.band_name(2) == "z14+"
+
+    async with admission.admit("basemap", 3):
+        # Other zoom bands and layers are not limited
+        async with admission.admit("basemap", 10), admission.admit("heavy", 3):
+            pass
+
+        with pytest.raises(TileOverloaded) as exc:
+            async with admission.admit("basemap", 4):
+                pass
+        assert exc.value.retry_after == 3
+
+    async with admission.admit("heavy", 3), admission.admit("heavy", 3):
+        pass
+
+    stats = admission.stats
+    assert list(stats) == ["basemap", "heavy"]
+    assert stats["basemap"]["z0-7"]["admitted"] == 1
+    assert stats["basemap"]["z0-7"]["rejected"] == 1
+    assert stats["basemap"]["z8-13"]["admitted"] == 1
+    assert stats["heavy"]["z0-7"]["admitted"] == 3
+
+
+def test_overloaded_response():
+    """Rejected requests should get a 503 response with a Retry-After header."""
+    app = FastAPI()
+    add_exception_handlers(app, DEFAULT_STATUS_CODES)
+
+    @app.get("/tile")
+    def tile():
+        raise TileOverloaded("overloaded", retry_after=2)
+
+    response = TestClient(app).get("/tile")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
@@ -0,0 +1,143 @@
+"""Test timvt.bench."""
+
+import random
+
+import morecantile
+import pytest
+
+from timvt.bench import (
+    Sample,
+    TileRange,
+    compare,
+    pan_pattern,
+    parse_server_timing,
+    percentile,
+    run_scenario,
+    summarize,
+    zipf_pattern,
+    zoom_pattern,
+)
+
+from fastapi import FastAPI, Response
+
+tms = morecantile.tms.get("WebMercatorQuad")
+
+
+def test_patterns():
+    """Access patterns should be reproducible tiles within the range."""
+    tiles = TileRange(tms, [-10, -10, 10, 10], 2, 6)
+
+    for pattern in [pan_pattern, zoom_pattern, zipf_pattern]:
+        requests = pattern(tiles, 50, random.Random(1))
+        assert len(requests) == 50
+        assert requests == pattern(tiles, 50, random.Random(1))
+        for tile in requests:
+            minx, maxx, miny, maxy = tiles.bounds(tile.z)
+            assert 2 <= tile.z <= 6
+            assert minx <= tile.x <= maxx and miny <= tile.y <= maxy
+
+    # Panning viewports only request the new tiles
+    requests = pan_pattern(
+        TileRange(tms, [-10, -10, 10, 10], 8, 8), 24, random.Random(1), (4, 3)
+    )
+    assert len(set(requests)) == 24
+
+    # Zooming in from minzoom to maxzoom
+    requests = zoom_pattern(tiles, 5, random.Random(1), viewport=(1, 1))
+    assert [tile.z for tile in requests] == [2, 3, 4, 5, 6]
+    assert morecantile.Tile(requests[-1].x // 4, requests[-1].y // 4, 4) == requests[2]
+
+    # The most popular tiles are requested more often
+    requests = zipf_pattern(tiles, 1000, random.Random(1), population=100)
+    counts = sorted([requests.count(tile) for tile in set(requests)], reverse=True)
+    assert counts[0] > 10 * counts[-1]
+
+
+def test_percentile():
+    """Percentiles should be interpolated."""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50.5
+    assert percentile(values, 99) == pytest.approx(99.01)
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_summarize():
+    """Samples should be summarized with latencies in ms and server timings."""
+    samples = [
+        Sample(200, 0.010, 100, parse_server_timing('pool_wait;desc="a";dur=1.0')),
+        Sample(204, 0.020, 0, parse_server_timing('pool_wait;desc="a";dur=3.0')),
+        Sample(503, 0.001),
+        Sample(None, 0.5),
+    ]
+    summary = summarize(samples, duration=1.0)
+    assert summary["requests"] == 4
+    assert summary["errors"] == 2
+    assert summary["statuses"] == {"200": 1, "204": 1, "503": 1, "error": 1}
+    assert summary["throughput"] == 3.0
+    assert summary["bytes"] == 100
+    assert summary["latency"]["max"] == 20.0
+    assert summary["timings"]["pool_wait"]["mean"] == 2.0
+
+
+def test_parse_server_timing():
+    """Durations of the same metric should be summed."""
+    timings = parse_server_timing(
+        'pool_wait;desc="a";dur=0.5, query;desc="a";dur=4.0, '
+        'query;desc="b";dur=1.0, total;dur=7.2, invalid'
+    )
+    assert timings == {"pool_wait": 0.5, "query": 5.0, "total": 7.2}
+    assert parse_server_timing(None) == {}
+
+
+def test_compare():
+    """Scenarios with a latency increase above the threshold are regressions."""
+
+    def result(pattern, p95):
+        return {
+            "layer": "public.landsat_wrs",
+            "tms": "WebMercatorQuad",
+            "pattern": pattern,
+            "concurrency": 8,
+            "latency": {"p95": p95},
+        }
+
+    comparison = compare(
+        [result("pan", 10.0), result("zipf", 10.0)],
+        [result("pan", 10.5), result("zipf", 15.0), result("zoom", 1.0)],
+        max_regression=0.1,
+    )
+    assert [(row["pattern"], row["regression"]) for row in comparison] == [
+        ("pan", False),
+        ("zipf", True),
+    ]
+    assert comparison[1]["change"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_run_scenario():
+    """Concurrent clients should request their tiles."""
+    httpx = pytest.importorskip("httpx")
+
+    app = FastAPI()
+    requested = []
+
+    @app.get("/tiles/{TileMatrixSetId}/{layer}/{z}/{x}/{y}")
+    def tile(TileMatrixSetId: str, layer: str, z: int, x: int, y: int):
+        requested.append((TileMatrixSetId, layer, z, x, y))
+        if x % 2:
+            return Response(status_code=204)
+        return Response(
+            b"tile", headers={"Server-Timing": f'query;desc="{layer}";dur=2.0'}
+        )
+
+    tiles = TileRange(tms, [-10, -10, 10, 10], 4, 4)
+    requests = [pan_pattern(tiles, 10, random.Random(i)) for i in range(3)]
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        summary = await run_scenario(client, "squares", tms, requests)
+
+    assert len(requested) == 30
+    assert requested[0][:2] == ("WebMercatorQuad", "squares")
+    assert summary["requests"] == 30
+    assert summary["errors"] == 0
+    assert set(summary["statuses"]) <= {"200", "204"}
+    assert summary["timings"]["query"]["p50"] == 2.0
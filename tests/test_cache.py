@@ -0,0 +1,193 @@
+"""Test timvt.cache."""
+
+import time
+
+import pytest
+from morecantile import Tile
+
+from timvt.cache import (
+    FileCache,
+    MemoryCache,
+    RedisCache,
+    create_tile_cache,
+    tile_cache_key,
+)
+from timvt.settings import CacheSettings
+
+
+def test_cache_key():
+    """Query parameters order should not change the key."""
+    tile = Tile(1, 2, 3)
+    assert tile_cache_key("layer", "WebMercatorQuad", tile) == (
+        "layer/WebMercatorQuad/3/1/2"
+    )
+    assert tile_cache_key(
+        "layer", "WebMercatorQuad", tile, limit="10", columns="a,b"
+    ) == tile_cache_key("layer", "WebMercatorQuad", tile, columns="a,b", limit="10")
+    assert tile_cache_key("layer", "WebMercatorQuad", tile, v=["1", "2"]).endswith(
+        "?v=1&v=2"
+    )
+
+
+@pytest.mark.asyncio
+async def test_memory_cache():
+    """Test MemoryCache LRU and TTL."""
+    cache = MemoryCache(max_size=10)
+    await cache.set("a", b"12345")
+    await cache.set("b", b"12345")
+    assert await cache.get("a") == b"12345"
+    assert cache.size == 10
+
+    # `b` is the least recently used entry
+    await cache.set("c", b"1")
+    assert await cache.get("b") is None
+    assert await cache.get("a") == b"12345"
+    assert cache.size == 6
+
+    # too big
+    await cache.set("d", b"12345678910")
+    assert await cache.get("d") is None
+
+    await cache.delete("a")
+    assert await cache.get("a") is None
+
+    await cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+    cache = MemoryCache(ttl=1)
+    await cache.set("a", b"1")
+    assert await cache.get("a") == b"1"
+    cache._data["a"] = (time.monotonic() - 1, b"1")
+    assert await cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_file_cache(tmp_path):
+    """Test FileCache."""
+    cache = FileCache(str(tmp_path))
+    key = tile_cache_key("layer", "WebMercatorQuad", Tile(0, 0, 0), limit="1")
+    assert await cache.get(key) is None
+
+    await cache.set(key, b"tile")
+    assert await cache.get(key) == b"tile"
+    assert (tmp_path / "layer" / "WebMercatorQuad" / "0" / "0" / "0").exists()
+
+    await cache.delete(key)
+    assert await cache.get(key) is None
+
+    await cache.set(key, b"tile")
+    await cache.clear()
+    assert await cache.get(key) is None
+
+
+@pytest.mark.asyncio
+async def test_redis_cache():
+    """Test RedisCache against a fake redis server."""
+    fakeredis = pytest.importorskip("fakeredis")
+
+    cache = RedisCache(client=fakeredis.aioredis.FakeRedis(), ttl=60)
+    assert await cache.get("a") is None
+
+    await cache.set("a", b"tile")
+    assert await cache.get("a") == b"tile"
+
+    await cache.delete("a")
+    assert await cache.get("a") is None
+
+    await cache.set("a", b"tile")
+    await cache.clear()
+    assert await cache.get("a") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "file", "redis"])
+async def test_cache_delete_tiles(backend, tmp_path):
+    """Test removing tiles of a layer, for all query parameters."""
+    if backend == "memory":
+        cache = MemoryCache()
+    elif backend == "file":
+        cache = FileCache(str(tmp_path))
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        cache = RedisCache(client=fakeredis.aioredis.FakeRedis())
+
+    keys = [
+        tile_cache_key("layer", "WebMercatorQuad", Tile(0, 0, 1)),
+        tile_cache_key("layer", "WebMercatorQuad", Tile(0, 0, 1), limit="1"),
+        tile_cache_key("layer", "WebMercatorQuad", Tile(1, 0, 1)),
+        tile_cache_key("layer", "WorldCRS84Quad", Tile(0, 0, 1)),
+        tile_cache_key("layer2", "WebMercatorQuad", Tile(0, 0, 1)),
+    ]
+    for key in keys:
+        await cache.set(key, b"tile")
+
+    await cache.delete_tiles("layer", "WebMercatorQuad", [Tile(0, 0, 1)])
+    assert [await cache.get(key) for key in keys] == [
+        None,
+        None,
+        b"tile",
+        b"tile",
+        b"tile",
+    ]
+
+    await cache.delete_tiles("layer", "WebMercatorQuad")
+    assert [await cache.get(key) for key in keys] == [
+        None,
+        None,
+        None,
+        b"tile",
+        b"tile",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "file", "redis"])
+async def test_cache_delete_zooms(backend, tmp_path):
+    """Test removing the tiles of a layer at some zoom levels."""
+    if backend == "memory":
+        cache = MemoryCache()
+    elif backend == "file":
+        cache = FileCache(str(tmp_path))
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        cache = RedisCache(client=fakeredis.aioredis.FakeRedis())
+
+        # Tiles are removed without scanning the keys
+        def scan_iter(*args, **kwargs):
+            raise AssertionError("scan")
+
+        cache.client.scan_iter = scan_iter
+
+    keys = [
+        tile_cache_key("layer", "WebMercatorQuad", Tile(0, 0, 1)),
+        tile_cache_key("layer", "WebMercatorQuad", Tile(0, 0, 18), limit="1"),
+        tile_cache_key("layer", "WebMercatorQuad", Tile(5, 0, 20)),
+        tile_cache_key("layer2", "WebMercatorQuad", Tile(0, 0, 18)),
+    ]
+    for key in keys:
+        await cache.set(key, b"tile")
+
+    await cache.delete_zooms("layer", "WebMercatorQuad", range(17, 31))
+    assert [await cache.get(key) for key in keys] == [b"tile", None, None, b"tile"]
+
+    await cache.set(keys[1], b"tile")
+    await cache.delete_tiles("layer", "WebMercatorQuad")
+    assert [await cache.get(key) for key in keys] == [None, None, None, b"tile"]
+
+
+def test_create_tile_cache(monkeypatch):
+    """Tiles should be cached with the configured encoding."""
+    assert create_tile_cache(CacheSettings()) is None
+
+    cache = create_tile_cache(CacheSettings(backend="memory"))
+    assert isinstance(cache, MemoryCache)
+    assert cache.encoding == "gzip"
+
+    monkeypatch.setenv("TIMVT_CACHE_ENCODING", "none")
+    cache = create_tile_cache(CacheSettings(backend="memory"))
+    assert cache.encoding is None
+
+    monkeypatch.setenv("TIMVT_CACHE_ENCODING", "zstd")
+    cache = create_tile_cache(CacheSettings(backend="memory"))
+    assert cache.encoding == "zstd"
@@ -0,0 +1,58 @@
+"""Test timvt.catalog."""
+
+import pytest
+
+from timvt.catalog import TableCatalog
+
+
+def _catalog(**kwargs):
+    catalog = TableCatalog(None, **kwargs)
+    catalog.loaded = []
+
+    async def load(table_ids):
+        catalog.loaded.extend(table_ids)
+        catalog._remove(table_ids)
+
+    catalog.load = load
+    return catalog
+
+
+@pytest.mark.asyncio
+async def test_catalog_lookup():
+    """Only the tables of the catalog's schemas and tables should be looked up."""
+    catalog = _catalog(schemas=["public", "My Schema"], tables=None)
+    assert await catalog.get_table("public.countries") is None
+    assert await catalog.get_table('"My Schema"."Countries"') is None
+    assert await catalog.get_table("private.countries") is None
+    assert await catalog.get_table("countries") is None
+    assert catalog.loaded == ["public.countries", '"My Schema"."Countries"']
+
+    # Not found tables are not looked up again
+    assert await catalog.get_table("public.countries") is None
+    assert len(catalog.loaded) == 2
+
+    catalog = _catalog(tables=["countries"])
+    assert await catalog.get_table("public.cities") is None
+    assert catalog.loaded == []
+
+    catalog = _catalog(lookup=False)
+    assert await catalog.get_table("public.countries") is None
+    assert catalog.loaded == []
+
+
+@pytest.mark.asyncio
+async def test_catalog_missing():
+    """Tables not found should be forgotten when expired or when too many."""
+    catalog = _catalog(max_missing=2)
+    for name in ["a", "b", "c"]:
+        await catalog.get_table(f"public.{name}")
+    assert list(catalog._missing) == ["public.b", "public.c"]
+
+    catalog = _catalog(missing_ttl=0)
+    for name in ["a", "b", "c"]:
+        await catalog.get_table(f"public.{name}")
+    assert not catalog._missing
+
+    # Expired tables are looked up again
+    await catalog.get_table("public.a")
+    assert catalog.loaded.count("public.a") == 2
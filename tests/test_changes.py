@@ -0,0 +1,227 @@
+"""Test timvt.changes."""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+
+import morecantile
+import pytest
+
+from timvt.cache import MemoryCache, tile_cache_key
+from timvt.changes import (
+    ApplicationSink,
+    CallbackSink,
+    ChangeTracker,
+    HTTPSink,
+    Invalidation,
+    LogFileSink,
+)
+from timvt.etag import TableVersions
+from timvt.occupancy import TileOccupancy
+
+from starlette.datastructures import State
+
+tms = morecantile.tms.get("WebMercatorQuad")
+
+
+def test_tracker_tiles():
+    """Bounding boxes should be mapped to the tiles at each zoom level."""
+    tracker = ChangeTracker([tms], [], minzoom=0, maxzoom=2, padding=0)
+    tiles = tracker.tiles([[-10, -10, -5, -5]], tms)
+    assert tiles == [
+        morecantile.Tile(0, 0, 0),
+        morecantile.Tile(0, 1, 1),
+        morecantile.Tile(1, 2, 2),
+    ]
+
+    # Neighbouring tiles
+    tracker = ChangeTracker([tms], [], minzoom=2, maxzoom=2, padding=1)
+    tiles = tracker.tiles([[-10, -10, -5, -5]], tms)
+    assert len(tiles) == 9
+
+    # Outside the TMS
+    assert tracker.tiles([[0, 86, 10, 89]], tms) == []
+
+    # Too many tiles
+    tracker = ChangeTracker([tms], [], minzoom=0, maxzoom=10, max_tiles=100)
+    assert tracker.tiles([[-10, -10, 10, 10]], tms) is None
+
+    # All the tiles
+    invalidations = tracker.invalidations("public.landsat_wrs", None)
+    assert invalidations == [
+        Invalidation("public.landsat_wrs", "WebMercatorQuad", None)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_tracker_handle(tmp_path):
+    """Notifications should be sent to the sinks."""
+    received = []
+    log_file = tmp_path / "tiles.log"
+
+    tracker = ChangeTracker(
+        [tms],
+        [CallbackSink(received.extend), LogFileSink(str(log_file))],
+        minzoom=0,
+        maxzoom=1,
+        padding=0,
+    )
+    await tracker.handle(
+        json.dumps({"table": "public.landsat_wrs", "bboxes": [[-10, -10, -5, -5]]})
+    )
+    await tracker.handle(json.dumps({"table": "public.landsat_wrs", "bboxes": None}))
+
+    assert received[0].tiles == [morecantile.Tile(0, 0, 0), morecantile.Tile(0, 1, 1)]
+    assert received[1].tiles is None
+    assert log_file.read_text().splitlines() == [
+        "public.landsat_wrs WebMercatorQuad 0/0/0",
+        "public.landsat_wrs WebMercatorQuad 1/0/1",
+        "public.landsat_wrs WebMercatorQuad *",
+    ]
+    assert tracker.stats == {
+        "notifications": 2,
+        "invalidations": 2,
+        "tiles": 2,
+        "layers": 1,
+        "errors": 0,
+    }
+
+    # Sink errors are counted
+    tracker.sinks = [HTTPSink("http://127.0.0.1:1/purge", timeout=1)]
+    await tracker.handle(json.dumps({"table": "public.landsat_wrs", "bboxes": None}))
+    assert tracker.stats["errors"] == 1
+
+
+class FakeConnection:
+    """Listening connection, with the tracked tables."""
+
+    def __init__(self):
+        self.termination_listeners = []
+
+    async def add_listener(self, channel, callback):
+        pass
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    def is_closed(self):
+        return False
+
+    async def close(self):
+        pass
+
+    async def fetch(self, query):
+        return [("public.landsat_wrs",)]
+
+
+@pytest.mark.asyncio
+async def test_tracker_reconnect():
+    """All the tiles of the tracked tables should be invalidated after a reconnection."""
+    received = []
+    connections = []
+
+    async def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    tracker = ChangeTracker([tms], [CallbackSink(received.extend)])
+    await tracker.start(connect, retry_interval=0)
+    try:
+        assert not received
+        connection = connections[0]
+        connection.termination_listeners[0](connection)
+        for _ in range(100):
+            if received:
+                break
+            await asyncio.sleep(0.01)
+
+        assert len(connections) == 2
+        assert received == [Invalidation("public.landsat_wrs", tms.identifier, None)]
+        assert tracker.stats["layers"] == 1
+    finally:
+        await tracker.stop()
+
+
+@pytest.mark.asyncio
+async def test_application_sink():
+    """Changes should purge the cached tiles at all zoom levels and update the application's state."""
+    layer = "public.landsat_wrs"
+    state = State()
+    state.tile_cache = MemoryCache()
+    state.table_versions = TableVersions({layer: "1"})
+    state.tile_occupancy = {layer: TileOccupancy(tms, 2, set(), "geom")}
+
+    keys = {
+        tile: tile_cache_key(layer, "WebMercatorQuad", tile)
+        for tile in [
+            morecantile.Tile(0, 1, 1),
+            morecantile.Tile(1, 0, 1),
+            morecantile.Tile(7, 9, 4),
+            morecantile.Tile(0, 0, 18),
+        ]
+    }
+    for key in keys.values():
+        await state.tile_cache.set(key, b"tile")
+
+    tracker = ChangeTracker(
+        [tms],
+        [ApplicationSink(SimpleNamespace(state=state), minzoom=0, maxzoom=1)],
+        minzoom=0,
+        maxzoom=1,
+        padding=0,
+    )
+    await tracker.handle(json.dumps({"table": layer, "bboxes": [[-10, -10, -5, -5]]}))
+
+    # Invalidated tiles and tiles outside of the tracker's zoom levels are removed
+    cached = [tile for tile, key in keys.items() if key in state.tile_cache._data]
+    assert cached == [morecantile.Tile(1, 0, 1)]
+    assert state.table_versions.get(layer) == "1.1"
+    assert not state.tile_occupancy[layer].is_empty(morecantile.Tile(1, 2, 2), tms)
+
+
+@pytest.mark.asyncio
+async def test_http_sink():
+    """Invalidated tiles should be posted to the purge url."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers["Content-Length"])
+            requests.append(json.loads(self.rfile.read(length)))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        sink = HTTPSink(f"http://127.0.0.1:{server.server_port}/purge")
+        await sink.send(
+            [
+                Invalidation(
+                    "public.landsat_wrs", "WebMercatorQuad", [morecantile.Tile(1, 2, 3)]
+                ),
+                Invalidation("public.landsat_wrs", "WorldCRS84Quad", None),
+            ]
+        )
+    finally:
+        server.shutdown()
+
+    assert requests == [
+        [
+            {
+                "layer": "public.landsat_wrs",
+                "tms": "WebMercatorQuad",
+                "tiles": ["3/1/2"],
+            },
+            {"layer": "public.landsat_wrs", "tms": "WorldCRS84Quad", "tiles": None},
+        ]
+    ]
@@ -0,0 +1,155 @@
+"""Test timvt.compression."""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from timvt.compression import (
+    Compressor,
+    compress,
+    create_compressor,
+    decompress,
+    negotiate,
+)
+from timvt.factory import VectorTilerFactory
+from timvt.settings import CompressionSettings
+
+from starlette.datastructures import State
+from starlette.requests import Request
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_compress(encoding):
+    """Compressed data should be decompressed."""
+    data = b"tile" * 100
+    compressed = compress(data, encoding)
+    assert len(compressed) < len(data)
+    assert decompress(compressed, encoding) == data
+
+
+def test_negotiate():
+    """Preferred encodings should be selected from the Accept-Encoding header."""
+    assert negotiate(None) is None
+    assert negotiate("") is None
+    assert negotiate("identity") is None
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("gzip, deflate, br, zstd") == "gzip"
+    assert negotiate("gzip;q=0.5, br") == "br"
+    assert negotiate("gzip;q=0, *") == "br"
+    assert negotiate("GZIP ; q=0.8") == "gzip"
+    assert negotiate("gzip;q=x") is None
+    assert negotiate("gzip, br", encodings=["br"]) == "br"
+    assert negotiate("gzip", encodings=["br"]) is None
+
+
+@pytest.mark.asyncio
+async def test_compressor():
+    """Large data should be compressed in the executor."""
+    compressor = create_compressor(CompressionSettings(offload_threshold=1000))
+    threads = []
+
+    def _compress(data, encoding):
+        threads.append(threading.current_thread().name)
+        return compress(data, encoding)
+
+    assert await compressor.run(10, _compress, b"tile", "gzip")
+    assert await compressor.run(1000, _compress, b"tile", "gzip")
+    assert threads[0] == threading.current_thread().name
+    assert threads[1].startswith("timvt-compression")
+    assert compressor.stats == {"inline": 1, "offloaded": 1}
+
+    data = b"tile" * 1000
+    compressed = await compressor.compress(data, "zstd")
+    assert await compressor.decompress(compressed, "zstd") == data
+    compressor.close()
+
+    # Without executor
+    compressor = create_compressor(CompressionSettings(executor="none"))
+    assert compressor.executor is None
+    assert await compressor.compress(data, "gzip") == compress(data, "gzip")
+    assert compressor.stats == {"inline": 1, "offloaded": 0}
+
+    # Process pool
+    compressor = Compressor(ProcessPoolExecutor(max_workers=1), offload_threshold=0)
+    try:
+        assert await compressor.compress(data, "br") == compress(data, "br")
+    finally:
+        compressor.close()
+
+
+def _request(**headers):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "app": SimpleNamespace(state=State(), debug=False),
+            "headers": [
+                (k.lower().replace("_", "-").encode(), v.encode())
+                for k, v in headers.items()
+            ],
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_tile_response():
+    """Tiles should be sent with the client's preferred encoding."""
+    factory = VectorTilerFactory()
+    tile = b"tile" * 100
+
+    response = await factory.tile_response(_request(), tile)
+    assert response.body == tile
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    etag = response.headers["etag"]
+
+    # Compressed on the fly
+    response = await factory.tile_response(_request(Accept_Encoding="br"), tile)
+    assert response.headers["content-encoding"] == "br"
+    assert decompress(response.body, "br") == tile
+    assert response.headers["etag"] == etag[:-1] + '-br"'
+
+    # Already compressed tiles are sent as is
+    compressed = compress(tile, "gzip")
+    response = await factory.tile_response(
+        _request(Accept_Encoding="gzip, br"), compressed, etag='"v-1"', encoding="gzip"
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.body == compressed
+    assert response.headers["etag"] == '"v-1-gzip"'
+
+    # or decompressed if the client doesn't accept the encoding
+    response = await factory.tile_response(
+        _request(Accept_Encoding="br"), compressed, etag='"v-1"', encoding="gzip"
+    )
+    assert response.headers["content-encoding"] == "br"
+    assert decompress(response.body, "br") == tile
+
+    response = await factory.tile_response(
+        _request(), compressed, etag='"v-1"', encoding="gzip"
+    )
+    assert "content-encoding" not in response.headers
+    assert response.body == tile
+    assert response.headers["etag"] == '"v-1"'
+
+    # Conditional requests
+    response = await factory.tile_response(
+        _request(Accept_Encoding="gzip", If_None_Match='"v-1-gzip"'),
+        compressed,
+        etag='"v-1"',
+        encoding="gzip",
+    )
+    assert response.status_code == 304
+
+    assert factory.not_modified(
+        _request(Accept_Encoding="gzip", If_None_Match='"v-1-gzip"'), '"v-1"'
+    )
+    assert factory.not_modified(_request(If_None_Match='"v-1"'), '"v-1"')
+    assert not factory.not_modified(_request(If_None_Match='"v-1-gzip"'), '"v-1"')
+    assert not factory.not_modified(_request(If_None_Match='"v-1"'), None)
+
+    # Empty tiles
+    assert (await factory.tile_response(_request(), b"")).status_code == 204
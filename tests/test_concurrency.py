@@ -0,0 +1,87 @@
+"""Test timvt.concurrency."""
+
+import asyncio
+
+import pytest
+
+from timvt.concurrency import ClientDisconnected, SingleFlight, cancel_on_disconnect
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    """Concurrent calls with the same key should run once."""
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    flight = SingleFlight()
+    results = await asyncio.gather(
+        *[flight.do("a", lambda: work("a")) for _ in range(10)],
+        flight.do("b", lambda: work("b")),
+    )
+    assert results == ["a"] * 10 + ["b"]
+    assert calls == ["a", "b"]
+    assert len(flight) == 0
+
+    # Once done, a new call runs again
+    assert await flight.do("a", lambda: work("a")) == "a"
+    assert calls == ["a", "b", "a"]
+
+    # Errors are forwarded to all the callers
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("oops")
+
+    with pytest.raises(ValueError):
+        await asyncio.gather(flight.do("c", fail), flight.do("c", fail))
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancel():
+    """The call should be cancelled when all its callers are cancelled."""
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    flight = SingleFlight()
+    callers = [asyncio.ensure_future(flight.do("a", work)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+
+    callers[0].cancel()
+    await asyncio.sleep(0.01)
+    assert not cancelled
+    assert len(flight) == 1
+
+    callers[1].cancel()
+    await asyncio.sleep(0.01)
+    assert cancelled
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect():
+    """Work should be cancelled when the client disconnects."""
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def work(delay):
+        await asyncio.sleep(delay)
+        return delay
+
+    assert await cancel_on_disconnect(receive, work(0.01)) == 0.01
+
+    asyncio.get_running_loop().call_later(0.01, disconnect.set)
+    with pytest.raises(ClientDisconnected):
+        await cancel_on_disconnect(receive, work(10))
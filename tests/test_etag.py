@@ -0,0 +1,89 @@
+"""Test ETags and table versions."""
+
+from types import SimpleNamespace
+
+import morecantile
+
+from timvt.etag import TableVersions, content_etag, if_none_match, version_etag
+from timvt.factory import VectorTilerFactory
+from timvt.layer import Table
+
+from starlette.datastructures import State
+from starlette.requests import Request
+
+
+def test_etags():
+    """Test ETags creation and matching."""
+    etag = content_etag(b"tile")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == content_etag(b"tile")
+    assert etag != content_etag(b"other tile")
+
+    etag = version_etag("1", "public.landsat_wrs/WebMercatorQuad/0/0/0")
+    assert etag.startswith('"v-')
+    assert etag != version_etag("2", "public.landsat_wrs/WebMercatorQuad/0/0/0")
+    assert etag != version_etag("1", "public.landsat_wrs/WebMercatorQuad/1/0/0")
+
+    assert not if_none_match(None, etag)
+    assert not if_none_match('"abc"', etag)
+    assert if_none_match(etag, etag)
+    assert if_none_match(f'"abc", W/{etag}', etag)
+    assert if_none_match("*", etag)
+
+
+def test_table_versions():
+    """Test table versions."""
+    versions = TableVersions({"public.landsat_wrs": "1-10-0-0"})
+    assert versions.get("public.landsat_wrs") == "1-10-0-0"
+    assert versions.get("public.notatable") is None
+
+    versions.bump("public.landsat_wrs")
+    assert versions.get("public.landsat_wrs") == "1-10-0-0.1"
+
+    versions.bump("public.notatable")
+    assert versions.get("public.notatable") is None
+
+
+def test_tile_versions():
+    """Tile ETags and cache keys should change with the table's data and configuration."""
+    geometry_column = {
+        "name": "geom",
+        "type": "geometry",
+        "geometry_type": "POLYGON",
+        "srid": 4326,
+        "bounds": [-10, -10, 10, 10],
+    }
+    table = Table(
+        id="public.countries",
+        table="countries",
+        schema="public",
+        properties=[{"name": "id", "type": "integer"}],
+        geometry_columns=[geometry_column],
+        geometry_column=geometry_column,
+    )
+    simplified = table.copy(update={"simplify": 1.0})
+    assert table.fingerprint == table.copy().fingerprint
+    assert table.fingerprint != simplified.fingerprint
+
+    state = State()
+    state.table_versions = None
+    request = Request({"type": "http", "app": SimpleNamespace(state=state)})
+    factory = VectorTilerFactory()
+    tms = morecantile.tms.get("WebMercatorQuad")
+    tile = morecantile.Tile(0, 0, 0)
+
+    # Unknown versions: no version ETag, cache keys from the configuration
+    assert factory.tile_etag(request, [table], tile, tms) is None
+    key = factory.cache_key(request, table, tile, tms, limit="10")
+    assert key.startswith("public.countries/WebMercatorQuad/0/0/0?limit=10&")
+    assert key != factory.cache_key(request, simplified, tile, tms, limit="10")
+
+    state.table_versions = TableVersions({"public.countries": "1"})
+    etag = factory.tile_etag(request, [table], tile, tms)
+    key = factory.cache_key(request, table, tile, tms)
+    assert etag != factory.tile_etag(request, [simplified], tile, tms)
+
+    # Tiles cached before the table changed are not used
+    state.table_versions.bump("public.countries")
+    assert etag != factory.tile_etag(request, [table], tile, tms)
+    assert key != factory.cache_key(request, table, tile, tms)
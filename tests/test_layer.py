@@ -0,0 +1,250 @@
+"""Test timvt.layer."""
+
+import re
+from contextlib import asynccontextmanager
+
+import morecantile
+import pytest
+from asyncpg.exceptions import UndefinedFunctionError
+
+from timvt.layer import Function, Table, _table_tile_sql
+
+GEOMETRY_COLUMN = {
+    "name": "geom",
+    "type": "geometry",
+    "geometry_type": "POLYGON",
+    "srid": 4326,
+    "bounds": [-10, -10, 10, 10],
+}
+
+
+def _table(**kwargs):
+    return Table(
+        id="public.countries",
+        table="countries",
+        schema="public",
+        properties=[
+            {"name": "id", "type": "integer"},
+            {"name": "name", "type": "text"},
+            {"name": "geom", "type": "geometry"},
+        ],
+        geometry_columns=[GEOMETRY_COLUMN],
+        geometry_column=GEOMETRY_COLUMN,
+        **kwargs,
+    )
+
+
+def test_table_shared():
+    """Tables should be immutable and render their SQL queries once."""
+    table = _table()
+    assert table.bounds == [-10, -10, 10, 10]
+    assert table._tile_columns == {"geom": ("id", "name")}
+
+    with pytest.raises(TypeError):
+        table.tileurl = "http://tiles/{z}/{x}/{y}"
+
+    tms = morecantile.tms.get("WebMercatorQuad")
+    tile = morecantile.Tile(0, 0, 0)
+    query, _ = table.tile_query(tile, tms)
+    assert table.tile_query(tile, tms)[0] is query
+    assert len(table._tile_sql) == 1
+
+    # Queries with a subset of the columns are not kept by the Table
+    assert table.tile_query(tile, tms, columns="name")[0] != query
+    assert len(table._tile_sql) == 1
+
+    # Copies have their own queries
+    ordered = table.copy(update={"order_by": "-name"})
+    assert "ORDER BY t.name DESC" in ordered.tile_query(tile, tms)[0]
+    assert "ORDER BY" not in table.tile_query(tile, tms)[0]
+
+
+def test_table_sql_keys():
+    """Tile SQL queries should be shared only by requests rendering the same SQL."""
+    _table_tile_sql.cache_clear()
+    table = Table(
+        id="public.countries",
+        table="countries",
+        schema="public",
+        properties=[
+            {"name": "id", "type": "integer"},
+            {"name": "name", "type": "text"},
+            {"name": "geom", "type": "geometry"},
+            {"name": "centroid", "type": "geometry"},
+        ],
+        geometry_columns=[
+            {**GEOMETRY_COLUMN, "transforms": {3857: "geom_3857"}},
+            {**GEOMETRY_COLUMN, "name": "centroid", "transforms": {3857: None}},
+        ],
+        geometry_column={**GEOMETRY_COLUMN, "transforms": {3857: "geom_3857"}},
+        overviews=[
+            {
+                "table": "public.countries_z0",
+                "geometry_column": "geom",
+                "srid": 3857,
+                "tms": "WebMercatorQuad",
+                "minzoom": 0,
+                "maxzoom": 2,
+            }
+        ],
+    )
+    mercator = morecantile.tms.get("WebMercatorQuad")
+    wgs84 = morecantile.tms.get("WorldCRS84Quad")
+    tile = morecantile.Tile(15, 15, 5)
+
+    query, params = table.tile_query(tile, mercator)
+    assert "t.geom_3857" in query
+
+    # Tiles and query parameters (e.g MVT layer name) are parameters of the query
+    named_query, named_params = table.tile_query(
+        morecantile.Tile(16, 15, 5), mercator, layer_name="countries", limit="10"
+    )
+    assert named_query is query
+    assert len(named_params) == len(params)
+    assert "countries" in named_params and "countries" not in params
+
+    queries = {
+        "default": query,
+        "columns": table.tile_query(tile, mercator, columns="name")[0],
+        "geometry column": table.tile_query(tile, mercator, geom="centroid")[0],
+        "overview": table.tile_query(morecantile.Tile(0, 0, 1), mercator)[0],
+        "no transform": table.tile_query(tile, wgs84)[0],
+    }
+    assert re.search(r"\bid\b", query)
+    assert not re.search(r"\bid\b", queries["columns"])
+    assert "ST_Transform(t.centroid, 3857)" in queries["geometry column"]
+    assert "public.countries_z0" in queries["overview"]
+    assert "t.geom_3857" not in queries["no transform"]
+
+    # Different SQL for each set of options, rendered once
+    assert len(set(queries.values())) == len(queries)
+    misses = _table_tile_sql.cache_info().misses
+    assert table.tile_query(tile, mercator, columns="name")[0] == queries["columns"]
+    assert table.tile_query(tile, mercator, geom="centroid")[0] is (
+        queries["geometry column"]
+    )
+    assert _table_tile_sql.cache_info().misses == misses
+
+    # Tables with the same SQL share the rendered queries
+    assert table.copy().tile_query(tile, mercator)[0] is query
+
+
+def test_table_sql_fields():
+    """Table's fields should not collide with the columns of the query's CTEs."""
+    table = Table(
+        id="public.grid",
+        table="grid",
+        schema="public",
+        properties=[
+            {"name": "pixel", "type": "float"},
+            {"name": "geom", "type": "text"},
+            {"name": "the_geom", "type": "geometry"},
+        ],
+        geometry_columns=[{**GEOMETRY_COLUMN, "name": "the_geom"}],
+        geometry_column={**GEOMETRY_COLUMN, "name": "the_geom"},
+    )
+    tms = morecantile.tms.get("WebMercatorQuad")
+    query, _ = table.tile_query(morecantile.Tile(0, 0, 0), tms, simplify=1.0)
+    assert "bounds_geomcrs.pixel" in query
+    assert not re.search(r"[^.]\bpixel\b,", query)
+    assert "AS geom, t.pixel, t.geom" in query
+
+
+class FakeConnection:
+    """Connection recording the executed SQL."""
+
+    def __init__(self, pid=1):
+        self.pid = pid
+        self.executed = []
+        self.dropped = False
+
+    def get_server_pid(self):
+        return self.pid
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def execute(self, query, *args):
+        self.executed.append(query)
+
+    async def fetch(self, query, *args, timeout=None):
+        self.executed.append((query, timeout))
+        xmins = next(arg for arg in args if isinstance(arg, list))
+        return [(idx, b"tile") for idx in range(1, len(xmins) + 1)]
+
+    async def fetchval(self, query, *args, timeout=None):
+        if self.dropped:
+            self.dropped = False
+            raise UndefinedFunctionError("function does not exist")
+        return query
+
+
+@pytest.mark.asyncio
+async def test_function_register():
+    """Functions should be created once per connection and function's SQL."""
+    Function._registered.clear()
+    squares = Function(id="squares", sql="CREATE FUNCTION squares() ...")
+    other = Function(
+        id="squares2", function_name="squares", sql="CREATE FUNCTION squares() -- v2"
+    )
+    conn = FakeConnection()
+
+    await squares.register(conn)
+    await squares.register(conn)
+    assert conn.executed.count(squares.sql) == 1
+    assert "pg_temp" in conn.executed[0]
+
+    # Other connections
+    await squares.register(FakeConnection(pid=2))
+    assert conn.executed.count(squares.sql) == 1
+
+    # Layers with the same function name replace each other's function
+    await other.register(conn)
+    await squares.register(conn)
+    assert conn.executed.count(squares.sql) == 2
+    assert conn.executed.count(other.sql) == 1
+
+    tms = morecantile.tms.get("WebMercatorQuad")
+    query, _ = squares.tile_query(morecantile.Tile(0, 0, 0), tms)
+    assert "pg_temp.squares(" in query
+
+    # Functions dropped since they were registered are created again
+    conn.dropped = True
+    assert await squares._call(conn, conn.fetchval, query, []) == query
+    assert conn.executed.count(squares.sql) == 3
+
+
+class FakePool:
+    """Pool of one FakeConnection, recording whether it is acquired."""
+
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.acquired = False
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquired = True
+        try:
+            yield self.conn
+        finally:
+            self.acquired = False
+
+
+@pytest.mark.asyncio
+async def test_table_get_tiles():
+    """Tiles should be fetched in one round trip per table, without holding the connection."""
+    table = _table(statement_timeout=5.0)
+    pool = FakePool()
+    tms = morecantile.tms.get("WebMercatorQuad")
+    tiles = [morecantile.Tile(0, 0, 1), morecantile.Tile(1, 0, 1)]
+
+    results = []
+    async for tile, content in table.get_tiles(pool, tiles, tms):
+        assert not pool.acquired
+        results.append((tile, content))
+
+    assert results == [(tile, b"tile") for tile in tiles]
+    # One query, with the time budget of the whole batch
+    assert len(pool.conn.executed) == 1
+    assert pool.conn.executed[0][1] == 5.0
@@ -0,0 +1,73 @@
+"""Test timvt.listener."""
+
+import asyncio
+
+import pytest
+
+from timvt.listener import Listener
+
+
+class FakeConnection:
+    """Connection recording its listeners."""
+
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.closed = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+    def terminate(self):
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnect():
+    """Listeners should reconnect and catch up when their connection is lost."""
+    connections = []
+    attempts = []
+    reconnected = asyncio.Event()
+
+    async def connect():
+        attempts.append(1)
+        # The first reconnection attempt fails
+        if len(attempts) == 2:
+            raise OSError("connection refused")
+        conn = FakeConnection()
+        connections.append(conn)
+        return conn
+
+    async def on_reconnect(conn):
+        assert conn is connections[-1]
+        reconnected.set()
+
+    listener = Listener(
+        connect, "channel", lambda *args: None, on_reconnect, retry_interval=0.01
+    )
+    await listener.start()
+    assert "channel" in connections[0].listeners
+
+    connections[0].terminate()
+    await asyncio.wait_for(reconnected.wait(), 1)
+    assert len(attempts) == 3
+    assert "channel" in connections[1].listeners
+    assert listener.stats == {"disconnections": 1, "reconnections": 1}
+
+    await listener.stop()
+    assert connections[1].closed
+    assert not connections[1].termination_listeners
@@ -0,0 +1,138 @@
+"""Test timvt.metrics."""
+
+from contextlib import asynccontextmanager
+
+import pytest
+
+from timvt.admission import AdmissionController
+from timvt.compression import Compressor
+from timvt.metrics import MetricsMiddleware, TileMetrics, TimedPool
+
+from fastapi import FastAPI
+
+from starlette.testclient import TestClient
+
+pytest.importorskip("prometheus_client")
+
+
+class FakePool:
+    """Pool returning itself as connection."""
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        yield self
+
+    def get_size(self):
+        return 4
+
+    def get_idle_size(self):
+        return 3
+
+    def get_max_size(self):
+        return 10
+
+
+def _value(metrics, name, **labels):
+    return metrics.registry.get_sample_value(name, labels)
+
+
+@pytest.mark.asyncio
+async def test_timed_pool():
+    """Pool wait and connection hold durations should be reported."""
+    observed = []
+    pool = TimedPool(FakePool(), lambda stage, duration: observed.append(stage))
+    async with pool.acquire() as conn:
+        assert isinstance(conn, FakePool)
+
+    assert observed == ["pool_wait", "query"]
+
+
+def test_tile_metrics():
+    """Tiles and stages should be recorded per layer, TMS and zoom."""
+    metrics = TileMetrics()
+    metrics.observe_stage("query", 0.2, "public.landsat_wrs", "WebMercatorQuad", 3)
+    metrics.observe_tile(
+        "public.landsat_wrs", "WebMercatorQuad", 3, "rendered", empty=False, size=2000
+    )
+    metrics.observe_tile("public.landsat_wrs", "WebMercatorQuad", 3, "cache", True)
+
+    labels = {"layer": "public.landsat_wrs", "tms": "WebMercatorQuad", "zoom": "3"}
+    assert (
+        _value(
+            metrics, "timvt_tile_stage_duration_seconds_sum", stage="query", **labels
+        )
+        == 0.2
+    )
+    assert _value(metrics, "timvt_tile_size_bytes_count", **labels) == 1
+    assert (
+        _value(metrics, "timvt_tiles_total", source="cache", empty="true", **labels)
+        == 1
+    )
+    assert b"timvt_tiles_total" in metrics.latest()
+
+    # No tracer, the span is a no-op
+    with metrics.span("timvt.tile", layer="public.landsat_wrs"):
+        pass
+
+
+def test_application_collector():
+    """Application components statistics should be read at scrape time."""
+    app = FastAPI()
+    app.state.pool = FakePool()
+    app.state.compressor = Compressor()
+    app.state.admission = AdmissionController()
+    app.state.admission.limiter("squares", 2)
+
+    metrics = TileMetrics(app)
+    assert (
+        _value(metrics, "timvt_db_pool_connections", pool="primary", state="idle") == 3
+    )
+    assert _value(metrics, "timvt_compression_calls_total", mode="inline") == 0
+    assert (
+        _value(
+            metrics,
+            "timvt_admission_queries",
+            layer="squares",
+            band="z0+",
+            state="active",
+        )
+        == 0
+    )
+
+
+def test_metrics_middleware():
+    """Requests should be recorded with their endpoint name."""
+    app = FastAPI()
+    app.state.metrics = TileMetrics()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/ping")
+    def ping():
+        return {"ping": "pong!"}
+
+    with TestClient(app) as client:
+        assert client.get("/ping").status_code == 200
+        assert client.get("/missing").status_code == 404
+
+    metrics = app.state.metrics
+    assert (
+        _value(
+            metrics,
+            "timvt_http_request_duration_seconds_count",
+            handler="ping",
+            method="GET",
+            status="200",
+        )
+        == 1
+    )
+    assert (
+        _value(
+            metrics,
+            "timvt_http_request_duration_seconds_count",
+            handler="unknown",
+            method="GET",
+            status="404",
+        )
+        == 1
+    )
+    assert _value(metrics, "timvt_http_response_write_seconds_count", handler="ping")
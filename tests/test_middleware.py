@@ -0,0 +1,110 @@
+"""Test timvt.middleware."""
+
+from timvt.middleware import CacheControlMiddleware, ETagMiddleware, TimingMiddleware
+
+from fastapi import FastAPI, Request
+
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.testclient import TestClient
+
+
+def _app():
+    app = FastAPI()
+
+    @app.get("/route1")
+    def route1():
+        return {"value": 1}
+
+    @app.get("/route2")
+    def route2():
+        return Response("route2", headers={"Cache-Control": "no-cache"})
+
+    @app.get("/tiles/{z}/{x}/{y}")
+    def tiles(z: int, x: int, y: int):
+        return Response(b"tile", headers={"ETag": '"tile"'})
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"a" * 10, b"b" * 10]))
+
+    @app.get("/timed")
+    def timed(request: Request):
+        request.state.server_timing = ['query;desc="layer";dur=1.0']
+        return {"value": 1}
+
+    @app.get("/error")
+    def error():
+        return PlainTextResponse("error", status_code=500)
+
+    return app
+
+
+def test_cachecontrol():
+    """Test CacheControlMiddleware."""
+    app = _app()
+    app.add_middleware(
+        CacheControlMiddleware,
+        cachecontrol="public, max-age=3600",
+        exclude_path={r"/tiles/.+"},
+    )
+    client = TestClient(app)
+
+    response = client.get("/route1")
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+
+    response = client.get("/route2")
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = client.get("/tiles/1/1/1")
+    assert "Cache-Control" not in response.headers
+
+    response = client.get("/error")
+    assert "Cache-Control" not in response.headers
+
+    response = client.post("/route1")
+    assert "Cache-Control" not in response.headers
+
+
+def test_timing():
+    """Test TimingMiddleware."""
+    app = _app()
+    app.add_middleware(TimingMiddleware)
+    client = TestClient(app)
+
+    response = client.get("/route1")
+    assert response.headers["Server-Timing"].startswith("total;dur=")
+
+    # Application's timings
+    response = client.get("/timed")
+    timings = response.headers["Server-Timing"].split(", ")
+    assert timings[0] == 'query;desc="layer";dur=1.0'
+    assert timings[1].startswith("total;dur=")
+
+
+def test_etag():
+    """Test ETagMiddleware."""
+    app = _app()
+    app.add_middleware(ETagMiddleware, max_size=15)
+    client = TestClient(app)
+
+    response = client.get("/route1")
+    assert response.json() == {"value": 1}
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    response = client.get("/route1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+    # Responses with an ETag are not modified
+    response = client.get("/tiles/1/1/1")
+    assert response.headers["ETag"] == '"tile"'
+
+    # Responses larger than `max_size` are streamed without ETag
+    response = client.get("/stream")
+    assert response.content == b"a" * 10 + b"b" * 10
+    assert "ETag" not in response.headers
+
+    response = client.get("/error")
+    assert "ETag" not in response.headers
@@ -0,0 +1,157 @@
+"""Test timvt.occupancy and Table bounds check."""
+
+import asyncio
+from types import SimpleNamespace
+
+import morecantile
+import pytest
+from morecantile import Tile
+
+from timvt.etag import TableVersions
+from timvt.layer import Table, tile_settings
+from timvt.occupancy import TileOccupancy, TileOccupancyIndexes, register_tile_occupancy
+
+from starlette.datastructures import State
+
+tms = morecantile.tms.get("WebMercatorQuad")
+
+
+def test_occupancy():
+    """Test TileOccupancy.is_empty."""
+    occupancy = TileOccupancy(tms, 2, {(1, 1), (3, 2)}, "geom")
+    assert len(occupancy) == 2
+
+    assert not occupancy.is_empty(Tile(0, 0, 0), tms)
+    assert not occupancy.is_empty(Tile(0, 0, 1), tms)
+    assert not occupancy.is_empty(Tile(1, 1, 1), tms)
+    assert occupancy.is_empty(Tile(1, 0, 1), tms)
+    assert occupancy.is_empty(Tile(0, 1, 1), tms)
+
+    assert not occupancy.is_empty(Tile(1, 1, 2), tms)
+    assert occupancy.is_empty(Tile(2, 2, 2), tms)
+
+    # children of the non-empty tiles
+    assert not occupancy.is_empty(Tile(2, 3, 3), tms)
+    assert not occupancy.is_empty(Tile(13, 9, 5), tms)
+    assert occupancy.is_empty(Tile(0, 0, 3), tms)
+    assert occupancy.is_empty(Tile(16, 16, 5), tms)
+
+    # the index is only valid for its TMS and geometry column
+    assert occupancy.is_empty(Tile(16, 16, 5), tms, geometry_column="geom")
+    assert not occupancy.is_empty(Tile(16, 16, 5), tms, geometry_column="centroid")
+    assert not occupancy.is_empty(Tile(0, 0, 3), morecantile.tms.get("WorldCRS84Quad"))
+
+
+def test_occupancy_add():
+    """New features should make their tiles non-empty."""
+    occupancy = TileOccupancy(tms, 4, {(0, 0)}, "geom")
+    assert occupancy.is_empty(Tile(8, 8, 4), tms)
+    assert occupancy.is_empty(Tile(1, 1, 1), tms)
+
+    # Small feature near (0, 0)
+    assert occupancy.add([[1, 1, 2, 2]])
+    assert not occupancy.is_empty(Tile(8, 7, 4), tms)
+    assert not occupancy.is_empty(Tile(1, 0, 1), tms)
+    assert not occupancy.is_empty(Tile(0, 0, 0), tms)
+    assert not occupancy.is_empty(Tile(16, 15, 5), tms)
+    assert occupancy.is_empty(Tile(0, 15, 4), tms)
+
+    # Too many tiles
+    assert not occupancy.add([[-180, -80, 180, 80]], max_tiles=10)
+
+
+def test_occupancy_quadtree():
+    """Occupancy index needs a quadtree TMS."""
+    with pytest.raises(ValueError):
+        TileOccupancy(morecantile.tms.get("CanadianNAD83_LCC"), 2, set(), "geom")
+
+
+@pytest.mark.asyncio
+async def test_occupancy_indexes():
+    """Indexes should only be created for the configured tables."""
+    indexes = TileOccupancyIndexes(None, tms, {"public_points": {"occupancy_zoom": 4}})
+    assert indexes.zoom("public.points") == 4
+    assert indexes.zoom("public.lines") is None
+
+    lines = Table(id="public.lines", schema="public", table="lines")
+    assert indexes.index(lines) is None
+    assert not indexes._tasks
+    await indexes.close()
+
+
+@pytest.mark.asyncio
+async def test_occupancy_indexes_version(monkeypatch):
+    """Indexes should be created again when the table's version changes."""
+    created = []
+
+    async def create(pool, table, tms, zoom):
+        created.append(table.id)
+        return TileOccupancy(tms, zoom, {(0, 0)}, "geom")
+
+    monkeypatch.setattr(TileOccupancy, "create", create)
+    indexes = TileOccupancyIndexes(None, tms, {"public_points": {"occupancy_zoom": 4}})
+    points = Table(id="public.points", schema="public", table="points")
+
+    async def index(version):
+        if indexes.index(points, version) is None:
+            await asyncio.gather(*indexes._tasks.values())
+        return indexes.index(points, version)
+
+    assert await index("1") is not None
+    assert await index("1") is not None
+    assert len(created) == 1
+
+    # Stale indexes are not used
+    assert indexes.index(points, "2") is None
+    assert await index("2") is not None
+    assert len(created) == 2
+    assert indexes.index(points) is not None
+
+
+@pytest.mark.asyncio
+async def test_register_tile_occupancy(monkeypatch):
+    """Indexes should only be created when they can follow the tables' changes."""
+    monkeypatch.setenv("TIMVT_TABLE_CONFIG", '{"public_points": {"occupancy_zoom": 4}}')
+    app = SimpleNamespace(state=State())
+    app.state.pool = None
+    app.state.table_catalog = {}
+
+    await register_tile_occupancy(app, tms)
+    assert app.state.tile_occupancy is None
+
+    app.state.table_versions = TableVersions()
+    await register_tile_occupancy(app, tms)
+    assert isinstance(app.state.tile_occupancy, TileOccupancyIndexes)
+
+
+def test_table_bounds(monkeypatch):
+    """Test Table bounds check."""
+    monkeypatch.setattr(tile_settings, "bounds_check", True)
+    table = Table(
+        id="public.points",
+        schema="public",
+        table="points",
+        geometry_columns=[
+            {
+                "name": "geom",
+                "type": "geometry",
+                "geometry_type": "POINT",
+                "srid": 4326,
+                "bounds": [0, 0, 10, 10],
+            }
+        ],
+    )
+    geom = table.geometry_columns[0]
+
+    assert not table._outside_bounds(Tile(0, 0, 0), tms, geom)
+    assert not table._outside_bounds(Tile(8, 7, 4), tms, geom)
+    assert table._outside_bounds(Tile(0, 0, 4), tms, geom)
+    assert table._outside_bounds(Tile(15, 15, 4), tms, geom)
+
+    # within the margin
+    assert not table._outside_bounds(Tile(1083, 995, 11), tms, geom)
+    assert table._outside_bounds(Tile(1097, 995, 11), tms, geom)
+
+    # No check for TMS with projected CRS (other than WebMercator)
+    lcc = morecantile.tms.get("CanadianNAD83_LCC")
+    assert not table._outside_bounds(Tile(0, 0, 0), lcc, geom)
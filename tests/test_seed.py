@@ -0,0 +1,238 @@
+"""Test timvt.seed."""
+
+import gzip
+import os
+import threading
+
+import morecantile
+import pytest
+from morecantile import Tile
+
+from timvt import layer as layer_module
+from timvt import pmtiles
+from timvt.compression import compress, decompress
+from timvt.layer import Archive, Layer
+from timvt.mbtiles import MBTiles
+from timvt.seed import seed, seed_archive
+
+tms = morecantile.tms.get("WebMercatorQuad")
+
+
+class FakeLayer(Layer):
+    """Layer returning the tile index as content (empty for odd columns)."""
+
+    async def get_tile(self, pool, tile, tms, **kwargs):
+        """Return fake tile."""
+        if tile.x % 2:
+            return b""
+        return f"{tile.z}/{tile.x}/{tile.y}".encode()
+
+
+def test_tileid():
+    """Test Hilbert tile ids."""
+    assert pmtiles.zxy_to_tileid(0, 0, 0) == 0
+    assert pmtiles.zxy_to_tileid(1, 0, 0) == 1
+    assert pmtiles.zxy_to_tileid(1, 0, 1) == 2
+    assert pmtiles.zxy_to_tileid(1, 1, 1) == 3
+    assert pmtiles.zxy_to_tileid(1, 1, 0) == 4
+    assert pmtiles.zxy_to_tileid(2, 0, 0) == 5
+
+
+def test_directory():
+    """Test directory serialization."""
+    entries = [
+        pmtiles.Entry(0, 0, 10, 1),
+        pmtiles.Entry(1, 10, 5, 3),
+        pmtiles.Entry(10, 0, 10, 1),
+    ]
+    assert (
+        pmtiles.deserialize_directory(pmtiles.serialize_directory(entries)) == entries
+    )
+    assert pmtiles.find_entry(entries, 3) == entries[1]
+    assert pmtiles.find_entry(entries, 5) is None
+    assert pmtiles.find_entry(entries, 10) == entries[2]
+
+
+@pytest.mark.asyncio
+async def test_seed_writer(tmp_path, monkeypatch):
+    """Archive writes should run in a writer thread, not in the event loop."""
+    threads = set()
+    write_tile = MBTiles.write_tile
+
+    def _write_tile(self, tile, data):
+        threads.add(threading.current_thread().name)
+        write_tile(self, tile, data)
+
+    monkeypatch.setattr(MBTiles, "write_tile", _write_tile)
+
+    with MBTiles(str(tmp_path / "tiles.mbtiles"), tms) as archive:
+        stats = await seed(
+            None, FakeLayer(id="fake"), tms, archive, [-180, -85, 180, 85], 0, 2
+        )
+        assert stats.tiles == 21
+        assert len(archive.seeded()) == 21
+
+    assert len(threads) == 1
+    assert threads.pop().startswith("timvt-seed")
+
+
+@pytest.mark.asyncio
+async def test_seed_resume(tmp_path):
+    """Seeded tiles should be skipped when resuming."""
+    layer = FakeLayer(id="fake")
+
+    with MBTiles(str(tmp_path / "tiles.mbtiles"), tms) as archive:
+        stats = await seed(None, layer, tms, archive, [-180, -85, 180, 85], 0, 2)
+        assert stats.tiles == 21
+        assert stats.empty == 10
+        assert stats.skipped == 0
+        assert len(list(archive.tiles())) == 11
+
+        data = archive.read_tile(Tile(2, 1, 2))
+        assert gzip.decompress(data) == b"2/2/1"
+        assert not archive.read_tile(Tile(1, 1, 2))
+
+        stats = await seed(
+            None, layer, tms, archive, [-180, -85, 180, 85], 0, 3, batch_size=5
+        )
+        assert stats.tiles == 64
+        assert stats.skipped == 21
+
+
+@pytest.mark.asyncio
+async def test_seed_pmtiles(tmp_path):
+    """Test PMTiles output."""
+    layer = FakeLayer(id="fake", minzoom=0, maxzoom=2)
+    output = str(tmp_path / "tiles.pmtiles")
+
+    stats = await seed_archive(None, layer, tms, output, concurrency=2)
+    assert stats.tiles == 21
+    assert not (tmp_path / "tiles.pmtiles.mbtiles").exists()
+
+    with open(output, "rb") as f:
+        data = f.read()
+
+    header = pmtiles.deserialize_header(data[: pmtiles.HEADER_SIZE])
+    assert header["min_zoom"] == 0
+    assert header["max_zoom"] == 2
+    assert header["addressed_tiles_count"] == 11
+    assert header["clustered"] == 1
+
+    root = pmtiles.deserialize_directory(
+        data[header["root_offset"] : header["root_offset"] + header["root_length"]]
+    )
+    entry = pmtiles.find_entry(root, pmtiles.zxy_to_tileid(2, 2, 1))
+    offset = header["tile_data_offset"] + entry.offset
+    assert gzip.decompress(data[offset : offset + entry.length]) == b"2/2/1"
+    assert pmtiles.find_entry(root, pmtiles.zxy_to_tileid(2, 1, 1)) is None
+
+
+def _write_pmtiles(path, tile_compression, data, internal_compression=pmtiles.GZIP):
+    writer = pmtiles.PMTilesWriter(
+        path,
+        tile_compression=tile_compression,
+        internal_compression=internal_compression,
+    )
+    with writer:
+        writer.write_tile(0, 0, 0, data)
+        writer.close(
+            header={
+                "min_zoom": 0,
+                "max_zoom": 0,
+                "min_lon": -180.0,
+                "min_lat": -85.0,
+                "max_lon": 180.0,
+                "max_lat": 85.0,
+                "center_lon": 0.0,
+                "center_lat": 0.0,
+                "center_zoom": 0,
+            },
+            metadata={"description": "tiles"},
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+async def test_archive_compression(tmp_path, encoding):
+    """PMTiles archives should be served with their tile compression."""
+    compression = {"gzip": pmtiles.GZIP, "br": pmtiles.BROTLI, "zstd": pmtiles.ZSTD}
+    output = str(tmp_path / "tiles.pmtiles")
+    _write_pmtiles(output, compression[encoding], compress(b"0/0/0", encoding))
+
+    archive = Archive.from_file("archive", output)
+    try:
+        data, content_encoding = archive.get_tile_data(Tile(0, 0, 0), tms)
+        assert content_encoding == encoding
+        assert decompress(data, encoding) == b"0/0/0"
+        assert await archive.get_tile(None, Tile(0, 0, 0), tms) == b"0/0/0"
+    finally:
+        archive.close()
+
+
+def test_archive_unsupported_compression(tmp_path):
+    """PMTiles archives with an unknown tile compression should be rejected."""
+    output = str(tmp_path / "tiles.pmtiles")
+    _write_pmtiles(output, 5, b"0/0/0")
+
+    with pytest.raises(ValueError):
+        Archive.from_file("archive", output)
+
+    # Archives written with an unknown internal compression are rejected when opened
+    with open(output, "r+b") as f:
+        header = pmtiles.deserialize_header(f.read(pmtiles.HEADER_SIZE))
+        f.seek(0)
+        f.write(pmtiles.serialize_header({**header, "internal_compression": 5}))
+
+    with pytest.raises(ValueError):
+        pmtiles.PMTilesReader(output)
+
+
+@pytest.mark.parametrize(
+    "internal_compression", [pmtiles.NONE, pmtiles.GZIP, pmtiles.BROTLI, pmtiles.ZSTD]
+)
+def test_archive_internal_compression(tmp_path, internal_compression):
+    """PMTiles directories and metadata should be read with the internal compression."""
+    output = str(tmp_path / "tiles.pmtiles")
+    _write_pmtiles(output, pmtiles.NONE, b"0/0/0", internal_compression)
+
+    with pmtiles.PMTilesReader(output) as reader:
+        assert reader.header["internal_compression"] == internal_compression
+        assert reader.metadata == {"description": "tiles"}
+        assert reader.get_tile(0, 0, 0) == b"0/0/0"
+
+    archive = Archive.from_file("archive", output)
+    try:
+        assert archive.description == "tiles"
+        assert archive.get_tile_data(Tile(0, 0, 0), tms) == (b"0/0/0", None)
+    finally:
+        archive.close()
+
+
+@pytest.mark.asyncio
+async def test_archive_threads(tmp_path, monkeypatch):
+    """MBTiles reads and large decompressions should not run in the event loop."""
+    calls = []
+
+    async def run_in_threadpool(func, *args):
+        calls.append(func.__name__)
+        return func(*args)
+
+    monkeypatch.setattr(layer_module, "run_in_threadpool", run_in_threadpool)
+
+    output = str(tmp_path / "tiles.mbtiles")
+    large = os.urandom(layer_module.ARCHIVE_OFFLOAD_THRESHOLD)
+    with MBTiles(output, tms) as archive:
+        archive.write_tile(Tile(0, 0, 0), b"0/0/0")
+        archive.write_tile(Tile(0, 0, 1), large)
+        archive.commit()
+
+    archive = Archive.from_file("archive", output)
+    try:
+        data, encoding = await archive.read_tile(Tile(0, 0, 0), tms)
+        assert (gzip.decompress(data), encoding) == (b"0/0/0", "gzip")
+        assert calls == ["get_tile_data"]
+
+        assert await archive.get_tile(None, Tile(0, 0, 1), tms) == large
+        assert calls == ["get_tile_data", "get_tile_data", "decompress"]
+    finally:
+        archive.close()
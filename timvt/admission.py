@@ -0,0 +1,223 @@
+"""timvt.admission: admission control of the tile queries."""
+
+import asyncio
+import bisect
+import collections
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Sequence, Tuple
+
+from timvt.errors import TileOverloaded
+from timvt.settings import AdmissionSettings
+
+from fastapi import FastAPI
+
+
+class Limiter:
+    """Concurrency limit with a bounded FIFO wait queue.
+
+    Attributes:
+        max_concurrency (int): Maximum number of concurrent holders.
+        max_queue (int): Maximum number of waiting callers, above which callers are rejected.
+        queue_timeout (float): Maximum waiting time (in seconds).
+        stats (dict): Number of `active`, `waiting`, `admitted` and `rejected` callers and the `wait_time_total`/`wait_time_max` (in seconds).
+
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        """Init Limiter."""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque["asyncio.Future[None]"] = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def waiting(self) -> int:
+        """Number of waiting callers."""
+        return sum(not fut.done() for fut in self._waiters)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Limiter statistics."""
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_time_total": round(self.wait_time_total, 6),
+            "wait_time_max": round(self.wait_time_max, 6),
+        }
+
+    async def acquire(self) -> None:
+        """Wait for a slot.
+
+        Raises:
+            TileOverloaded: if the wait queue is full or the waiting time exceeds `queue_timeout`.
+
+        """
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise TileOverloaded("Too many queued tile queries.")
+
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+
+        except asyncio.TimeoutError:
+            # The slot might have been handed over just before the timeout
+            if fut.done() and not fut.cancelled():
+                self.release()
+            self.rejected += 1
+            raise TileOverloaded(
+                f"Tile query not started within {self.queue_timeout}s."
+            ) from None
+
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+        finally:
+            wait_time = time.monotonic() - start
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+
+        self.admitted += 1
+
+    def release(self) -> None:
+        """Release a slot, handed over to the first waiting caller if any."""
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+
+        self.active -= 1
+
+
+class AdmissionController:
+    """Limit the number of concurrent tile queries per layer and zoom band.
+
+    Each layer and zoom band gets its own limit and wait queue, so expensive layers
+    (or low zoom levels) can't use all the database connections and delay the other
+    layers. Queries waiting for too long or exceeding the wait queue are rejected
+    (`TileOverloaded`, `503 Service Unavailable` response with a `Retry-After` header).
+
+    Attributes:
+        max_concurrency (int): Default maximum number of concurrent queries per layer and zoom band.
+        layers (dict): Maximum number of concurrent queries of specific layers.
+        zoom_bands (list): First zoom level of each zoom band.
+        max_queue (int): Maximum number of waiting queries per layer and zoom band.
+        queue_timeout (float): Maximum waiting time (in seconds).
+        retry_after (int): `Retry-After` delay (in seconds) of the rejected requests.
+
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        layers: Optional[Dict[str, int]] = None,
+        zoom_bands: Sequence[int] = (0,),
+        max_queue: int = 32,
+        queue_timeout: float = 5.0,
+        retry_after: int = 1,
+    ):
+        """Init AdmissionController."""
+        self.max_concurrency = max_concurrency
+        self.layers = layers or {}
+        self.zoom_bands = sorted(zoom_bands) or [0]
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._limiters: Dict[Tuple[str, int], Limiter] = {}
+
+    def band(self, zoom: int) -> int:
+        """Return the zoom band index of a zoom level."""
+        return max(bisect.bisect_right(self.zoom_bands, zoom) - 1, 0)
+
+    def band_name(self, band: int) -> str:
+        """Return the zoom band name (e.g `z0-7` or `z14+`)."""
+        minzoom = self.zoom_bands[band]
+        if band + 1 < len(self.zoom_bands):
+            return f"z{minzoom}-{self.zoom_bands[band + 1] - 1}"
+
+        return f"z{minzoom}+"
+
+    def limiter(self, layer: str, zoom: int) -> Limiter:
+        """Return the limiter of a layer and zoom level."""
+        key = (layer, self.band(zoom))
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = Limiter(
+                self.layers.get(layer, self.max_concurrency),
+                self.max_queue,
+                self.queue_timeout,
+            )
+            self._limiters[key] = limiter
+
+        return limiter
+
+    @asynccontextmanager
+    async def admit(self, layer: str, zoom: int) -> AsyncIterator[None]:
+        """Wait for the layer and zoom level's limit before running a tile query.
+
+        Raises:
+            TileOverloaded: if the query can't be started soon enough.
+
+        """
+        limiter = self.limiter(layer, zoom)
+        try:
+            await limiter.acquire()
+        except TileOverloaded as e:
+            raise TileOverloaded(
+                f"Layer '{layer}' is overloaded: {e}", retry_after=self.retry_after
+            ) from None
+
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """Limiters statistics, per layer and zoom band."""
+        stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (layer, band), limiter in sorted(self._limiters.items()):
+            stats.setdefault(layer, {})[self.band_name(band)] = limiter.stats
+
+        return stats
+
+
+def register_admission_controller(
+    app: FastAPI, settings: Optional[AdmissionSettings] = None
+) -> None:
+    """Add an admission controller (`app.state.admission`) if enabled in the settings."""
+    if not settings:
+        settings = AdmissionSettings()
+
+    if not settings.enabled:
+        app.state.admission = None
+        return
+
+    app.state.admission = AdmissionController(
+        max_concurrency=settings.max_concurrency,
+        layers=settings.layers,
+        zoom_bands=settings.zoom_bands,
+        max_queue=settings.max_queue,
+        queue_timeout=settings.queue_timeout,
+        retry_after=settings.retry_after,
+    )
@@ -0,0 +1,530 @@
+"""timvt.bench: load tests of a TiMVT server with synthetic tables and tile access patterns."""
+
+import asyncio
+import math
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from buildpg import Var as pg_variable
+from buildpg import asyncpg
+from morecantile import Tile, TileMatrixSet
+
+try:
+    import httpx
+except ImportError:  # pragma: nocover
+    httpx = None  # type: ignore
+
+GEOMETRY_TYPES = {"point": "Point", "linestring": "LineString", "polygon": "Polygon"}
+
+# Geometries around random centers (`c`), about `:size` degrees wide
+GEOMETRY_SQL = {
+    "point": "c",
+    "linestring": """ST_MakeLine(ARRAY[
+        c,
+        ST_Translate(c, (random() - 0.5) * :size::float8, (random() - 0.5) * :size::float8),
+        ST_Translate(c, (random() - 0.5) * :size::float8, (random() - 0.5) * :size::float8)
+    ])""",
+    "polygon": "ST_Buffer(c, (0.1 + random()) * :size::float8 / 2, 4)",
+}
+
+SYNTHETIC_TABLE_SQL = """
+    CREATE TABLE :table (
+        id integer PRIMARY KEY,
+        value integer,
+        category text,
+        geom geometry({geometry_type}, 4326)
+    )
+"""
+
+SYNTHETIC_ROWS_SQL = """
+    INSERT INTO :table (id, value, category, geom)
+    SELECT id, (random() * 1000)::int, (ARRAY['a', 'b', 'c', 'd'])[1 + id % 4], {geometry}
+    FROM (
+        SELECT
+            id,
+            ST_SetSRID(
+                ST_MakePoint(
+                    :xmin::float8 + random() * (:xmax::float8 - :xmin::float8),
+                    :ymin::float8 + random() * (:ymax::float8 - :ymin::float8)
+                ),
+                4326
+            ) AS c
+        FROM generate_series(1, :rows::int) AS id
+    ) AS t
+"""
+
+SERVER_TIMING = re.compile(r"^\s*([^;,\s]+)(?:;.*?)?;dur=([0-9.]+)")
+
+PERCENTILES = (50, 95, 99)
+
+
+def synthetic_table_name(geometry_type: str, rows: int, schema: str = "public") -> str:
+    """Return the name of a synthetic table (e.g `public.timvt_bench_point_100000`)."""
+    return f"{schema}.timvt_bench_{geometry_type}_{rows}"
+
+
+async def create_synthetic_table(
+    pool: asyncpg.BuildPgPool,
+    table: str,
+    geometry_type: str = "point",
+    rows: int = 100_000,
+    bbox: Sequence[float] = (-180, -85, 180, 85),
+    size: float = 0.01,
+    seed: float = 0.0,
+) -> None:
+    """Create (or re-create) a table of random features.
+
+    Args:
+        pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+        table (str): Table name (schema.table).
+        geometry_type (str): `point`, `linestring` or `polygon`.
+        rows (int): Number of features.
+        bbox (list): Bounding box (minx, miny, maxx, maxy) of the features, in WGS84.
+        size (float): Size (in degrees) of the lines and polygons.
+        seed (float): Random seed (between -1 and 1), for reproducible tables.
+
+    """
+    if geometry_type not in GEOMETRY_TYPES:
+        raise ValueError(f"Invalid geometry type: {geometry_type}.")
+
+    identifier = pg_variable(table)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute_b("DROP TABLE IF EXISTS :table", table=identifier)
+            await conn.execute_b(
+                SYNTHETIC_TABLE_SQL.format(geometry_type=GEOMETRY_TYPES[geometry_type]),
+                table=identifier,
+            )
+            await conn.execute_b("SELECT setseed(:seed::float8)", seed=seed)
+            await conn.execute_b(
+                SYNTHETIC_ROWS_SQL.format(geometry=GEOMETRY_SQL[geometry_type]),
+                table=identifier,
+                xmin=bbox[0],
+                ymin=bbox[1],
+                xmax=bbox[2],
+                ymax=bbox[3],
+                rows=rows,
+                size=size,
+            )
+            await conn.execute_b(
+                "CREATE INDEX ON :table USING GIST (geom)", table=identifier
+            )
+
+        await conn.execute_b("ANALYZE :table", table=identifier)
+
+
+@dataclass
+class TileRange:
+    """Tiles of a bounding box at each zoom level."""
+
+    tms: TileMatrixSet
+    bbox: Sequence[float]
+    minzoom: int
+    maxzoom: int
+
+    def bounds(self, zoom: int) -> Tuple[int, int, int, int]:
+        """Return the min/max tile indices (minx, maxx, miny, maxy) at a zoom level."""
+        tms_bbox: Any = self.tms.bbox
+        west = max(self.bbox[0], tms_bbox.left)
+        south = max(self.bbox[1], tms_bbox.bottom)
+        east = min(self.bbox[2], tms_bbox.right)
+        north = min(self.bbox[3], tms_bbox.top)
+
+        matrix = self.tms.matrix(zoom)
+        ul = self.tms.tile(west, north, zoom)
+        lr = self.tms.tile(east, south, zoom)
+        return (
+            max(ul.x, 0),
+            min(lr.x, matrix.matrixWidth - 1),
+            max(ul.y, 0),
+            min(lr.y, matrix.matrixHeight - 1),
+        )
+
+    def random_tile(self, rng: random.Random, zoom: Optional[int] = None) -> Tile:
+        """Return a random tile (at a random zoom level by default)."""
+        if zoom is None:
+            zoom = rng.randint(self.minzoom, self.maxzoom)
+
+        minx, maxx, miny, maxy = self.bounds(zoom)
+        return Tile(rng.randint(minx, maxx), rng.randint(miny, maxy), zoom)
+
+    def viewport(self, x: int, y: int, zoom: int, size: Tuple[int, int]) -> List[Tile]:
+        """Return the tiles of a viewport of `size` (columns, rows) tiles centered on a tile."""
+        minx, maxx, miny, maxy = self.bounds(zoom)
+        width, height = size
+        x0 = max(minx, min(x - width // 2, maxx - width + 1))
+        y0 = max(miny, min(y - height // 2, maxy - height + 1))
+        return [
+            Tile(tx, ty, zoom)
+            for ty in range(y0, min(y0 + height, maxy + 1))
+            for tx in range(x0, min(x0 + width, maxx + 1))
+        ]
+
+
+def pan_pattern(
+    tiles: TileRange,
+    count: int,
+    rng: random.Random,
+    viewport: Tuple[int, int] = (4, 3),
+) -> List[Tile]:
+    """Viewport panning at a random zoom level, changing direction from time to time.
+
+    Like map clients, only the tiles entering the viewport are requested.
+
+    """
+    zoom = rng.randint(tiles.minzoom, tiles.maxzoom)
+    start = tiles.random_tile(rng, zoom)
+    x, y = start.x, start.y
+    dx, dy = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+
+    requests: List[Tile] = []
+    seen: set = set()
+    while len(requests) < count:
+        new = [
+            tile for tile in tiles.viewport(x, y, zoom, viewport) if tile not in seen
+        ]
+        if not new:
+            # Panned over the whole range, start again
+            seen.clear()
+            dx, dy = -dx, -dy
+            new = tiles.viewport(x, y, zoom, viewport)
+
+        seen.update(new)
+        requests.extend(new)
+
+        minx, maxx, miny, maxy = tiles.bounds(zoom)
+        if rng.random() < 0.2 or not (
+            minx <= x + dx <= maxx and miny <= y + dy <= maxy
+        ):
+            dx, dy = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+
+        x = max(minx, min(x + dx, maxx))
+        y = max(miny, min(y + dy, maxy))
+
+    return requests[:count]
+
+
+def zoom_pattern(
+    tiles: TileRange,
+    count: int,
+    rng: random.Random,
+    viewport: Tuple[int, int] = (4, 3),
+) -> List[Tile]:
+    """Bursts of viewports zooming in on random places, from minzoom to maxzoom."""
+    requests: List[Tile] = []
+    while len(requests) < count:
+        target = tiles.random_tile(rng, tiles.maxzoom)
+        for zoom in range(tiles.minzoom, tiles.maxzoom + 1):
+            scale = 2 ** (tiles.maxzoom - zoom)
+            requests.extend(
+                tiles.viewport(target.x // scale, target.y // scale, zoom, viewport)
+            )
+
+    return requests[:count]
+
+
+def zipf_pattern(
+    tiles: TileRange,
+    count: int,
+    rng: random.Random,
+    population: int = 1000,
+    exponent: float = 1.1,
+    seed: int = 0,
+) -> List[Tile]:
+    """Tiles drawn from a population of random tiles with a Zipfian popularity.
+
+    The `n`-th most popular tile is requested `1 / n ** exponent` times as often as
+    the most popular one. All the clients share the same population (from `seed`).
+
+    """
+    population_rng = random.Random(seed)
+    candidates = [tiles.random_tile(population_rng) for _ in range(population)]
+    weights = [1 / (rank**exponent) for rank in range(1, population + 1)]
+    return rng.choices(candidates, weights=weights, k=count)
+
+
+PATTERNS: Dict[str, Callable[..., List[Tile]]] = {
+    "pan": pan_pattern,
+    "zoom": zoom_pattern,
+    "zipf": zipf_pattern,
+}
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Return the `q`-th percentile (linear interpolation) of values."""
+    if not values:
+        return math.nan
+
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Parse `Server-Timing` header in {metric: duration (ms)}, summing the entries of each metric (e.g per layer)."""
+    timings: Dict[str, float] = {}
+    for entry in (header or "").split(","):
+        matched = SERVER_TIMING.match(entry)
+        if matched:
+            name, duration = matched.groups()
+            timings[name] = timings.get(name, 0.0) + float(duration)
+
+    return timings
+
+
+@dataclass
+class Sample:
+    """Tile request measure."""
+
+    # None if the request failed (e.g connection error)
+    status: Optional[int]
+    # Seconds
+    latency: float
+    # Bytes received (compressed)
+    size: int = 0
+    # Server-Timing durations (ms)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def _distribution(values: Sequence[float]) -> Dict[str, float]:
+    """Return percentiles, mean and max of values."""
+    stats = {f"p{q}": round(percentile(values, q), 3) for q in PERCENTILES}
+    stats["mean"] = round(sum(values) / len(values), 3)
+    stats["max"] = round(max(values), 3)
+    return stats
+
+
+def summarize(samples: Sequence[Sample], duration: float) -> Dict[str, Any]:
+    """Summarize the samples of a scenario: latencies (ms), throughput and server timings."""
+    statuses: Dict[str, int] = {}
+    for sample in samples:
+        key = str(sample.status) if sample.status is not None else "error"
+        statuses[key] = statuses.get(key, 0) + 1
+
+    completed = [s for s in samples if s.status is not None]
+    summary: Dict[str, Any] = {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s.status is None or s.status >= 500),
+        "statuses": statuses,
+        "duration": round(duration, 3),
+        "throughput": round(len(completed) / duration, 3) if duration else 0.0,
+        "bytes": sum(s.size for s in completed),
+        "latency": (
+            _distribution([s.latency * 1000 for s in completed]) if completed else None
+        ),
+        "timings": {},
+    }
+
+    # Server-side phases (debug mode), e.g `pool_wait` and `query`
+    names = sorted({name for s in completed for name in s.timings})
+    for name in names:
+        values = [s.timings[name] for s in completed if name in s.timings]
+        summary["timings"][name] = _distribution(values)
+
+    return summary
+
+
+async def run_scenario(
+    client: Any,
+    layer: str,
+    tms: TileMatrixSet,
+    requests: Sequence[Sequence[Tile]],
+    params: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Request tiles with concurrent clients and summarize the responses.
+
+    Args:
+        client (httpx.AsyncClient): HTTP client (with the server's base url).
+        layer (str): Layer name.
+        tms (morecantile.TileMatrixSet): Tile Matrix Set.
+        requests (list): Tiles requested (in order) by each concurrent client.
+        params (dict, optional): Query parameters of the tile requests.
+
+    Returns:
+        dict: Scenario summary (see `summarize`).
+
+    """
+    assert httpx is not None, "'httpx' must be installed to run load tests"
+
+    samples: List[Sample] = []
+
+    async def _client(tiles: Sequence[Tile]) -> None:
+        for tile in tiles:
+            url = f"/tiles/{tms.identifier}/{layer}/{tile.z}/{tile.x}/{tile.y}"
+            start = time.perf_counter()
+            try:
+                response = await client.get(url, params=params)
+            except httpx.HTTPError:
+                samples.append(Sample(None, time.perf_counter() - start))
+                continue
+
+            samples.append(
+                Sample(
+                    response.status_code,
+                    time.perf_counter() - start,
+                    response.num_bytes_downloaded,
+                    parse_server_timing(response.headers.get("Server-Timing")),
+                )
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(tiles) for tiles in requests])
+    return summarize(samples, time.perf_counter() - start)
+
+
+async def run(
+    url: str,
+    layers: Sequence[str],
+    tms: Sequence[TileMatrixSet],
+    patterns: Sequence[str] = ("pan", "zoom", "zipf"),
+    concurrency: Sequence[int] = (1, 8, 32),
+    requests: int = 100,
+    bbox: Optional[Sequence[float]] = None,
+    minzoom: Optional[int] = None,
+    maxzoom: Optional[int] = None,
+    seed: int = 0,
+    debug_token: Optional[str] = None,
+    params: Optional[Dict[str, str]] = None,
+    timeout: float = 30.0,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Run a scenario for each layer, TileMatrixSet, access pattern and concurrency level.
+
+    The tiles requested by each client are generated from the access pattern, within
+    the layer's bounds and zoom levels (from its TileJSON) by default. With the
+    server's debug token, the server-side phases (e.g `pool_wait`, `query`) are
+    reported from the responses' `Server-Timing` headers.
+
+    Args:
+        url (str): Server url.
+        layers (list): Layers names.
+        tms (list): TileMatrixSets.
+        patterns (list): Access patterns (`pan`, `zoom` or `zipf`).
+        concurrency (list): Numbers of concurrent clients.
+        requests (int): Number of tile requests per client.
+        bbox (list, optional): Bounding box of the requested tiles.
+        minzoom (int, optional): Min zoom level of the requested tiles.
+        maxzoom (int, optional): Max zoom level of the requested tiles.
+        seed (int): Random seed, for reproducible requests.
+        debug_token (str, optional): Server's debug token (`TIMVT_DEBUG_TOKEN`).
+        params (dict, optional): Query parameters of the tile requests.
+        timeout (float): Requests timeout (in seconds).
+        progress (callable, optional): Called with each scenario's result.
+
+    Returns:
+        list: Scenarios results.
+
+    """
+    assert httpx is not None, "'httpx' must be installed to run load tests"
+
+    headers = {"Accept-Encoding": "gzip"}
+    if debug_token:
+        headers["X-Debug-Token"] = debug_token
+
+    results: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(
+        base_url=url,
+        headers=headers,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=max(concurrency)),
+    ) as client:
+        for layer in layers:
+            for matrix_set in tms:
+                response = await client.get(
+                    f"/{matrix_set.identifier}/{layer}/tilejson.json"
+                )
+                response.raise_for_status()
+                tilejson = response.json()
+
+                tiles = TileRange(
+                    matrix_set,
+                    bbox or tilejson["bounds"],
+                    tilejson["minzoom"] if minzoom is None else minzoom,
+                    tilejson["maxzoom"] if maxzoom is None else maxzoom,
+                )
+
+                for pattern in patterns:
+                    for clients in concurrency:
+                        rng = random.Random(seed)
+                        scenario = {
+                            "layer": layer,
+                            "tms": matrix_set.identifier,
+                            "pattern": pattern,
+                            "concurrency": clients,
+                        }
+                        summary = await run_scenario(
+                            client,
+                            layer,
+                            matrix_set,
+                            [
+                                PATTERNS[pattern](tiles, requests, rng)
+                                for _ in range(clients)
+                            ],
+                            params=params,
+                        )
+                        result = {**scenario, **summary}
+                        results.append(result)
+                        if progress:
+                            progress(result)
+
+    return results
+
+
+def scenario_key(result: Dict[str, Any]) -> Tuple[str, str, str, int]:
+    """Return the scenario of a result: layer, TileMatrixSet, pattern and concurrency."""
+    return (
+        result["layer"],
+        result["tms"],
+        result["pattern"],
+        result["concurrency"],
+    )
+
+
+def compare(
+    baseline: Sequence[Dict[str, Any]],
+    results: Sequence[Dict[str, Any]],
+    metric: str = "p95",
+    max_regression: float = 0.1,
+) -> List[Dict[str, Any]]:
+    """Compare the latencies of the scenarios found in both runs.
+
+    Args:
+        baseline (list): Baseline scenarios results.
+        results (list): Scenarios results.
+        metric (str): Latency statistic (`p50`, `p95`, `p99`, `mean` or `max`).
+        max_regression (float): Relative latency increase above which a scenario is regressed.
+
+    Returns:
+        list: Baseline and current latencies, relative change and regression flag of each scenario.
+
+    """
+    reference = {scenario_key(result): result for result in baseline}
+
+    comparison: List[Dict[str, Any]] = []
+    for result in results:
+        previous = reference.get(scenario_key(result))
+        if not previous or not previous["latency"] or not result["latency"]:
+            continue
+
+        before = previous["latency"][metric]
+        after = result["latency"][metric]
+        change = (after - before) / before if before else 0.0
+        comparison.append(
+            {
+                "layer": result["layer"],
+                "tms": result["tms"],
+                "pattern": result["pattern"],
+                "concurrency": result["concurrency"],
+                "baseline": before,
+                "current": after,
+                "change": round(change, 3),
+                "regression": change > max_regression,
+            }
+        )
+
+    return comparison
@@ -0,0 +1,417 @@
+"""timvt.cache: Tile cache backends."""
+
+import abc
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Collection, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from morecantile import Tile
+
+from timvt.settings import CacheSettings
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:  # pragma: nocover
+    aioredis = None  # type: ignore
+
+
+def tile_cache_key(layer: str, tms: str, tile: Tile, **kwargs: Any) -> str:
+    """Create a cache key from a tile request.
+
+    Query parameters are sorted so that `?a=1&b=2` and `?b=2&a=1` share the same entry.
+
+    Args:
+        layer (str): Layer's id.
+        tms (str): TileMatrixSet identifier.
+        tile (morecantile.Tile): Tile object with X,Y,Z indices.
+        kwargs (any, optional): Query parameters forwarded to `Layer.get_tile`.
+
+    Returns:
+        str: cache key (e.g `public.landsat_wrs/WebMercatorQuad/0/0/0?limit=10`).
+
+    """
+    key = f"{layer}/{tms}/{tile.z}/{tile.x}/{tile.y}"
+    if kwargs:
+        key += "?" + urlencode(sorted(kwargs.items()), doseq=True)
+
+    return key
+
+
+class TileCache(metaclass=abc.ABCMeta):
+    """Tile Cache Abstract Base Class.
+
+    Attributes:
+        encoding (str, optional): Content encoding (`gzip`, `br` or `zstd`) of the cached tiles.
+
+    """
+
+    encoding: Optional[str] = None
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return cached tile data or None."""
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: bytes) -> None:
+        """Add tile data to the cache."""
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        """Remove a tile from the cache."""
+        ...
+
+    @abc.abstractmethod
+    async def clear(self) -> None:
+        """Remove all entries from the cache."""
+        ...
+
+    async def delete_tiles(
+        self, layer: str, tms: str, tiles: Optional[Sequence[Tile]] = None
+    ) -> None:
+        """Remove tiles of a layer (all the tiles by default), for all query parameters.
+
+        The default implementation only removes the entries without query parameters.
+
+        """
+        for tile in tiles or []:
+            await self.delete(tile_cache_key(layer, tms, tile))
+
+    async def delete_zooms(self, layer: str, tms: str, zooms: Collection[int]) -> None:
+        """Remove all the tiles of a layer at some zoom levels.
+
+        The default implementation removes all the layer's tiles (see `delete_tiles`).
+
+        """
+        await self.delete_tiles(layer, tms)
+
+    async def close(self) -> None:
+        """Release cache resources."""
+        pass
+
+
+class MemoryCache(TileCache):
+    """In-process LRU cache bounded by the total size (in bytes) of the tiles."""
+
+    def __init__(self, max_size: int = 256 * 1024 * 1024, ttl: Optional[int] = None):
+        """Init cache.
+
+        Args:
+            max_size (int): Maximum size (in bytes) of all the cached tiles.
+            ttl (int, optional): Time to live (in seconds) of a cache entry.
+
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self._data: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Number of cached tiles."""
+        return len(self._data)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return cached tile data or None."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires and expires < time.monotonic():
+            self._pop(key)
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        """Add tile data to the cache and evict the least recently used entries."""
+        if len(value) > self.max_size:
+            return
+
+        self._pop(key)
+
+        expires = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (expires, value)
+        self.size += len(value)
+
+        while self.size > self.max_size:
+            self._pop(next(iter(self._data)))
+
+    async def delete(self, key: str) -> None:
+        """Remove a tile from the cache."""
+        self._pop(key)
+
+    async def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self._data.clear()
+        self.size = 0
+
+    async def delete_tiles(
+        self, layer: str, tms: str, tiles: Optional[Sequence[Tile]] = None
+    ) -> None:
+        """Remove tiles of a layer (all the tiles by default), for all query parameters."""
+        prefix = f"{layer}/{tms}/"
+        paths = (
+            {tile_cache_key(layer, tms, tile) for tile in tiles}
+            if tiles is not None
+            else None
+        )
+        for key in list(self._data):
+            path = key.partition("?")[0]
+            if path.startswith(prefix) and (paths is None or path in paths):
+                self._pop(key)
+
+    async def delete_zooms(self, layer: str, tms: str, zooms: Collection[int]) -> None:
+        """Remove all the tiles of a layer at some zoom levels."""
+        prefix = f"{layer}/{tms}/"
+        levels = {str(zoom) for zoom in zooms}
+        for key in list(self._data):
+            path = key.partition("?")[0]
+            if path.startswith(prefix) and path[len(prefix) :].split("/")[0] in levels:
+                self._pop(key)
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class FileCache(TileCache):
+    """On-disk cache.
+
+    Tiles are stored in `{directory}/{layer}/{tms}/{z}/{x}/{y}/{query hash}` files.
+
+    """
+
+    def __init__(self, directory: str, ttl: Optional[int] = None):
+        """Init cache.
+
+        Args:
+            directory (str): Cache root directory.
+            ttl (int, optional): Time to live (in seconds) of a cache entry.
+
+        """
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key: str) -> str:
+        path, _, query = key.partition("?")
+        name = hashlib.sha1(query.encode()).hexdigest()
+        return os.path.join(self.directory, *path.split("/"), name)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+
+            with open(path, "rb") as f:
+                return f.read()
+
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial tiles
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+    def _remove(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return cached tile data or None."""
+        return await run_in_threadpool(self._read, key)
+
+    async def set(self, key: str, value: bytes) -> None:
+        """Add tile data to the cache."""
+        await run_in_threadpool(self._write, key, value)
+
+    async def delete(self, key: str) -> None:
+        """Remove a tile from the cache."""
+        await run_in_threadpool(self._remove, key)
+
+    async def clear(self) -> None:
+        """Remove all entries from the cache."""
+        await run_in_threadpool(shutil.rmtree, self.directory, True)
+
+    def _remove_tiles(self, layer: str, tms: str, tiles: Optional[Sequence[Tile]]):
+        root = os.path.join(self.directory, *layer.split("/"), tms)
+        if tiles is None:
+            shutil.rmtree(root, True)
+            return
+
+        for tile in tiles:
+            shutil.rmtree(
+                os.path.join(root, str(tile.z), str(tile.x), str(tile.y)), True
+            )
+
+    async def delete_tiles(
+        self, layer: str, tms: str, tiles: Optional[Sequence[Tile]] = None
+    ) -> None:
+        """Remove tiles of a layer (all the tiles by default), for all query parameters."""
+        await run_in_threadpool(self._remove_tiles, layer, tms, tiles)
+
+    def _remove_zooms(self, layer: str, tms: str, zooms: Collection[int]):
+        root = os.path.join(self.directory, *layer.split("/"), tms)
+        for zoom in zooms:
+            shutil.rmtree(os.path.join(root, str(zoom)), True)
+
+    async def delete_zooms(self, layer: str, tms: str, zooms: Collection[int]) -> None:
+        """Remove all the tiles of a layer at some zoom levels."""
+        await run_in_threadpool(self._remove_zooms, layer, tms, zooms)
+
+
+class RedisCache(TileCache):
+    """Redis cache (works with any server speaking the Redis protocol).
+
+    The keys of each tile (for all query parameters) are indexed in a
+    `{prefix}keys:{layer}/{tms}/{z}/{x}/{y}` set, the tiles of each zoom level in a
+    `{prefix}keys:{layer}/{tms}/{z}` set and the zoom levels of each layer in a
+    `{prefix}keys:{layer}/{tms}` set, so tiles can be removed without scanning the keys.
+
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        ttl: Optional[int] = None,
+        prefix: str = "timvt:",
+        client: Optional[Any] = None,
+    ):
+        """Init cache.
+
+        Args:
+            url (str, optional): Redis URL (e.g `redis://localhost:6379/0`).
+            ttl (int, optional): Time to live (in seconds) of a cache entry.
+            prefix (str): Prefix added to all the keys.
+            client (redis.asyncio.Redis, optional): Redis client to use instead of creating one from `url`.
+
+        """
+        if client is None:
+            assert aioredis is not None, "'redis' must be installed to use RedisCache"
+            assert url, "'url' or 'client' must be set to use RedisCache"
+            client = aioredis.from_url(url)
+
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return cached tile data or None."""
+        return await self.client.get(self.prefix + key)
+
+    def _index(self, path: str) -> str:
+        return f"{self.prefix}keys:{path}"
+
+    async def set(self, key: str, value: bytes) -> None:
+        """Add tile data to the cache."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self.prefix + key, value, ex=self.ttl or None)
+
+        # Index the keys of the tiles (`{layer}/{tms}/{z}/{x}/{y}?{query}` keys)
+        path = key.partition("?")[0]
+        parts = path.rsplit("/", 3)
+        if len(parts) == 4:
+            layer_tms, zoom = parts[:2]
+            for index, member in [
+                (self._index(path), self.prefix + key),
+                (self._index(f"{layer_tms}/{zoom}"), path),
+                (self._index(layer_tms), zoom),
+            ]:
+                pipe.sadd(index, member)
+                if self.ttl:
+                    pipe.expire(index, self.ttl)
+
+        await pipe.execute()
+
+    async def delete(self, key: str) -> None:
+        """Remove a tile from the cache."""
+        await self.client.delete(self.prefix + key)
+
+    async def clear(self) -> None:
+        """Remove all entries from the cache."""
+        async for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            await self.client.delete(key)
+
+    async def _delete_paths(self, paths: Sequence[str]) -> None:
+        """Remove the tiles (`{layer}/{tms}/{z}/{x}/{y}` paths) and their index."""
+        indexes = [self._index(path) for path in paths]
+        if not indexes:
+            return
+
+        pipe = self.client.pipeline(transaction=False)
+        for index in indexes:
+            pipe.smembers(index)
+        keys = [key for members in await pipe.execute() for key in members]
+        await self.client.delete(*keys, *indexes)
+
+    async def delete_tiles(
+        self, layer: str, tms: str, tiles: Optional[Sequence[Tile]] = None
+    ) -> None:
+        """Remove tiles of a layer (all the tiles by default), for all query parameters."""
+        if tiles is None:
+            zooms = await self.client.smembers(self._index(f"{layer}/{tms}"))
+            await self.delete_zooms(layer, tms, [int(zoom) for zoom in zooms])
+            return
+
+        await self._delete_paths([tile_cache_key(layer, tms, tile) for tile in tiles])
+
+    async def delete_zooms(self, layer: str, tms: str, zooms: Collection[int]) -> None:
+        """Remove all the tiles of a layer at some zoom levels."""
+        indexes = [self._index(f"{layer}/{tms}/{zoom}") for zoom in zooms]
+        if not indexes:
+            return
+
+        pipe = self.client.pipeline(transaction=False)
+        for index in indexes:
+            pipe.smembers(index)
+        paths = [path.decode() for members in await pipe.execute() for path in members]
+        await self._delete_paths(paths)
+        await self.client.delete(*indexes)
+        await self.client.srem(self._index(f"{layer}/{tms}"), *zooms)
+
+    async def close(self) -> None:
+        """Close the connection to the redis server."""
+        await self.client.close()
+
+
+def create_tile_cache(settings: Optional[CacheSettings] = None) -> Optional[TileCache]:
+    """Create a TileCache from the settings."""
+    if not settings:
+        settings = CacheSettings()
+
+    cache: TileCache
+    if settings.backend == "memory":
+        cache = MemoryCache(max_size=settings.max_size, ttl=settings.ttl)
+
+    elif settings.backend == "file":
+        assert settings.directory, "'TIMVT_CACHE_DIRECTORY' must be set"
+        cache = FileCache(settings.directory, ttl=settings.ttl)
+
+    elif settings.backend == "redis":
+        cache = RedisCache(url=settings.redis_url, ttl=settings.ttl)
+
+    else:
+        return None
+
+    cache.encoding = settings.encoding
+    return cache
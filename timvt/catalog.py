@@ -0,0 +1,488 @@
+"""timvt.catalog: lazy, incremental and refreshable table catalog."""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from buildpg import Var as pg_variable
+from buildpg import asyncpg
+from pydantic import ValidationError
+
+from timvt.concurrency import SingleFlight
+from timvt.dbmodel import OVERVIEWS_REGISTRY, get_overviews, get_table_index
+from timvt.layer import Table
+from timvt.listener import Connect, Listener
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "timvt_catalog"
+
+# `schema.table` ids, with identifiers quoted as by `format('%I.%I', ...)`
+TABLE_ID = re.compile(r'("(?:[^"]|"")+"|[^".]+)\.("(?:[^"]|"")+"|[^".]+)')
+
+# Cheap listing of the tables (no extent): a table is reloaded when its signature
+# (description, columns and indexes) changes
+TABLE_SIGNATURES_SQL = f"""
+    SELECT
+        format('%I.%I', nspname, relname) AS id,
+        nspname AS schema,
+        relname AS table,
+        md5(concat_ws(
+            '|',
+            obj_description(c.oid, 'pg_class'),
+            (
+                SELECT string_agg(
+                    format(
+                        '%s:%s:%s:%s',
+                        attnum,
+                        attname,
+                        format_type(atttypid, atttypmod),
+                        col_description(attrelid, attnum)
+                    ),
+                    ',' ORDER BY attnum
+                )
+                FROM pg_attribute
+                WHERE attrelid = c.oid AND attnum > 0 AND NOT attisdropped
+            ),
+            (
+                SELECT string_agg(pg_get_indexdef(indexrelid), ',' ORDER BY indexrelid)
+                FROM pg_index
+                WHERE indrelid = c.oid
+            )
+        )) AS signature
+    FROM
+        pg_class c
+        JOIN pg_namespace n on (c.relnamespace=n.oid)
+    WHERE
+        relkind IN ('r','v', 'm', 'f', 'p')
+        AND has_table_privilege(c.oid, 'SELECT')
+        AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        AND c.relname NOT IN ('spatial_ref_sys','geometry_columns','geography_columns','{OVERVIEWS_REGISTRY}')
+        AND (:schemas::text[] IS NULL OR n.nspname = ANY (:schemas))
+        AND (:tables::text[] IS NULL OR c.relname = ANY (:tables))
+        AND (:ids::text[] IS NULL OR format('%I.%I', nspname, relname) = ANY (:ids))
+"""
+
+EVENT_TRIGGER_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION :function() RETURNS event_trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        tablename text;
+    BEGIN
+        IF TG_EVENT = 'sql_drop' THEN
+            FOR tablename IN
+                SELECT DISTINCT format('%I.%I', schema_name, object_name)
+                FROM pg_event_trigger_dropped_objects()
+                WHERE object_type IN ('table', 'view', 'materialized view', 'foreign table')
+            LOOP
+                PERFORM pg_notify('{CHANNEL}', tablename);
+            END LOOP;
+            RETURN;
+        END IF;
+
+        -- Created or altered tables (and the tables of the created indexes)
+        FOR tablename IN
+            SELECT DISTINCT format('%I.%I', n.nspname, c.relname)
+            FROM
+                pg_event_trigger_ddl_commands() AS cmd
+                LEFT JOIN pg_index i ON (i.indexrelid = cmd.objid)
+                JOIN pg_class c ON (c.oid = coalesce(i.indrelid, cmd.objid))
+                JOIN pg_namespace n ON (n.oid = c.relnamespace)
+            WHERE
+                cmd.classid = 'pg_class'::regclass
+                AND c.relkind IN ('r', 'v', 'm', 'f', 'p')
+        LOOP
+            PERFORM pg_notify('{CHANNEL}', tablename);
+        END LOOP;
+    END;
+    $$
+"""
+
+EVENT_TRIGGERS_SQL = """
+    CREATE EVENT TRIGGER timvt_catalog_ddl ON ddl_command_end
+    EXECUTE FUNCTION :function();
+
+    CREATE EVENT TRIGGER timvt_catalog_drop ON sql_drop
+    EXECUTE FUNCTION :function();
+"""
+
+DROP_EVENT_TRIGGERS_SQL = """
+    DROP EVENT TRIGGER IF EXISTS timvt_catalog_ddl;
+    DROP EVENT TRIGGER IF EXISTS timvt_catalog_drop;
+"""
+
+
+def _unquote(identifier: str) -> str:
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+async def install_event_triggers(
+    conn: asyncpg.BuildPgConnection, schema: str = "public"
+) -> None:
+    """Create the event triggers notifying the tables' DDL changes (needs superuser privileges and PostgreSQL >= 11).
+
+    Args:
+        conn (asyncpg.BuildPgConnection): AsyncPG database connection.
+        schema (str): Schema of the trigger function.
+
+    """
+    function = pg_variable(f"{schema}.timvt_notify_ddl")
+    async with conn.transaction():
+        await conn.execute_b(EVENT_TRIGGER_FUNCTION_SQL, function=function)
+        await conn.execute(DROP_EVENT_TRIGGERS_SQL)
+        await conn.execute_b(EVENT_TRIGGERS_SQL, function=function)
+
+
+async def drop_event_triggers(conn: asyncpg.BuildPgConnection) -> None:
+    """Remove the event triggers notifying the tables' DDL changes."""
+    await conn.execute(DROP_EVENT_TRIGGERS_SQL)
+
+
+class TableCatalog(MutableMapping[str, Table]):
+    """Table catalog (`{table id: Table}`), loaded lazily and refreshed incrementally.
+
+    Tables are loaded on first access (`get_table`, with `lookup`) or by `refresh`, which lists the
+    tables with a cheap query and reloads (with `get_table_index`) only the new tables,
+    the tables whose description, columns or indexes changed and the tables whose
+    overviews changed, and removes the dropped tables. Refreshes run in the background
+    every `interval` seconds (`start`) and tables are reloaded when notified by the DDL
+    event triggers created with `install_event_triggers` (`listen`, on a dedicated
+    connection which is re-opened, followed by a full refresh, when lost).
+
+    The mapping only holds the loaded tables, as `Table` layers validated once when
+    loaded and shared across requests.
+
+    Attributes:
+        pool (asyncpg.BuildPgPool): Connection pool.
+        schemas (list, optional): Schemas of the tables.
+        tables (list, optional): Names of the tables.
+        spatial (bool): Only keep tables with a geometry column.
+        missing_ttl (float): Time (in seconds) during which tables not found are not looked up again.
+        max_missing (int): Max number of tables not found remembered.
+        lookup (bool): Look up the tables not in the catalog on first access.
+        stats (dict): Number of refreshes, loaded tables, notifications and errors.
+
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.BuildPgPool,
+        schemas: Optional[List[str]] = ["public"],
+        tables: Optional[List[str]] = None,
+        spatial: bool = True,
+        missing_ttl: float = 60.0,
+        max_missing: int = 10000,
+        lookup: bool = True,
+        observe_refresh: Optional[Callable[[float], None]] = None,
+    ):
+        """Init catalog.
+
+        Args:
+            pool (asyncpg.BuildPgPool): Connection pool.
+            schemas (list, optional): Schemas of the tables (all schemas if None).
+            tables (list, optional): Names of the tables (all tables if None).
+            spatial (bool): Only keep tables with a geometry column.
+            missing_ttl (float): Time (in seconds) during which tables not found are not looked up again.
+            max_missing (int): Max number of tables not found remembered (the oldest are forgotten first).
+            lookup (bool): Look up the tables not in the catalog on first access (e.g tables created after a full load, when the catalog is not refreshed).
+            observe_refresh (callable, optional): Called with the duration (in seconds) of each refresh.
+
+        """
+        self.pool = pool
+        self.schemas = schemas
+        self.tables = tables
+        self.spatial = spatial
+        self.missing_ttl = missing_ttl
+        self.max_missing = max_missing
+        self.lookup = lookup
+        self.observe_refresh = observe_refresh
+
+        self.stats: Dict[str, int] = {
+            "refreshes": 0,
+            "loads": 0,
+            "notifications": 0,
+            "errors": 0,
+        }
+
+        self._entries: Dict[str, Table] = {}
+        # Signatures of the loaded tables (including the ones not in the catalog,
+        # e.g non-spatial or overview tables)
+        self._signatures: Dict[str, str] = {}
+        # Tables not found: {table id: time after which they are looked up again},
+        # in expiration order
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._flights = SingleFlight()
+        self._notified: Set[str] = set()
+        self._event: Optional[asyncio.Event] = None
+        self._listener: Optional[Listener] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def __getitem__(self, key: str) -> Table:
+        """Return a loaded table."""
+        return self._entries[key]
+
+    def __setitem__(self, key: str, value: Table) -> None:
+        """Set a table."""
+        self._entries[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        """Remove a table."""
+        del self._entries[key]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the loaded tables ids."""
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        """Number of loaded tables."""
+        return len(self._entries)
+
+    def _in_scope(self, table_id: str) -> bool:
+        """Check the table id is in the catalog's schemas and tables."""
+        match = TABLE_ID.fullmatch(table_id)
+        if match is None:
+            return False
+
+        schema, name = (_unquote(identifier) for identifier in match.groups())
+        if self.schemas is not None and schema not in self.schemas:
+            return False
+
+        if self.tables is not None and name not in self.tables:
+            return False
+
+        return True
+
+    def _set_missing(self, table_id: str, expires: float) -> None:
+        """Remember a table not found, forgetting the expired and the oldest entries."""
+        self._missing.pop(table_id, None)
+        self._missing[table_id] = expires
+
+        now = time.monotonic()
+        while self._missing and (
+            len(self._missing) > self.max_missing
+            or next(iter(self._missing.values())) <= now
+        ):
+            self._missing.popitem(last=False)
+
+    async def get_table(self, table_id: str) -> Optional[Table]:
+        """Return a table, loading it if needed (None if not found)."""
+        table = self._entries.get(table_id)
+        if table is not None:
+            return table
+
+        if not self.lookup or not self._in_scope(table_id):
+            return None
+
+        if self._missing.get(table_id, 0.0) > time.monotonic():
+            return None
+
+        await self._flights.do(table_id, lambda: self.load([table_id]))
+        return self._entries.get(table_id)
+
+    async def _signatures_of(
+        self, ids: Optional[Iterable[str]] = None
+    ) -> Dict[str, Tuple[str, str, str]]:
+        """Fetch `{table id: (schema, table name, signature)}` of the tables (all the tables if `ids` is None)."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch_b(
+                TABLE_SIGNATURES_SQL,
+                schemas=self.schemas,
+                tables=self.tables,
+                ids=list(ids) if ids is not None else None,
+            )
+
+        return {
+            row["id"]: (row["schema"], row["table"], row["signature"]) for row in rows
+        }
+
+    async def _load(self, tables: Dict[str, Tuple[str, str, str]]) -> None:
+        """Load tables (`{table id: (schema, table name, signature)}`), one query per schema."""
+        by_schema: Dict[str, List[str]] = {}
+        for schema, name, _ in tables.values():
+            by_schema.setdefault(schema, []).append(name)
+
+        for schema, names in by_schema.items():
+            index = await get_table_index(
+                self.pool, schemas=[schema], tables=names, spatial=self.spatial
+            )
+            for table_id, (table_schema, _, signature) in tables.items():
+                if table_schema != schema:
+                    continue
+
+                self._signatures[table_id] = signature
+                self._missing.pop(table_id, None)
+                table = None
+                if table_id in index:
+                    try:
+                        table = Table(**index[table_id])
+                    except ValidationError as e:
+                        logger.warning(f"Invalid table '{table_id}': {e}")
+
+                if table is not None:
+                    self._entries[table_id] = table
+                else:
+                    # e.g non-spatial, overview or invalid table
+                    self._entries.pop(table_id, None)
+                    self._set_missing(table_id, time.monotonic() + self.missing_ttl)
+
+        self.stats["loads"] += len(tables)
+
+    def _remove(self, table_ids: Iterable[str]) -> None:
+        """Remove dropped (or not found) tables."""
+        expires = time.monotonic() + self.missing_ttl
+        for table_id in table_ids:
+            self._entries.pop(table_id, None)
+            self._signatures.pop(table_id, None)
+            self._set_missing(table_id, expires)
+
+    async def load(self, table_ids: Iterable[str]) -> None:
+        """(Re)load tables, removing the tables not found."""
+        table_ids = set(table_ids)
+        tables = await self._signatures_of(table_ids)
+        self._remove(table_ids - set(tables))
+        if tables:
+            await self._load(tables)
+
+    async def refresh(self) -> None:
+        """Load the new and modified tables and remove the dropped tables."""
+        start = time.perf_counter()
+
+        tables = await self._signatures_of()
+        self._remove(set(self._signatures) - set(tables))
+
+        modified = {
+            table_id: table
+            for table_id, table in tables.items()
+            if self._signatures.get(table_id) != table[2]
+        }
+
+        # Tables whose overviews were added or removed
+        async with self.pool.acquire() as conn:
+            overviews = await get_overviews(conn, schemas=self.schemas)
+
+        sources: Dict[str, List[Dict[str, Any]]] = {}
+        for overview in overviews:
+            source = overview.pop("source")
+            sources.setdefault(source, []).append(overview)
+
+        for table_id, table in self._entries.items():
+            if [o.dict() for o in table.overviews] != sources.get(table_id, []):
+                if table_id in tables:
+                    modified[table_id] = tables[table_id]
+
+        if modified:
+            await self._load(modified)
+
+        self.stats["refreshes"] += 1
+        if self.observe_refresh is not None:
+            self.observe_refresh(time.perf_counter() - start)
+
+    async def _refresh_every(self, interval: Optional[float], initial: bool) -> None:
+        if not initial:
+            await asyncio.sleep(interval)  # type: ignore
+
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:  # noqa
+                self.stats["errors"] += 1
+                logger.error(f"Could not refresh the table catalog: {e}")
+
+            if interval is None:
+                return
+
+            await asyncio.sleep(interval)
+
+    def _on_notification(self, conn: Any, pid: int, channel: str, payload: str):
+        self.stats["notifications"] += 1
+        self._notified.add(payload)
+        self._missing.pop(payload, None)
+        if self._event is not None:
+            self._event.set()
+
+    async def _consume(self, delay: float) -> None:
+        while True:
+            await self._event.wait()  # type: ignore
+            # Wait for the other statements of a migration
+            await asyncio.sleep(delay)
+            self._event.clear()  # type: ignore
+
+            table_ids, self._notified = self._notified, set()
+            try:
+                await self.load(table_ids)
+            except Exception as e:  # noqa
+                self.stats["errors"] += 1
+                logger.error(f"Could not reload tables {sorted(table_ids)}: {e}")
+
+    def start(self, interval: Optional[float], initial: bool = False) -> None:
+        """Refresh the catalog every `interval` seconds in a background task.
+
+        Args:
+            interval (float, optional): Time (in seconds) between the refreshes (no periodic refresh if None).
+            initial (bool): Refresh the catalog immediately (e.g to load the tables without delaying the startup).
+
+        """
+        if interval is None and not initial:
+            return
+
+        self._tasks.append(asyncio.create_task(self._refresh_every(interval, initial)))
+
+    async def _on_reconnect(self, conn: asyncpg.BuildPgConnection) -> None:
+        # DDL changes notified while disconnected are lost
+        try:
+            await self.refresh()
+        except Exception as e:  # noqa
+            self.stats["errors"] += 1
+            logger.error(f"Could not refresh the table catalog: {e}")
+
+    async def listen(
+        self, connect: Connect, delay: float = 0.5, retry_interval: float = 5.0
+    ) -> None:
+        """Reload the tables notified by the DDL event triggers, on a dedicated connection.
+
+        Args:
+            connect (callable): Open the connection to listen on (outside of the pool, e.g `timvt.db.connect`).
+            delay (float): Time (in seconds) to wait for other notifications before reloading the tables.
+            retry_interval (float): Time (in seconds) between the reconnection attempts when the connection is lost.
+
+        """
+        self._event = asyncio.Event()
+        self._listener = Listener(
+            connect,
+            CHANNEL,
+            self._on_notification,
+            on_reconnect=self._on_reconnect,
+            retry_interval=retry_interval,
+        )
+        await self._listener.start()
+        self._tasks.append(asyncio.create_task(self._consume(delay)))
+
+    async def stop(self) -> None:
+        """Stop the background refreshes and stop listening."""
+        if self._listener is not None:
+            await self._listener.stop()
+            self._listener = None
+
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
@@ -0,0 +1,552 @@
+"""timvt.changes: track tables changes and invalidate the modified tiles."""
+
+import abc
+import asyncio
+import inspect
+import json
+import logging
+import math
+import urllib.request
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import morecantile
+from buildpg import Var as pg_variable
+from buildpg import asyncpg, check_word
+
+from timvt.db import connect
+from timvt.listener import Connect, Listener
+from timvt.settings import ChangesSettings
+
+from fastapi import FastAPI
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "timvt_changes"
+
+# Max number of bounding boxes for one statement (above, the extent of the changes is sent)
+MAX_BBOXES = 1000
+
+# Number of bounding boxes per notification (payloads are limited to 8000 bytes)
+BBOXES_PER_NOTIFICATION = 50
+
+# Max zoom level of the cached tiles removed outside of the invalidated zoom levels
+MAX_ZOOM = 30
+
+TRIGGER_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION :function() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        tablename text := format('%I.%I', TG_TABLE_SCHEMA, TG_TABLE_NAME);
+        geoms text;
+        payload text;
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            PERFORM pg_notify(
+                '{CHANNEL}', json_build_object('table', tablename, 'bboxes', NULL)::text
+            );
+            RETURN NULL;
+        END IF;
+
+        IF TG_OP = 'INSERT' THEN
+            geoms := format('SELECT %1$I::geometry AS geom FROM new_rows', TG_ARGV[0]);
+        ELSIF TG_OP = 'DELETE' THEN
+            geoms := format('SELECT %1$I::geometry AS geom FROM old_rows', TG_ARGV[0]);
+        ELSE
+            geoms := format(
+                'SELECT %1$I::geometry AS geom FROM new_rows UNION ALL SELECT %1$I::geometry FROM old_rows',
+                TG_ARGV[0]
+            );
+        END IF;
+
+        -- Bounding boxes (in WGS84) of the modified rows
+        FOR payload IN EXECUTE format($sql$
+            WITH
+            boxes AS (
+                SELECT ST_Transform(ST_Envelope(geom), 4326)::box2d AS box
+                FROM (%s) AS g
+                WHERE geom IS NOT NULL AND NOT ST_IsEmpty(geom) AND ST_SRID(geom) != 0
+            ),
+            merged AS (
+                SELECT box FROM boxes
+                WHERE (SELECT count(*) FROM boxes) <= {MAX_BBOXES}
+                UNION ALL
+                SELECT ST_Extent(box::geometry)::box2d FROM boxes
+                WHERE (SELECT count(*) FROM boxes) > {MAX_BBOXES}
+            )
+            SELECT json_build_object(
+                'table', %L,
+                'bboxes', json_agg(
+                    json_build_array(ST_XMin(box), ST_YMin(box), ST_XMax(box), ST_YMax(box))
+                )
+            )::text
+            FROM (
+                SELECT box, (row_number() OVER () - 1) / {BBOXES_PER_NOTIFICATION} AS chunk
+                FROM merged
+                WHERE box IS NOT NULL
+            ) AS b
+            GROUP BY chunk
+        $sql$, geoms, tablename)
+        LOOP
+            PERFORM pg_notify('{CHANNEL}', payload);
+        END LOOP;
+
+        RETURN NULL;
+    END;
+    $$
+"""
+
+TRIGGERS_SQL = """
+    CREATE TRIGGER timvt_changes_insert AFTER INSERT ON :table
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION :function(:geometry_column);
+
+    CREATE TRIGGER timvt_changes_update AFTER UPDATE ON :table
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION :function(:geometry_column);
+
+    CREATE TRIGGER timvt_changes_delete AFTER DELETE ON :table
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION :function(:geometry_column);
+
+    CREATE TRIGGER timvt_changes_truncate AFTER TRUNCATE ON :table
+    FOR EACH STATEMENT EXECUTE FUNCTION :function(:geometry_column);
+"""
+
+DROP_TRIGGERS_SQL = """
+    DROP TRIGGER IF EXISTS timvt_changes_insert ON :table;
+    DROP TRIGGER IF EXISTS timvt_changes_update ON :table;
+    DROP TRIGGER IF EXISTS timvt_changes_delete ON :table;
+    DROP TRIGGER IF EXISTS timvt_changes_truncate ON :table;
+"""
+
+# Tables with the triggers notifying their changes
+TRACKED_TABLES_SQL = """
+    SELECT DISTINCT format('%I.%I', n.nspname, c.relname)
+    FROM
+        pg_trigger t
+        JOIN pg_class c ON (c.oid = t.tgrelid)
+        JOIN pg_namespace n ON (n.oid = c.relnamespace)
+    WHERE t.tgname = 'timvt_changes_insert'
+"""
+
+
+async def install_triggers(
+    conn: asyncpg.BuildPgConnection, table: str, geometry_column: str
+) -> None:
+    """Create the triggers notifying the changes of a table (needs PostgreSQL >= 11).
+
+    Args:
+        conn (asyncpg.BuildPgConnection): AsyncPG database connection.
+        table (str): Table id (`schema.table`).
+        geometry_column (str): Geometry column of the modified features.
+
+    """
+    schema = table.rpartition(".")[0] or "public"
+    identifiers = {
+        "table": pg_variable(table),
+        "function": pg_variable(f"{schema}.timvt_notify_changes"),
+    }
+    async with conn.transaction():
+        await conn.execute_b(TRIGGER_FUNCTION_SQL, **identifiers)
+        await conn.execute_b(DROP_TRIGGERS_SQL, **identifiers)
+        # Trigger arguments must be string literals
+        check_word(geometry_column)
+        await conn.execute_b(
+            TRIGGERS_SQL.replace(":geometry_column", f"'{geometry_column}'"),
+            **identifiers,
+        )
+
+
+async def drop_triggers(conn: asyncpg.BuildPgConnection, table: str) -> None:
+    """Remove the triggers notifying the changes of a table."""
+    await conn.execute_b(DROP_TRIGGERS_SQL, table=pg_variable(table))
+
+
+@dataclass
+class Invalidation:
+    """Tiles of a layer to invalidate.
+
+    Attributes:
+        layer (str): Layer's id (e.g `public.landsat_wrs`).
+        tms (str): TileMatrixSet identifier.
+        tiles (list, optional): Invalidated tiles (None when all the layer's tiles are invalidated).
+        bboxes (list, optional): Bounding boxes (in WGS84) of the modified features (None when unknown, e.g `TRUNCATE`).
+
+    """
+
+    layer: str
+    tms: str
+    tiles: Optional[List[morecantile.Tile]]
+    bboxes: Optional[List[List[float]]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return JSON serializable invalidation."""
+        return {
+            "layer": self.layer,
+            "tms": self.tms,
+            "tiles": [f"{t.z}/{t.x}/{t.y}" for t in self.tiles]
+            if self.tiles is not None
+            else None,
+        }
+
+
+class ChangeSink(metaclass=abc.ABCMeta):
+    """Invalidated tiles receiver."""
+
+    @abc.abstractmethod
+    async def send(self, invalidations: Sequence[Invalidation]) -> None:
+        """Receive invalidated tiles."""
+        ...
+
+    async def close(self) -> None:
+        """Release sink resources."""
+        pass
+
+
+class CallbackSink(ChangeSink):
+    """Call a function (or coroutine function) with the invalidated tiles."""
+
+    def __init__(self, callback: Callable[[Sequence[Invalidation]], Any]):
+        """Init sink."""
+        self.callback = callback
+
+    async def send(self, invalidations: Sequence[Invalidation]) -> None:
+        """Call the callback."""
+        result = self.callback(invalidations)
+        if inspect.isawaitable(result):
+            await result
+
+
+class ApplicationSink(ChangeSink):
+    """Remove invalidated tiles from the application's tile cache (`app.state.tile_cache`), change the tables versions (`app.state.table_versions`) and update the tile occupancy indexes (`app.state.tile_occupancy`)."""
+
+    def __init__(self, app: FastAPI, minzoom: int = 0, maxzoom: Optional[int] = None):
+        """Init sink.
+
+        Args:
+            app (fastapi.FastAPI): Application.
+            minzoom (int): Min zoom level of the invalidated tiles.
+            maxzoom (int, optional): Max zoom level of the invalidated tiles. The cached tiles of the modified layers outside of the zoom levels range are all removed.
+
+        """
+        self.app = app
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+
+    async def send(self, invalidations: Sequence[Invalidation]) -> None:
+        """Purge the application's tile cache."""
+        versions = getattr(self.app.state, "table_versions", None)
+        occupancy = getattr(self.app.state, "tile_occupancy", None) or {}
+        cache = getattr(self.app.state, "tile_cache", None)
+
+        for inv in {inv.layer: inv for inv in invalidations}.values():
+            if versions is not None:
+                versions.bump(inv.layer)
+
+            # Known empty tiles might not be empty anymore
+            index = occupancy.get(inv.layer)
+            if index is not None and inv.bboxes is not None:
+                if not index.add(inv.bboxes):
+                    logger.warning(f"Tile occupancy index of {inv.layer} is removed.")
+                    occupancy.pop(inv.layer)
+
+        if cache is not None:
+            outside = [
+                zoom
+                for zoom in range(MAX_ZOOM + 1)
+                if zoom < self.minzoom
+                or (self.maxzoom is not None and zoom > self.maxzoom)
+            ]
+            for inv in invalidations:
+                await cache.delete_tiles(inv.layer, inv.tms, inv.tiles)
+                if inv.tiles is not None and outside:
+                    await cache.delete_zooms(inv.layer, inv.tms, outside)
+
+
+class LogFileSink(ChangeSink):
+    """Append invalidated tiles (`{layer} {tms} {z}/{x}/{y}` lines, `*` for all the tiles) to a file."""
+
+    def __init__(self, path: str):
+        """Init sink."""
+        self.path = path
+
+    def _write(self, invalidations: Sequence[Invalidation]) -> None:
+        with open(self.path, "a") as f:
+            for inv in invalidations:
+                if inv.tiles is None:
+                    f.write(f"{inv.layer} {inv.tms} *\n")
+                    continue
+
+                for t in inv.tiles:
+                    f.write(f"{inv.layer} {inv.tms} {t.z}/{t.x}/{t.y}\n")
+
+    async def send(self, invalidations: Sequence[Invalidation]) -> None:
+        """Append tiles to the file."""
+        await run_in_threadpool(self._write, invalidations)
+
+
+class HTTPSink(ChangeSink):
+    """POST invalidated tiles to a purge url.
+
+    The request body is a JSON list of `{"layer": ..., "tms": ..., "tiles": ["z/x/y", ...]}`
+    objects (`"tiles": null` when all the layer's tiles are invalidated).
+
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 10.0,
+    ):
+        """Init sink."""
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+
+    def _post(self, body: bytes) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            headers={"Content-Type": "application/json", **self.headers},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    async def send(self, invalidations: Sequence[Invalidation]) -> None:
+        """Send tiles to the purge url."""
+        body = json.dumps([inv.to_dict() for inv in invalidations]).encode()
+        await run_in_threadpool(self._post, body)
+
+
+class ChangeTracker:
+    """Listen to the tables changes and send the invalidated tiles to sinks.
+
+    Changes are notified (on the `timvt_changes` channel) with the bounding boxes of the
+    modified features, by the triggers created with `install_triggers`. Notifications
+    are received on a dedicated connection, re-opened when lost: as the changes made
+    while disconnected are unknown, all the tiles of the tracked tables are then
+    invalidated.
+
+    """
+
+    def __init__(
+        self,
+        tms: Sequence[morecantile.TileMatrixSet],
+        sinks: Sequence[ChangeSink],
+        minzoom: int = 0,
+        maxzoom: int = 16,
+        max_tiles: int = 10000,
+        padding: int = 1,
+    ):
+        """Init tracker.
+
+        Args:
+            tms (list of morecantile.TileMatrixSet): TileMatrixSets of the invalidated tiles.
+            sinks (list of ChangeSink): Invalidated tiles receivers.
+            minzoom (int): Min zoom level of the invalidated tiles.
+            maxzoom (int): Max zoom level of the invalidated tiles.
+            max_tiles (int): Maximum number of tiles for a change, above which all the layer's tiles are invalidated.
+            padding (int): Number of neighbouring tiles to invalidate (features are drawn in the tiles' buffer).
+
+        """
+        self.tms = tms
+        self.sinks = sinks
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+        self.max_tiles = max_tiles
+        self.padding = padding
+
+        self.stats: Dict[str, int] = {
+            "notifications": 0,
+            "invalidations": 0,
+            "tiles": 0,
+            "layers": 0,
+            "errors": 0,
+        }
+
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._listener: Optional[Listener] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def tiles(
+        self, bboxes: Sequence[Sequence[float]], tms: morecantile.TileMatrixSet
+    ) -> Optional[List[morecantile.Tile]]:
+        """Return the tiles intersecting bounding boxes (None if above `max_tiles`)."""
+        bbox: morecantile.BoundingBox = tms.bbox  # type: ignore
+
+        ranges: Set[Tuple[int, int, int, int, int]] = set()
+        count = 0
+        for zoom in range(self.minzoom, self.maxzoom + 1):
+            matrix = tms.matrix(zoom)
+            for west, south, east, north in bboxes:
+                west, east = max(west, bbox.left), min(east, bbox.right)
+                south, north = max(south, bbox.bottom), min(north, bbox.top)
+                if west > east or south > north:
+                    continue
+
+                ul = tms.tile(west, north, zoom)
+                lr = tms.tile(east, south, zoom)
+                minx = max(min(ul.x, lr.x) - self.padding, 0)
+                maxx = min(max(ul.x, lr.x) + self.padding, matrix.matrixWidth - 1)
+                miny = max(min(ul.y, lr.y) - self.padding, 0)
+                maxy = min(max(ul.y, lr.y) + self.padding, matrix.matrixHeight - 1)
+
+                count += (maxx - minx + 1) * (maxy - miny + 1)
+                if count > self.max_tiles:
+                    return None
+
+                ranges.add((zoom, minx, maxx, miny, maxy))
+
+        tiles: Set[morecantile.Tile] = set()
+        for zoom, minx, maxx, miny, maxy in ranges:
+            tiles.update(
+                morecantile.Tile(x, y, zoom)
+                for x in range(minx, maxx + 1)
+                for y in range(miny, maxy + 1)
+            )
+
+        return sorted(tiles, key=lambda t: (t.z, t.x, t.y))
+
+    def invalidations(
+        self, layer: str, bboxes: Optional[Sequence[Sequence[float]]]
+    ) -> List[Invalidation]:
+        """Return the invalidated tiles of a layer, for each TileMatrixSet.
+
+        All the layer's tiles are invalidated when `bboxes` is None (e.g `TRUNCATE`).
+
+        """
+        if bboxes is None:
+            return [Invalidation(layer, tms.identifier, None) for tms in self.tms]
+
+        finite = [list(bbox) for bbox in bboxes if all(math.isfinite(v) for v in bbox)]
+        return [
+            Invalidation(layer, tms.identifier, self.tiles(finite, tms), finite)
+            for tms in self.tms
+        ]
+
+    async def _send(self, invalidations: Sequence[Invalidation]) -> None:
+        for inv in invalidations:
+            self.stats["invalidations"] += 1
+            if inv.tiles is None:
+                self.stats["layers"] += 1
+            else:
+                self.stats["tiles"] += len(inv.tiles)
+
+        for sink in self.sinks:
+            try:
+                await sink.send(invalidations)
+            except Exception as e:  # noqa
+                self.stats["errors"] += 1
+                logger.error(f"Could not send invalidated tiles to {sink}: {e}")
+
+    async def handle(self, payload: str) -> None:
+        """Send the invalidated tiles of a change notification to the sinks."""
+        self.stats["notifications"] += 1
+
+        change = json.loads(payload)
+        await self._send(self.invalidations(change["table"], change["bboxes"]))
+
+    async def flush(self, layers: Sequence[str]) -> None:
+        """Invalidate all the tiles of the layers."""
+        await self._send(
+            [inv for layer in layers for inv in self.invalidations(layer, None)]
+        )
+
+    async def _on_reconnect(self, conn: asyncpg.BuildPgConnection) -> None:
+        # Changes notified while disconnected are lost
+        tables = [row[0] for row in await conn.fetch(TRACKED_TABLES_SQL)]
+        logger.warning(f"Invalidating all the tiles of {tables} after a reconnection.")
+        await self.flush(tables)
+
+    def _on_notification(self, conn: Any, pid: int, channel: str, payload: str):
+        self._queue.put_nowait(payload)
+
+    async def _consume(self) -> None:
+        while True:
+            payload = await self._queue.get()
+            try:
+                await self.handle(payload)
+            except Exception as e:  # noqa
+                self.stats["errors"] += 1
+                logger.error(f"Invalid change notification {payload!r}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """Wait for the received notifications to be processed."""
+        await self._queue.join()
+
+    async def start(self, connect: Connect, retry_interval: float = 5.0) -> None:
+        """Listen to the changes, on a dedicated connection.
+
+        Args:
+            connect (callable): Open the connection to listen on (outside of the pool, e.g `timvt.db.connect`).
+            retry_interval (float): Time (in seconds) between the reconnection attempts when the connection is lost.
+
+        """
+        self._listener = Listener(
+            connect,
+            CHANNEL,
+            self._on_notification,
+            on_reconnect=self._on_reconnect,
+            retry_interval=retry_interval,
+        )
+        await self._listener.start()
+        self._task = asyncio.create_task(self._consume())
+
+    async def stop(self) -> None:
+        """Stop listening and close the sinks."""
+        if self._listener is not None:
+            await self._listener.stop()
+            self._listener = None
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for sink in self.sinks:
+            await sink.close()
+
+
+async def register_change_tracker(
+    app: FastAPI, settings: Optional[ChangesSettings] = None
+) -> None:
+    """Start a change tracker (`app.state.change_tracker`) if enabled in the settings.
+
+    Invalidated tiles are removed from the application's tile cache and, optionally,
+    appended to a log file and sent to a purge url.
+
+    """
+    if not settings:
+        settings = ChangesSettings()
+
+    if not settings.enabled:
+        app.state.change_tracker = None
+        return
+
+    sinks: List[ChangeSink] = [
+        ApplicationSink(app, minzoom=settings.minzoom, maxzoom=settings.maxzoom)
+    ]
+    if settings.log_file:
+        sinks.append(LogFileSink(settings.log_file))
+    if settings.purge_url:
+        sinks.append(HTTPSink(settings.purge_url))
+
+    tracker = ChangeTracker(
+        [morecantile.tms.get(identifier) for identifier in settings.tms],
+        sinks,
+        minzoom=settings.minzoom,
+        maxzoom=settings.maxzoom,
+        max_tiles=settings.max_tiles,
+    )
+    await tracker.start(getattr(app.state, "connect", connect))
+    app.state.change_tracker = tracker
@@ -0,0 +1,531 @@
+"""timvt.cli: command line interface."""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from buildpg import asyncpg
+from morecantile import tms as morecantile_tms
+
+from timvt import __version__ as timvt_version
+from timvt import bench as timvt_bench
+from timvt.catalog import drop_event_triggers, install_event_triggers
+from timvt.changes import drop_triggers, install_triggers
+from timvt.db import create_pool
+from timvt.dbmodel import get_table_index
+from timvt.layer import Function, Layer, Table
+from timvt.overviews import create_overviews
+from timvt.seed import SeedStats, seed_archive
+from timvt.settings import ApiSettings, PostgresSettings
+
+
+def _bbox(value: str) -> List[float]:
+    """Parse `minx,miny,maxx,maxy` bounding box."""
+    bbox = [float(v) for v in value.split(",")]
+    if len(bbox) != 4:
+        raise argparse.ArgumentTypeError("bbox must be `minx,miny,maxx,maxy`")
+
+    return bbox
+
+
+def _param(value: str) -> Tuple[str, str]:
+    """Parse `key=value` parameter."""
+    key, sep, val = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("parameter must be `key=value`")
+
+    return key, val
+
+
+def _zooms(value: str) -> Tuple[int, int]:
+    """Parse `minzoom-maxzoom` zoom range."""
+    minzoom, sep, maxzoom = value.partition("-")
+    try:
+        zooms = (int(minzoom), int(maxzoom if sep else minzoom))
+    except ValueError:
+        raise argparse.ArgumentTypeError("zoom range must be `minzoom-maxzoom`")
+
+    if zooms[0] > zooms[1]:
+        raise argparse.ArgumentTypeError("zoom range must be `minzoom-maxzoom`")
+
+    return zooms
+
+
+async def get_layer(
+    pool: asyncpg.BuildPgPool,
+    name: str,
+    functions_directory: Optional[str] = None,
+) -> Layer:
+    """Find a Function (from the functions directory) or a Table layer."""
+    if functions_directory:
+        infile = os.path.join(functions_directory, f"{name}.sql")
+        if os.path.exists(infile):
+            return Function.from_file(id=name, infile=infile)
+
+    schema, _, table = name.rpartition(".")
+    catalog = await get_table_index(pool, schemas=[schema or "public"], tables=[table])
+    if name in catalog:
+        return Table(**catalog[name])
+
+    raise ValueError(f"Table/Function '{name}' not found.")
+
+
+def _print_progress(stats: SeedStats, _last: List[float] = [0.0]) -> None:
+    # print at most once per second
+    if time.monotonic() - _last[0] >= 1:
+        _last[0] = time.monotonic()
+        print(f"\r{stats}", end="", file=sys.stderr, flush=True)
+
+
+async def seed(args: argparse.Namespace) -> None:
+    """Seed a layer in an archive."""
+    pool = await create_pool(
+        PostgresSettings(), min_size=1, max_size=max(args.concurrency, 1)
+    )
+    try:
+        layer = await get_layer(pool, args.layer, args.functions_directory)
+        stats = await seed_archive(
+            pool,
+            layer,
+            morecantile_tms.get(args.tms),
+            args.output,
+            bbox=args.bbox,
+            minzoom=args.minzoom,
+            maxzoom=args.maxzoom,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            progress=None if args.quiet else _print_progress,
+            **dict(args.params),
+        )
+    finally:
+        await pool.close()
+
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(stats)
+
+
+async def overviews(args: argparse.Namespace) -> None:
+    """Create Table overviews."""
+    pool = await create_pool(PostgresSettings(), min_size=1, max_size=1)
+    try:
+        layer = await get_layer(pool, args.table)
+        if not isinstance(layer, Table):
+            raise ValueError(f"Table '{args.table}' not found.")
+
+        created = await create_overviews(
+            pool,
+            layer,
+            morecantile_tms.get(args.tms),
+            args.zooms,
+            simplify=args.simplify,
+            min_area=args.min_area,
+            cluster=args.cluster,
+            geometry_column=args.geom,
+        )
+    finally:
+        await pool.close()
+
+    for overview in created:
+        print(f"{overview.table} (zooms {overview.minzoom}-{overview.maxzoom})")
+
+
+async def triggers(args: argparse.Namespace) -> None:
+    """Create (or remove) change tracking triggers."""
+    pool = await create_pool(PostgresSettings(), min_size=1, max_size=1)
+    try:
+        layer = await get_layer(pool, args.table)
+        if not isinstance(layer, Table):
+            raise ValueError(f"Table '{args.table}' not found.")
+
+        async with pool.acquire() as conn:
+            if args.drop:
+                await drop_triggers(conn, layer.id)
+                return
+
+            column = layer.get_geometry_column(args.geom)
+            if not column:
+                raise ValueError(f"Invalid Geometry Column: {args.geom}.")
+
+            await install_triggers(conn, layer.id, column.name)
+    finally:
+        await pool.close()
+
+
+async def catalog_triggers(args: argparse.Namespace) -> None:
+    """Create (or remove) table catalog event triggers."""
+    pool = await create_pool(PostgresSettings(), min_size=1, max_size=1)
+    try:
+        async with pool.acquire() as conn:
+            if args.drop:
+                await drop_event_triggers(conn)
+                return
+
+            await install_event_triggers(conn, schema=args.schema)
+    finally:
+        await pool.close()
+
+
+async def bench_tables(args: argparse.Namespace) -> None:
+    """Create synthetic tables for load tests."""
+    pool = await create_pool(PostgresSettings(), min_size=1, max_size=1)
+    try:
+        for geometry_type in args.geometry_types or list(timvt_bench.GEOMETRY_TYPES):
+            table = timvt_bench.synthetic_table_name(
+                geometry_type, args.rows, schema=args.schema
+            )
+            await timvt_bench.create_synthetic_table(
+                pool,
+                table,
+                geometry_type=geometry_type,
+                rows=args.rows,
+                bbox=args.bbox,
+                size=args.size,
+                seed=args.seed,
+            )
+            print(table)
+    finally:
+        await pool.close()
+
+
+def _print_scenario(result: Dict[str, Any]) -> None:
+    latency = result["latency"] or {}
+    pool_wait = result["timings"].get("pool_wait", {})
+    print(
+        f"{result['layer']} {result['tms']} {result['pattern']} "
+        f"x{result['concurrency']}: {result['throughput']:.1f} req/s, "
+        f"p50={latency.get('p50', 0):.1f}ms p95={latency.get('p95', 0):.1f}ms "
+        f"p99={latency.get('p99', 0):.1f}ms, errors={result['errors']}"
+        + (f", pool_wait p95={pool_wait['p95']:.1f}ms" if pool_wait else ""),
+        file=sys.stderr,
+    )
+
+
+async def bench(args: argparse.Namespace) -> None:
+    """Run load tests against a server."""
+    results = await timvt_bench.run(
+        args.url,
+        args.layers,
+        [morecantile_tms.get(name) for name in args.tms or ["WebMercatorQuad"]],
+        patterns=args.patterns or list(timvt_bench.PATTERNS),
+        concurrency=args.concurrency or [1, 8, 32],
+        requests=args.requests,
+        bbox=args.bbox,
+        minzoom=args.minzoom,
+        maxzoom=args.maxzoom,
+        seed=args.seed,
+        debug_token=args.debug_token,
+        params=dict(args.params),
+        progress=None if args.quiet else _print_scenario,
+    )
+
+    output = {
+        "timvt": timvt_version,
+        "label": args.label,
+        "url": args.url,
+        "requests": args.requests,
+        "seed": args.seed,
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["scenarios"]
+
+        comparison = timvt_bench.compare(
+            baseline, results, metric=args.metric, max_regression=args.max_regression
+        )
+        for row in comparison:
+            print(
+                f"{row['layer']} {row['tms']} {row['pattern']} x{row['concurrency']}: "
+                f"{args.metric} {row['baseline']:.1f}ms -> {row['current']:.1f}ms "
+                f"({row['change']:+.0%})"
+                + (" REGRESSION" if row["regression"] else ""),
+                file=sys.stderr,
+            )
+
+        if any(row["regression"] for row in comparison):
+            sys.exit(1)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Return command line parser."""
+    parser = argparse.ArgumentParser(
+        prog="timvt", description="TiMVT command line interface."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser(
+        "seed",
+        help="Render a layer to an MBTiles (.mbtiles) or PMTiles (.pmtiles) archive.",
+        description=(
+            "Render a layer to an MBTiles (.mbtiles) or PMTiles (.pmtiles) archive. "
+            "Database connection is configured with the usual environment variables "
+            "(e.g DATABASE_URL). Interrupted seeding are resumed when running the same "
+            "command again."
+        ),
+    )
+    seed_parser.add_argument("layer", help="Table (schema.table) or Function name.")
+    seed_parser.add_argument("output", help="Output archive path.")
+    seed_parser.add_argument(
+        "--tms", default="WebMercatorQuad", help="TileMatrixSet identifier."
+    )
+    seed_parser.add_argument(
+        "--bbox",
+        type=_bbox,
+        help="Bounding box (minx,miny,maxx,maxy). Defaults to the layer's bounds.",
+    )
+    seed_parser.add_argument(
+        "--minzoom", type=int, help="Min zoom level. Defaults to the layer's minzoom."
+    )
+    seed_parser.add_argument(
+        "--maxzoom", type=int, help="Max zoom level. Defaults to the layer's maxzoom."
+    )
+    seed_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of concurrent database queries.",
+    )
+    seed_parser.add_argument(
+        "--batch-size", type=int, default=64, help="Number of tiles per query."
+    )
+    seed_parser.add_argument(
+        "--param",
+        dest="params",
+        type=_param,
+        action="append",
+        default=[],
+        help="Layer option (key=value), e.g `--param limit=1000`.",
+    )
+    seed_parser.add_argument(
+        "--functions-directory",
+        default=ApiSettings().functions_directory,
+        help="Directory of Function SQL files.",
+    )
+    seed_parser.add_argument(
+        "--quiet", action="store_true", help="Do not print progress."
+    )
+    seed_parser.set_defaults(func=seed)
+
+    overviews_parser = commands.add_parser(
+        "overviews",
+        help="Create simplified copies of a Table for ranges of zoom levels.",
+        description=(
+            "Create simplified copies of a Table (overviews) for ranges of zoom levels. "
+            "Overviews are used in place of the Table for the tiles of their zoom "
+            "levels and must be re-created when the Table changes."
+        ),
+    )
+    overviews_parser.add_argument("table", help="Table name (schema.table).")
+    overviews_parser.add_argument(
+        "--zooms",
+        type=_zooms,
+        action="append",
+        required=True,
+        help="Zoom levels range (minzoom-maxzoom) of an overview, e.g `--zooms 0-4 --zooms 5-8`.",
+    )
+    overviews_parser.add_argument(
+        "--tms", default="WebMercatorQuad", help="TileMatrixSet identifier."
+    )
+    overviews_parser.add_argument(
+        "--simplify",
+        type=float,
+        default=1.0,
+        help="Simplification tolerance, in pixels of the maxzoom tiles.",
+    )
+    overviews_parser.add_argument(
+        "--min-area",
+        type=float,
+        help="Skip polygons smaller than this area, in square pixels of the maxzoom tiles.",
+    )
+    overviews_parser.add_argument(
+        "--cluster",
+        action="store_true",
+        help="Physically reorder the overviews on their spatial index.",
+    )
+    overviews_parser.add_argument(
+        "--geom", help="Geometry column. Defaults to the Table's first geometry column."
+    )
+    overviews_parser.set_defaults(func=overviews)
+
+    triggers_parser = commands.add_parser(
+        "triggers",
+        help="Create triggers notifying the changes of a Table.",
+        description=(
+            "Create triggers notifying (with LISTEN/NOTIFY) the bounding boxes of the "
+            "modified features of a Table, used by the application's change tracking "
+            "(TIMVT_CHANGES_ENABLED=TRUE) to invalidate the modified tiles."
+        ),
+    )
+    triggers_parser.add_argument("table", help="Table name (schema.table).")
+    triggers_parser.add_argument(
+        "--geom", help="Geometry column. Defaults to the Table's first geometry column."
+    )
+    triggers_parser.add_argument(
+        "--drop", action="store_true", help="Remove the triggers."
+    )
+    triggers_parser.set_defaults(func=triggers)
+
+    catalog_triggers_parser = commands.add_parser(
+        "catalog-triggers",
+        help="Create event triggers notifying the tables' DDL changes.",
+        description=(
+            "Create event triggers notifying (with LISTEN/NOTIFY) the created, altered "
+            "and dropped tables, reloaded by the application's table catalog "
+            "(TIMVT_CATALOG_LISTEN=TRUE). Needs superuser privileges."
+        ),
+    )
+    catalog_triggers_parser.add_argument(
+        "--schema", default="public", help="Schema of the trigger function."
+    )
+    catalog_triggers_parser.add_argument(
+        "--drop", action="store_true", help="Remove the event triggers."
+    )
+    catalog_triggers_parser.set_defaults(func=catalog_triggers)
+
+    bench_tables_parser = commands.add_parser(
+        "bench-tables",
+        help="Create synthetic tables for load tests.",
+        description=(
+            "Create (or re-create) tables of random features "
+            "({schema}.timvt_bench_{geometry_type}_{rows}) for load tests. The server "
+            "must be restarted to publish the new tables."
+        ),
+    )
+    bench_tables_parser.add_argument(
+        "--geometry-type",
+        dest="geometry_types",
+        choices=list(timvt_bench.GEOMETRY_TYPES),
+        action="append",
+        help="Geometry type of a table (all the types by default).",
+    )
+    bench_tables_parser.add_argument(
+        "--rows", type=int, default=100_000, help="Number of features per table."
+    )
+    bench_tables_parser.add_argument(
+        "--schema", default="public", help="Database schema of the tables."
+    )
+    bench_tables_parser.add_argument(
+        "--bbox",
+        type=_bbox,
+        default=[-180, -85, 180, 85],
+        help="Bounding box (minx,miny,maxx,maxy) of the features, in WGS84.",
+    )
+    bench_tables_parser.add_argument(
+        "--size",
+        type=float,
+        default=0.01,
+        help="Size (in degrees) of the lines and polygons.",
+    )
+    bench_tables_parser.add_argument(
+        "--seed", type=float, default=0.0, help="Random seed (between -1 and 1)."
+    )
+    bench_tables_parser.set_defaults(func=bench_tables)
+
+    bench_parser = commands.add_parser(
+        "bench",
+        help="Run load tests against a server.",
+        description=(
+            "Request tiles from a running server with concurrent clients, following "
+            "access patterns (viewport pans, zoom-in bursts, Zipfian popularity), and "
+            "report latency percentiles and throughput of each layer, TileMatrixSet, "
+            "pattern and concurrency level as JSON."
+        ),
+    )
+    bench_parser.add_argument(
+        "layers", nargs="+", help="Table (schema.table) or Function names."
+    )
+    bench_parser.add_argument(
+        "--url", default="http://127.0.0.1:8081", help="Server url."
+    )
+    bench_parser.add_argument(
+        "--tms",
+        action="append",
+        help="TileMatrixSet identifier (WebMercatorQuad by default).",
+    )
+    bench_parser.add_argument(
+        "--pattern",
+        dest="patterns",
+        choices=list(timvt_bench.PATTERNS),
+        action="append",
+        help="Access pattern (all the patterns by default).",
+    )
+    bench_parser.add_argument(
+        "--concurrency",
+        type=int,
+        action="append",
+        help="Number of concurrent clients (1, 8 and 32 by default).",
+    )
+    bench_parser.add_argument(
+        "--requests", type=int, default=100, help="Number of requests per client."
+    )
+    bench_parser.add_argument(
+        "--bbox",
+        type=_bbox,
+        help="Bounding box (minx,miny,maxx,maxy). Defaults to the layer's bounds.",
+    )
+    bench_parser.add_argument(
+        "--minzoom", type=int, help="Min zoom level. Defaults to the layer's minzoom."
+    )
+    bench_parser.add_argument(
+        "--maxzoom", type=int, help="Max zoom level. Defaults to the layer's maxzoom."
+    )
+    bench_parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed of the requested tiles."
+    )
+    bench_parser.add_argument(
+        "--debug-token",
+        default=ApiSettings().debug_token,
+        help="Server's debug token, to report the server-side phases (e.g pool wait).",
+    )
+    bench_parser.add_argument(
+        "--param",
+        dest="params",
+        type=_param,
+        action="append",
+        default=[],
+        help="Layer option (key=value), e.g `--param limit=1000`.",
+    )
+    bench_parser.add_argument("--output", help="Output JSON file (stdout by default).")
+    bench_parser.add_argument("--label", help="Label of the results (e.g git commit).")
+    bench_parser.add_argument(
+        "--compare", help="Baseline results (JSON file) to compare the latencies with."
+    )
+    bench_parser.add_argument(
+        "--metric",
+        default="p95",
+        choices=["p50", "p95", "p99", "mean", "max"],
+        help="Latency statistic compared with the baseline.",
+    )
+    bench_parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.1,
+        help="Relative latency increase failing the comparison (exit code 1).",
+    )
+    bench_parser.add_argument(
+        "--quiet", action="store_true", help="Do not print progress."
+    )
+    bench_parser.set_defaults(func=bench)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run command line interface."""
+    args = get_parser().parse_args(argv)
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
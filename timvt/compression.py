@@ -0,0 +1,145 @@
+"""timvt.compression: tile content encodings."""
+
+import asyncio
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, TypeVar
+
+import cramjam
+
+from timvt.settings import CompressionSettings
+
+T = TypeVar("T")
+
+# Content encodings, in server preference order for on-the-fly compression
+ENCODINGS = ("gzip", "br", "zstd")
+
+# Compression levels: fast enough to compress tiles on the fly
+LEVELS: Dict[str, int] = {"gzip": 6, "br": 5, "zstd": 3}
+
+BACKENDS = {
+    "gzip": cramjam.gzip,
+    "br": cramjam.brotli,
+    "zstd": cramjam.zstd,
+}
+
+ACCEPT_ENCODING = re.compile(r"^\s*([a-z0-9*-]+)\s*(?:;\s*q=([0-9.]+))?\s*$", re.I)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress data."""
+    return bytes(BACKENDS[encoding].compress(data, level=LEVELS[encoding]))
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """Decompress data."""
+    return bytes(BACKENDS[encoding].decompress(data))
+
+
+def accepted_encodings(header: Optional[str]) -> Dict[str, float]:
+    """Parse `Accept-Encoding` header (e.g `gzip, br;q=0.5`) in {encoding: quality}."""
+    values: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        matched = ACCEPT_ENCODING.match(item)
+        if not matched:
+            continue
+
+        name, q = matched.groups()
+        try:
+            values[name.lower()] = float(q) if q else 1.0
+        except ValueError:
+            values[name.lower()] = 0.0
+
+    return values
+
+
+def negotiate(
+    header: Optional[str], encodings: Sequence[str] = ENCODINGS
+) -> Optional[str]:
+    """Select the client's preferred encoding (from the `Accept-Encoding` header) within `encodings`.
+
+    Ties are resolved with the `encodings` order. Returns None if no encoding is accepted.
+
+    """
+    accepted = accepted_encodings(header)
+
+    best: Optional[str] = None
+    best_q = 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
+class Compressor:
+    """Compress and decompress tiles in the event loop or in an executor, depending on their size.
+
+    Compressing large tiles (e.g low zoom levels) blocks the event loop for a while,
+    delaying all the other requests. Data larger than `offload_threshold` bytes is
+    processed in the executor (cramjam releases the GIL, so a thread pool is enough),
+    smaller data in the event loop, avoiding the executor's overhead.
+
+    Attributes:
+        executor (concurrent.futures.Executor, optional): Pool for the large data. Everything is processed in the event loop if None.
+        offload_threshold (int): Size (in bytes) from which the data is processed in the executor.
+        stats (dict): Number of `inline` and `offloaded` calls.
+
+    """
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        offload_threshold: int = 64 * 1024,
+    ):
+        """Init Compressor."""
+        self.executor = executor
+        self.offload_threshold = offload_threshold
+        self.stats = {"inline": 0, "offloaded": 0}
+
+    async def run(self, size: int, func: Callable[..., T], *args: Any) -> T:
+        """Call `func(*args)`, in the executor if `size` reaches the offload threshold.
+
+        `func` and its arguments must be picklable with a process pool executor.
+
+        """
+        if self.executor is None or size < self.offload_threshold:
+            self.stats["inline"] += 1
+            return func(*args)
+
+        self.stats["offloaded"] += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def compress(self, data: bytes, encoding: str) -> bytes:
+        """Compress data."""
+        return await self.run(len(data), compress, data, encoding)
+
+    async def decompress(self, data: bytes, encoding: str) -> bytes:
+        """Decompress data."""
+        # Tiles usually compress 2 to 5 times
+        return await self.run(len(data) * 4, decompress, data, encoding)
+
+    def close(self) -> None:
+        """Shutdown the executor."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+def create_compressor(settings: Optional[CompressionSettings] = None) -> Compressor:
+    """Create a Compressor from the settings."""
+    if not settings:
+        settings = CompressionSettings()
+
+    executor: Optional[Executor] = None
+    if settings.executor == "thread":
+        executor = ThreadPoolExecutor(
+            max_workers=settings.max_workers, thread_name_prefix="timvt-compression"
+        )
+
+    elif settings.executor == "process":
+        executor = ProcessPoolExecutor(max_workers=settings.max_workers)
+
+    return Compressor(executor, offload_threshold=settings.offload_threshold)
@@ -0,0 +1,103 @@
+"""timvt.concurrency: asyncio helpers."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from starlette.types import Receive
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client disconnected before the response was sent."""
+
+
+async def cancel_on_disconnect(receive: Receive, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable`, cancelled as soon as the HTTP client disconnects.
+
+    Cancelling a database query (e.g. asyncpg's `fetchval`) cancels the query in
+    Postgres, releasing the connection for other requests.
+
+    Args:
+        receive (callable): ASGI receive channel of a request without (or with an already read) body.
+        awaitable (awaitable): Work to cancel on disconnection.
+
+    Returns:
+        any: result of `awaitable`.
+
+    Raises:
+        ClientDisconnected: if the client disconnected first.
+
+    """
+    task = asyncio.ensure_future(awaitable)
+
+    async def _watch() -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                task.cancel()
+                return
+
+    watcher = asyncio.ensure_future(_watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if watcher.done() and not watcher.cancelled():
+            raise ClientDisconnected() from None
+        raise
+    finally:
+        watcher.cancel()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls sharing the same key into a single execution.
+
+    While a call for `key` is in flight, other callers for the same `key` await
+    the same result instead of starting their own work. The call is cancelled when
+    all its callers are cancelled.
+
+    """
+
+    def __init__(self) -> None:
+        """Init registry of in-flight calls."""
+        self._calls: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self._waiters: Dict["asyncio.Future[Any]", int] = {}
+
+    def __len__(self) -> int:
+        """Number of calls in flight."""
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `func` or wait for the in-flight call with the same key.
+
+        Args:
+            key (hashable): Unique identifier of the call.
+            func (callable): Coroutine function to run if no call is in flight.
+
+        Returns:
+            any: result of `func`.
+
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+
+            def _done(fut: "asyncio.Future[Any]") -> None:
+                if self._calls.get(key) is fut:
+                    del self._calls[key]
+
+            future.add_done_callback(_done)
+
+        # A cancelled caller (e.g client disconnection) should not cancel the
+        # shared call other callers are waiting for.
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+                # Nobody is waiting for the result anymore
+                if not future.done():
+                    future.cancel()
@@ -1,15 +1,35 @@
 """timvt.db: database events."""
 
-from typing import Any, Optional
+import asyncio
+import functools
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
 
 import orjson
+from asyncpg.exceptions import ConnectionDoesNotExistError, PostgresConnectionError
 from buildpg import asyncpg
 
-from timvt.dbmodel import get_table_index
-from timvt.settings import PostgresSettings
+from timvt.catalog import TableCatalog
+from timvt.settings import CatalogSettings, PostgresSettings
 
 from fastapi import FastAPI
 
+logger = logging.getLogger(__name__)
+
+# Replication lag (in seconds) of a replica, NULL on a primary
+REPLICATION_LAG_SQL = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN
+        coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Errors meaning the database (not the query) failed. Timeouts, which are also
+# `OSError` since python 3.11, are handled separately as they are query errors.
+CONNECTION_ERRORS = (OSError, PostgresConnectionError, ConnectionDoesNotExistError)
+
 
 async def con_init(conn):
     """Use json for json returns."""
@@ -21,31 +41,281 @@ async def con_init(conn):
     )
 
 
+async def create_pool(
+    settings: Optional[PostgresSettings] = None,
+    database_url: Optional[str] = None,
+    **kwargs,
+) -> asyncpg.BuildPgPool:
+    """Create a connection pool (to `settings.database_url` by default)."""
+    if not settings:
+        settings = PostgresSettings()
+
+    options = {
+        "min_size": settings.db_min_conn_size,
+        "max_size": settings.db_max_conn_size,
+        "max_queries": settings.db_max_queries,
+        "max_inactive_connection_lifetime": settings.db_max_inactive_conn_lifetime,
+        "statement_cache_size": settings.db_statement_cache_size,
+        "init": con_init,
+        **kwargs,
+    }
+
+    return await asyncpg.create_pool_b(database_url or settings.database_url, **options)
+
+
+async def connect(
+    settings: Optional[PostgresSettings] = None,
+    database_url: Optional[str] = None,
+) -> asyncpg.BuildPgConnection:
+    """Open a connection outside of the pools (e.g to LISTEN to notifications), to `settings.database_url` by default."""
+    if not settings:
+        settings = PostgresSettings()
+
+    return await asyncpg.connect_b(database_url or settings.database_url)
+
+
+class PoolBalancer:
+    """Spread connections across pools (e.g read replicas), to the pool with the least outstanding connections.
+
+    Pools are health-checked every `interval` seconds (see `start`): pools failing to
+    connect or replicas lagging by more than `max_lag` seconds are skipped until the
+    next successful check. When no pool is healthy, connections come from the
+    `fallback` pool (e.g the primary).
+
+    Attributes:
+        pools (list): Pools to balance the connections across.
+        fallback (asyncpg.BuildPgPool, optional): Pool used when no pool is healthy.
+        max_lag (float, optional): Maximum replication lag (in seconds) of a healthy replica.
+        names (list): Pools names (host:port/dbname, without credentials).
+
+    """
+
+    def __init__(
+        self,
+        pools: Sequence[asyncpg.BuildPgPool],
+        fallback: Optional[asyncpg.BuildPgPool] = None,
+        max_lag: Optional[float] = None,
+        names: Optional[Sequence[str]] = None,
+    ):
+        """Init PoolBalancer."""
+        self.pools = list(pools)
+        self.fallback = fallback
+        self.max_lag = max_lag
+        self.names = list(names or [f"pool-{i}" for i in range(len(self.pools))])
+        self.outstanding = [0] * len(self.pools)
+        self.healthy = [True] * len(self.pools)
+        self.lags: List[Optional[float]] = [None] * len(self.pools)
+        self.acquired = [0] * len(self.pools)
+        self.errors = [0] * len(self.pools)
+        self.fallbacks = 0
+        # Round-robin between the pools with the same number of outstanding connections
+        self._turn = itertools.count()
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def select(self) -> Optional[int]:
+        """Return the index of the healthy pool with the least outstanding connections (None if no pool is healthy)."""
+        candidates = [i for i, healthy in enumerate(self.healthy) if healthy]
+        if not candidates:
+            return None
+
+        least = min(self.outstanding[i] for i in candidates)
+        candidates = [i for i in candidates if self.outstanding[i] == least]
+        return candidates[next(self._turn) % len(candidates)]
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.BuildPgConnection]:
+        """Acquire a connection from the selected pool.
+
+        Pools raising connection errors are marked as unhealthy.
+
+        """
+        index = self.select()
+        if index is None:
+            if self.fallback is None:
+                raise ConnectionError("No healthy database pool.")
+
+            self.fallbacks += 1
+            async with self.fallback.acquire() as conn:
+                yield conn
+            return
+
+        self.outstanding[index] += 1
+        self.acquired[index] += 1
+        try:
+            async with self.pools[index].acquire() as conn:
+                yield conn
+
+        # Statement timeouts don't mean the database is unhealthy
+        except asyncio.TimeoutError:
+            raise
+
+        except CONNECTION_ERRORS:
+            self.errors[index] += 1
+            self.healthy[index] = False
+            logger.warning(f"Database pool '{self.names[index]}' is unhealthy.")
+            raise
+
+        finally:
+            self.outstanding[index] -= 1
+
+    async def check(self, timeout: float = 5.0) -> None:
+        """Check the pools' health and replication lag."""
+
+        async def _check(index: int) -> None:
+            pool = self.pools[index]
+            try:
+                async with pool.acquire(timeout=timeout) as conn:
+                    lag = await conn.fetchval(REPLICATION_LAG_SQL, timeout=timeout)
+
+            except (asyncio.TimeoutError, *CONNECTION_ERRORS) as e:
+                if self.healthy[index]:
+                    logger.warning(
+                        f"Database pool '{self.names[index]}' is unhealthy: {e}"
+                    )
+                self.healthy[index] = False
+                return
+
+            self.lags[index] = float(lag) if lag is not None else None
+            healthy = self.max_lag is None or lag is None or lag <= self.max_lag
+            if healthy and not self.healthy[index]:
+                logger.info(f"Database pool '{self.names[index]}' is healthy.")
+            self.healthy[index] = healthy
+
+        await asyncio.gather(*[_check(i) for i in range(len(self.pools))])
+
+    def start(self, interval: float) -> None:
+        """Check the pools every `interval` seconds."""
+
+        async def _run() -> None:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.check()
+                except Exception as e:  # noqa
+                    logger.error(f"Database pools health check failed: {e}")
+
+        self._task = asyncio.create_task(_run())
+
+    async def close(self) -> None:
+        """Stop the health checks and close the pools (not the fallback pool)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await asyncio.gather(*[pool.close() for pool in self.pools])
+
+    @property
+    def stats(self) -> List[Dict[str, Any]]:
+        """Pools statistics."""
+        return [
+            {
+                "name": self.names[i],
+                "healthy": self.healthy[i],
+                "outstanding": self.outstanding[i],
+                "acquired": self.acquired[i],
+                "errors": self.errors[i],
+                "lag": self.lags[i],
+            }
+            for i in range(len(self.pools))
+        ]
+
+
+def _pool_name(url: str) -> str:
+    """Pool name from its url, without credentials."""
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 5432}{parts.path}"
+
+
 async def connect_to_db(
     app: FastAPI,
     settings: Optional[PostgresSettings] = None,
     **kwargs,
 ) -> None:
-    """Connect."""
+    """Connect.
+
+    `app.state.pool` is the primary database's pool, used for the catalog and
+    `app.state.tile_pool` the pool used for the tile queries: the read replicas' pools
+    (`PoolBalancer`) if `settings.database_replica_urls` is set, the primary's otherwise.
+    `app.state.connect` opens dedicated connections to the primary database (e.g to
+    LISTEN to notifications without holding a connection of the pool).
+
+    """
     if not settings:
         settings = PostgresSettings()
 
-    app.state.pool = await asyncpg.create_pool_b(
-        settings.database_url,
-        min_size=settings.db_min_conn_size,
-        max_size=settings.db_max_conn_size,
-        max_queries=settings.db_max_queries,
-        max_inactive_connection_lifetime=settings.db_max_inactive_conn_lifetime,
-        init=con_init,
+    app.state.pool = await create_pool(settings, **kwargs)
+    app.state.connect = functools.partial(connect, settings)
+    app.state.tile_pool = app.state.pool
+
+    if settings.database_replica_urls:
+        urls = [str(url) for url in settings.database_replica_urls]
+        pools = await asyncio.gather(
+            *[create_pool(settings, database_url=url, **kwargs) for url in urls]
+        )
+        balancer = PoolBalancer(
+            pools,
+            fallback=app.state.pool,
+            max_lag=settings.db_replica_max_lag,
+            names=[_pool_name(url) for url in urls],
+        )
+        await balancer.check()
+        balancer.start(settings.db_replica_check_interval)
+        app.state.tile_pool = balancer
+
+
+async def register_table_catalog(
+    app: FastAPI, settings: Optional[CatalogSettings] = None, **kwargs: Any
+) -> None:
+    """Register Table catalog (`app.state.table_catalog`).
+
+    Tables are loaded at startup (or in the background with `settings.lazy`), refreshed
+    every `settings.refresh_interval` seconds and, with `settings.listen`, reloaded when
+    notified by the DDL event triggers. Tables not loaded yet are loaded on first access,
+    unless the catalog is fully loaded at startup and never refreshed (tables not in the
+    catalog are then not found, without querying the database).
+
+    Args:
+        app (FastAPI): Application.
+        settings (CatalogSettings, optional): Catalog settings.
+        kwargs: `TableCatalog` options (`schemas`, `tables`, `spatial`).
+
+    """
+    if not settings:
+        settings = CatalogSettings()
+
+    metrics = getattr(app.state, "metrics", None)
+    catalog = TableCatalog(
+        app.state.pool,
+        missing_ttl=settings.missing_ttl,
+        max_missing=settings.max_missing,
+        lookup=(
+            settings.lazy or settings.refresh_interval is not None or settings.listen
+        ),
+        observe_refresh=metrics.observe_catalog_refresh if metrics else None,
         **kwargs,
     )
+    if not settings.lazy:
+        await catalog.refresh()
 
+    catalog.start(settings.refresh_interval, initial=settings.lazy)
+    if settings.listen:
+        await catalog.listen(getattr(app.state, "connect", connect))
 
-async def register_table_catalog(app: FastAPI, **kwargs: Any) -> None:
-    """Register Table catalog."""
-    app.state.table_catalog = await get_table_index(app.state.pool, **kwargs)
+    app.state.table_catalog = catalog
 
 
 async def close_db_connection(app: FastAPI) -> None:
     """Close connection."""
+    table_catalog = getattr(app.state, "table_catalog", None)
+    if isinstance(table_catalog, TableCatalog):
+        await table_catalog.stop()
+
+    tile_pool = getattr(app.state, "tile_pool", None)
+    if isinstance(tile_pool, PoolBalancer):
+        await tile_pool.close()
+
     await app.state.pool.close()
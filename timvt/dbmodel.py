@@ -1,5 +1,6 @@
 """timvt.dbmodel: database events."""
 
+import re
 from typing import Any, Dict, List, Optional
 
 from buildpg import asyncpg
@@ -54,6 +55,9 @@ class GeometryColumn(Column):
     bounds: List[float] = [-180, -90, 180, 90]
     srid: int = 4326
     geometry_type: str
+    # Same geometries in other CRS: {srid: generated column name}, or {srid: None}
+    # when only an `ST_Transform(column, srid)` expression index exists.
+    transforms: Dict[int, Optional[str]] = {}
 
 
 class DatetimeColumn(Column):
@@ -63,6 +67,17 @@ class DatetimeColumn(Column):
     max: Optional[str]
 
 
+class Overview(BaseModel):
+    """Model for a Table overview (geometries pre-processed for a range of zoom levels)."""
+
+    table: str
+    geometry_column: str
+    srid: int
+    tms: str
+    minzoom: int
+    maxzoom: int
+
+
 class Table(BaseModel):
     """Model for DB Table."""
 
@@ -76,6 +91,7 @@ class Table(BaseModel):
     datetime_columns: List[DatetimeColumn] = []
     geometry_column: Optional[GeometryColumn]
     datetime_column: Optional[DatetimeColumn]
+    overviews: List[Overview] = []
 
     def get_datetime_column(self, name: Optional[str] = None) -> Optional[Column]:
         """Return the Column for either the passed in tstz column or the first tstz column."""
@@ -138,6 +154,144 @@ class Table(BaseModel):
 
 Database = Dict[str, Dict[str, Any]]
 
+# Registry of the overviews (created by `timvt overviews`), one per schema
+OVERVIEWS_REGISTRY = "timvt_overviews"
+
+
+async def get_overviews(
+    conn: asyncpg.BuildPgConnection, schemas: Optional[List[str]] = ["public"]
+) -> List[Dict[str, Any]]:
+    """Fetch Table overviews from the overviews registries."""
+    registries = await conn.fetch_b(
+        """
+        SELECT format('%I.%I', nspname, relname)
+        FROM pg_class c JOIN pg_namespace n on (c.relnamespace=n.oid)
+        WHERE
+            relname = :registry
+            AND relkind IN ('r', 'p')
+            AND has_table_privilege(c.oid, 'SELECT')
+            AND (:schemas::text[] IS NULL OR n.nspname = ANY (:schemas))
+        """,
+        registry=OVERVIEWS_REGISTRY,
+        schemas=schemas,
+    )
+
+    overviews: List[Dict[str, Any]] = []
+    for (registry,) in registries:
+        rows = await conn.fetch(
+            f"SELECT source, overview AS table, geometry_column, srid, tms, minzoom, maxzoom FROM {registry}"
+        )
+        overviews.extend(dict(row) for row in rows)
+
+    return overviews
+
+
+# `st_transform(geom, 3857)` expression (as deparsed by `pg_get_expr`/`pg_get_indexdef`)
+TRANSFORM_EXPRESSION = re.compile(
+    r'^(?:\w+\.)?st_transform\((\w+|"[^"]+"), (\d+)\)$', re.IGNORECASE
+)
+
+
+async def get_geometry_transforms(
+    conn: asyncpg.BuildPgConnection,
+    schemas: Optional[List[str]] = ["public"],
+    tables: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Fetch `ST_Transform(column, srid)` generated columns and spatial expression indexes."""
+    generated = """
+        SELECT
+            format('%I.%I', nspname, c.relname) AS id,
+            attname AS name,
+            pg_get_expr(d.adbin, d.adrelid) AS expression
+        FROM
+            pg_attrdef d
+            JOIN pg_attribute a ON (a.attrelid = d.adrelid AND a.attnum = d.adnum)
+            JOIN pg_class c ON (c.oid = d.adrelid)
+            JOIN pg_namespace n ON (c.relnamespace = n.oid)
+        WHERE
+            a.attgenerated = 's'
+            AND (:schemas::text[] IS NULL OR n.nspname = ANY (:schemas))
+            AND (:tables::text[] IS NULL OR c.relname = ANY (:tables))
+        UNION ALL
+    """
+    indexes = """
+        SELECT
+            format('%I.%I', nspname, c.relname) AS id,
+            NULL AS name,
+            pg_get_indexdef(i.indexrelid, 1, true) AS expression
+        FROM
+            pg_index i
+            JOIN pg_class c ON (c.oid = i.indrelid)
+            JOIN pg_namespace n ON (c.relnamespace = n.oid)
+            JOIN pg_class ic ON (ic.oid = i.indexrelid)
+            JOIN pg_am am ON (am.oid = ic.relam)
+        WHERE
+            i.indnatts = 1
+            AND i.indexprs IS NOT NULL
+            AND i.indpred IS NULL
+            AND am.amname IN ('gist', 'spgist', 'brin')
+            AND (:schemas::text[] IS NULL OR n.nspname = ANY (:schemas))
+            AND (:tables::text[] IS NULL OR c.relname = ANY (:tables))
+    """
+    # Generated columns are only available with PostgreSQL >= 12
+    query = indexes
+    if conn.get_server_version() >= (12, 0):
+        query = generated + indexes
+
+    rows = await conn.fetch_b(query, schemas=schemas, tables=tables)
+
+    transforms = []
+    for row in rows:
+        match = TRANSFORM_EXPRESSION.match(row["expression"])
+        if match:
+            transforms.append(
+                {
+                    "id": row["id"],
+                    "source": match.group(1).strip('"'),
+                    "srid": int(match.group(2)),
+                    "name": row["name"],
+                }
+            )
+
+    return transforms
+
+
+def _add_geometry_transforms(
+    catalog: Database, transforms: List[Dict[str, Any]]
+) -> Database:
+    """Attach transformed geometry columns and indexes to their geometry column."""
+    for transform in transforms:
+        table = catalog.get(transform["id"])
+        if not table:
+            continue
+
+        names = {col["name"] for col in table["geometry_columns"]}
+        # Generated column must be available in the table's geometry columns
+        if transform["name"] is not None and transform["name"] not in names:
+            continue
+
+        for col in table["geometry_columns"]:
+            if col["name"] == transform["source"]:
+                srids = col.setdefault("transforms", {})
+                # Prefer generated columns to expression indexes
+                if srids.get(transform["srid"]) is None:
+                    srids[transform["srid"]] = transform["name"]
+
+    return catalog
+
+
+def _add_overviews(catalog: Database, overviews: List[Dict[str, Any]]) -> Database:
+    """Attach overviews to their source Table and remove overview tables from the catalog."""
+    for overview in overviews:
+        catalog.pop(overview["table"], None)
+
+    for overview in overviews:
+        source = catalog.get(overview.pop("source"))
+        if source is not None:
+            source.setdefault("overviews", []).append(overview)
+
+    return catalog
+
 
 async def get_table_index(
     db_pool: asyncpg.BuildPgPool,
@@ -168,7 +322,7 @@ async def get_table_index(
                 AND has_table_privilege(c.oid, 'SELECT')
                 AND has_column_privilege(c.oid,a.attnum, 'SELECT')
                 AND n.nspname NOT IN ('pg_catalog', 'information_schema')
-                AND c.relname NOT IN ('spatial_ref_sys','geometry_columns','geography_columns')
+                AND c.relname NOT IN ('spatial_ref_sys','geometry_columns','geography_columns','timvt_overviews')
                 AND (:schemas::text[] IS NULL  OR n.nspname = ANY (:schemas))
                 AND (:tables::text[] IS NULL OR c.relname = ANY (:tables))
         ),
@@ -328,6 +482,9 @@ async def get_table_index(
             if not geometry_column and geometry_columns:
                 geometry_column = geometry_columns[0]
 
+            # Feature priority column (`-{column}` for descending order)
+            order_by = table_conf.get("order_by") or ""
+
             catalog[id] = {
                 "id": id,
                 "table": table["table"],
@@ -339,6 +496,16 @@ async def get_table_index(
                 "properties": properties,
                 "datetime_column": datetime_column,
                 "geometry_column": geometry_column,
+                "simplify": table_conf.get("simplify"),
+                "min_area": table_conf.get("min_area"),
+                "statement_timeout": table_conf.get("statement_timeout"),
+                "order_by": order_by
+                if order_by.lstrip("+-") in property_names
+                else None,
             }
 
-        return catalog
+        transforms = await get_geometry_transforms(conn, schemas=schemas, tables=tables)
+        overviews = await get_overviews(conn, schemas=schemas)
+
+    catalog = _add_geometry_transforms(catalog, transforms)
+    return _add_overviews(catalog, overviews)
@@ -1,9 +1,11 @@
 """TiVTiler.dependencies: endpoint's dependencies."""
 
 import re
+from typing import List
 
 from morecantile import Tile
 
+from timvt.catalog import TableCatalog
 from timvt.layer import Layer, Table
 
 from fastapi import HTTPException, Path
@@ -20,7 +22,7 @@ def TileParams(
     return Tile(x, y, z)
 
 
-def LayerParams(
+async def LayerParams(
     request: Request,
     layer: str = Path(..., description="Layer Name"),
 ) -> Layer:
@@ -31,6 +33,12 @@ def LayerParams(
     if func:
         return func
 
+    # Check timvt_archive_catalog
+    archive_catalog = getattr(request.app.state, "timvt_archive_catalog", {})
+    archive = archive_catalog.get(layer)
+    if archive:
+        return archive
+
     # Check table_catalog
     else:
         table_pattern = re.match(  # type: ignore
@@ -45,7 +53,41 @@ def LayerParams(
         assert table_pattern.groupdict()["table"]
 
         table_catalog = getattr(request.app.state, "table_catalog", {})
-        if layer in table_catalog:
-            return Table(**table_catalog[layer])
+        if isinstance(table_catalog, TableCatalog):
+            # Tables not loaded yet (e.g new tables) are loaded on first access
+            table = await table_catalog.get_table(layer)
+        else:
+            table = table_catalog.get(layer)
+
+        if table:
+            return table
+
+    raise HTTPException(
+        status_code=404, detail=f"Table/Function/Archive '{layer}' not found."
+    )
+
+
+async def LayersParams(
+    request: Request,
+    layers: str = Path(..., description="Comma-separated list of Layer Names"),
+) -> List[Layer]:
+    """Return Layer Objects.
+
+    Only Table tiles are named after the layer's id, so combining layers which would
+    share the same MVT layer name (Function and Archive tiles have their own layer
+    names) is rejected.
+
+    """
+    ids = layers.split(",")
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail=f"Duplicate layers in '{layers}'.")
+
+    objs = [await LayerParams(request, layer=layer) for layer in ids]
+    others = [layer.id for layer in objs if not isinstance(layer, Table)]
+    if len(others) > 1:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Function and Archive layers can't be combined ({', '.join(others)}).",
+        )
 
-    raise HTTPException(status_code=404, detail=f"Table/Function '{layer}' not found.")
+    return objs
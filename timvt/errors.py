@@ -1,7 +1,7 @@
 """timvt.errors: Error classes."""
 
 import logging
-from typing import Callable, Dict, Type
+from typing import Callable, Dict, Optional, Type
 
 from fastapi import FastAPI
 
@@ -32,11 +32,36 @@ class InvalidGeometryColumnName(TiMVTError):
     """Invalid geometry column name."""
 
 
+class InvalidTileMatrixSet(TiMVTError):
+    """Layer not available in the TileMatrixSet."""
+
+
+class TileQueryTimeout(TiMVTError):
+    """Tile query exceeded the layer's statement timeout."""
+
+
+class DebugDisabled(TiMVTError):
+    """Debug mode is not enabled for the request."""
+
+
+class TileOverloaded(TiMVTError):
+    """Too many tile queries waiting for the layer."""
+
+    def __init__(self, message: str, retry_after: Optional[int] = None):
+        """Init error with the `Retry-After` delay (in seconds)."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 DEFAULT_STATUS_CODES = {
     TableNotFound: status.HTTP_404_NOT_FOUND,
     MissingEPSGCode: status.HTTP_500_INTERNAL_SERVER_ERROR,
     MissingGeometryColumn: status.HTTP_500_INTERNAL_SERVER_ERROR,
     InvalidGeometryColumnName: status.HTTP_404_NOT_FOUND,
+    InvalidTileMatrixSet: status.HTTP_404_NOT_FOUND,
+    TileQueryTimeout: status.HTTP_503_SERVICE_UNAVAILABLE,
+    TileOverloaded: status.HTTP_503_SERVICE_UNAVAILABLE,
+    DebugDisabled: status.HTTP_403_FORBIDDEN,
     Exception: status.HTTP_500_INTERNAL_SERVER_ERROR,
 }
 
@@ -47,8 +72,18 @@ def exception_handler_factory(status_code: int) -> Callable:
     """
 
     def handler(request: Request, exc: Exception):
-        logger.error(exc, exc_info=True)
-        return JSONResponse(content={"detail": str(exc)}, status_code=status_code)
+        headers = None
+        retry_after = getattr(exc, "retry_after", None)
+        if retry_after is not None:
+            # Expected under load, no need for a traceback
+            logger.warning(exc)
+            headers = {"Retry-After": str(retry_after)}
+        else:
+            logger.error(exc, exc_info=True)
+
+        return JSONResponse(
+            content={"detail": str(exc)}, status_code=status_code, headers=headers
+        )
 
     return handler
 
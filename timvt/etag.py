@@ -0,0 +1,178 @@
+"""timvt.etag: ETags and table versions for conditional tile requests."""
+
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from buildpg import asyncpg
+
+from fastapi import FastAPI
+
+logger = logging.getLogger(__name__)
+
+# Modification counters of the tables, with the server start and statistics reset
+# times (when the counters are reset) and the table's file node (changed by TRUNCATE,
+# which the counters ignore)
+TABLE_VERSIONS_SQL = """
+    SELECT
+        format('%I.%I', s.schemaname, s.relname) AS id,
+        concat_ws(
+            '-',
+            extract(epoch FROM pg_postmaster_start_time())::bigint,
+            extract(epoch FROM d.stats_reset),
+            pg_relation_filenode(s.relid),
+            s.n_tup_ins,
+            s.n_tup_upd,
+            s.n_tup_del
+        ) AS version
+    FROM pg_stat_user_tables s
+    JOIN pg_stat_database d ON d.datname = current_database()
+    WHERE format('%I.%I', s.schemaname, s.relname) = ANY (:tables)
+"""
+
+
+def content_etag(content: bytes) -> str:
+    """Return a strong ETag from the tile content."""
+    return '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+
+
+def version_etag(version: str, key: str) -> str:
+    """Return a strong ETag from a layer version and a tile request key.
+
+    Args:
+        version (str): Layer's version token.
+        key (str): tile request key (see `timvt.cache.tile_cache_key`).
+
+    Returns:
+        str: ETag (e.g `"v-5d41402abc4b2a76b9719d911017c592"`).
+
+    """
+    digest = hashlib.blake2b(f"{version}:{key}".encode(), digest_size=16)
+    return f'"v-{digest.hexdigest()}"'
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """Return the ETag of a content-encoded representation (e.g `"v-5d41...-gzip"`)."""
+    if not encoding:
+        return etag
+
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def if_none_match(header: Optional[str], etag: str) -> bool:
+    """Check if an ETag matches the `If-None-Match` request header."""
+    if not header:
+        return False
+
+    if header.strip() == "*":
+        return True
+
+    # Weak comparison (RFC 7232 section 3.2)
+    tags = {_opaque_tag(tag) for tag in header.split(",")}
+    return _opaque_tag(etag) in tags
+
+
+def _opaque_tag(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+class TableVersions:
+    """Version tokens of the tables, changing when the tables are modified.
+
+    Tokens come from the tables' modification counters (`pg_stat_user_tables`), which
+    are refreshed every `interval` seconds, so a modification can take up to `interval`
+    seconds (plus the statistics reporting delay) to change the table's token. Tokens
+    can also be changed directly with `bump` (e.g by a change tracking process).
+
+    """
+
+    def __init__(self, tables: Optional[Dict[str, str]] = None):
+        """Init versions.
+
+        Args:
+            tables (dict, optional): Version tokens (by table id).
+
+        """
+        self.tables: Dict[str, str] = dict(tables or {})
+        self._bumps: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, table: str) -> Optional[str]:
+        """Return the version token of a table (None if unknown)."""
+        version = self.tables.get(table)
+        if version is None:
+            return None
+
+        bumps = self._bumps.get(table)
+        return f"{version}.{bumps}" if bumps else version
+
+    def bump(self, table: str) -> None:
+        """Change the version token of a table."""
+        self._bumps[table] = self._bumps.get(table, 0) + 1
+
+    async def refresh(self, pool: asyncpg.BuildPgPool, tables: Sequence[str]) -> None:
+        """Fetch the version tokens of tables."""
+        async with pool.acquire() as conn:
+            rows = await conn.fetch_b(TABLE_VERSIONS_SQL, tables=list(tables))
+
+        self.tables = {row["id"]: row["version"] for row in rows}
+
+    def start(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tables: Union[Sequence[str], Callable[[], Sequence[str]]],
+        interval: float,
+    ) -> None:
+        """Refresh versions every `interval` seconds in a background task.
+
+        `tables` can be a function returning the tables (e.g of a refreshed catalog).
+
+        """
+
+        async def _refresh():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.refresh(pool, tables() if callable(tables) else tables)
+                except Exception as e:  # noqa
+                    # Unknown versions disable the version ETags
+                    logger.warning(f"Could not refresh table versions: {e}")
+                    self.tables = {}
+
+        self._task = asyncio.create_task(_refresh())
+
+    async def stop(self) -> None:
+        """Stop the background refresh."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def register_table_versions(app: FastAPI, interval: Optional[float]) -> None:
+    """Create table versions (`app.state.table_versions`) refreshed every `interval` seconds.
+
+    Versions are disabled when `interval` is None.
+
+    """
+    if interval is None:
+        app.state.table_versions = None
+        return
+
+    def _tables() -> List[str]:
+        # Tables of the (refreshed) catalog and their overviews
+        tables = []
+        for table_id, table in getattr(app.state, "table_catalog", {}).items():
+            tables.append(table_id)
+            tables.extend(overview.table for overview in table.overviews)
+        return tables
+
+    versions = TableVersions()
+    await versions.refresh(app.state.pool, _tables())
+    versions.start(app.state.pool, _tables, interval)
+    app.state.table_versions = versions
@@ -1,24 +1,55 @@
 """timvt.endpoints.factory: router factories."""
 
+import asyncio
+import logging
+import os
+import secrets
+import struct
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from dataclasses import dataclass, field
-from typing import Any, Callable, Dict, List, Literal, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from urllib.parse import urlencode
 
+from buildpg import asyncpg
 from morecantile import Tile, TileMatrixSet
 from morecantile import tms as morecantile_tms
 from morecantile.defaults import TileMatrixSets
 
-from timvt.dependencies import LayerParams, TileParams
-from timvt.layer import Function, Layer, Table
+from timvt.cache import tile_cache_key
+from timvt.compression import ENCODINGS, Compressor, accepted_encodings, negotiate
+from timvt.concurrency import ClientDisconnected, SingleFlight, cancel_on_disconnect
+from timvt.dependencies import LayerParams, LayersParams, TileParams
+from timvt.errors import DebugDisabled, TileOverloaded, TileQueryTimeout
+from timvt.etag import content_etag, encoded_etag, if_none_match, version_etag
+from timvt.layer import Archive, Function, Layer, Table
+from timvt.metrics import TileMetrics, TimedPool
+from timvt.models.batch import TileBatch
 from timvt.models.mapbox import TileJSON
 from timvt.models.OGC import TileMatrixSetList
+from timvt.occupancy import TileOccupancyIndexes
 from timvt.resources.enums import MimeTypes
 
 from fastapi import APIRouter, Depends, Path, Query
+from fastapi.encoders import jsonable_encoder
 
+from starlette.convertors import Convertor, register_url_convertor
 from starlette.datastructures import QueryParams
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, Response
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from starlette.routing import NoMatchFound
 from starlette.templating import Jinja2Templates
 
@@ -31,18 +62,52 @@ except ImportError:
 
 templates = Jinja2Templates(directory=str(resources_files(__package__) / "templates"))  # type: ignore
 
+logger = logging.getLogger(__name__)
+
+# Used when the application has no compressor (`app.state.compressor`)
+INLINE_COMPRESSOR = Compressor()
+
+# Layer options set by the application, not by the query parameters (e.g the MVT
+# layer name of the multi-layers tiles)
+RESERVED_PARAMS = ["layer_name"]
+
+# `z` of the last record of incomplete batch responses, whose data is the error message
+BATCH_ERROR_ZOOM = 0xFFFFFFFF
+
 TILE_RESPONSE_PARAMS: Dict[str, Any] = {
-    "responses": {200: {"content": {"application/x-protobuf": {}}}},
+    "responses": {
+        200: {"content": {"application/x-protobuf": {}}},
+        204: {"description": "Empty tile (or time budget exceeded, `X-Tile-Timeout`)"},
+        503: {"description": "Too many queued tile queries (`Retry-After`)"},
+        304: {"description": "Tile not modified (`If-None-Match`)"},
+    },
     "response_class": Response,
 }
 
 
+class LayersConvertor(Convertor):
+    """Match a comma-separated list of layers (e.g `public.countries,squares`)."""
+
+    regex = "[^/]+,[^/]+"
+
+    def convert(self, value: str) -> str:
+        """Return path parameter value."""
+        return value
+
+    def to_string(self, value: str) -> str:
+        """Return path parameter string."""
+        return value
+
+
+register_url_convertor("layers", LayersConvertor())
+
+
 def queryparams_to_kwargs(q: QueryParams, ignore_keys: List = []) -> Dict:
-    """Convert query params to dict."""
+    """Convert query params to dict (without the options reserved to the application)."""
     keys = list(q.keys())
     values = {}
     for k in keys:
-        if k in ignore_keys:
+        if k in ignore_keys or k in RESERVED_PARAMS:
             continue
 
         v = q.getlist(k)
@@ -68,16 +133,26 @@ class VectorTilerFactory:
     default_tms: str = "WebMercatorQuad"
 
     # Table/Function dependency
-    layer_dependency: Callable[..., Layer] = LayerParams
+    layer_dependency: Callable[..., Union[Layer, Awaitable[Layer]]] = LayerParams
+
+    # Table/Function list dependency (for multi-layers tiles)
+    layers_dependency: Callable[
+        ..., Union[List[Layer], Awaitable[List[Layer]]]
+    ] = LayersParams
 
     with_tables_metadata: bool = False
     with_functions_metadata: bool = False
+    with_archives_metadata: bool = False
     with_viewer: bool = False
 
     # Router Prefix is needed to find the path for routes when prefixed
     # e.g if you mount the route with `/foo` prefix, set router_prefix to foo
     router_prefix: str = ""
 
+    # Concurrent requests for the same tile share a single database query.
+    # Set to `None` to disable requests coalescing.
+    single_flight: Optional[SingleFlight] = field(default_factory=SingleFlight)
+
     def __post_init__(self):
         """Post Init: register route and configure specific options."""
         self.register_routes()
@@ -90,9 +165,14 @@ class VectorTilerFactory:
         if self.with_functions_metadata:
             self.register_functions_metadata()
 
+        if self.with_archives_metadata:
+            self.register_archives_metadata()
+
         if self.with_viewer:
             self.register_viewer()
 
+        # Explain routes need to be registered before the `tile` routes
+        self.register_explain()
         self.register_tiles()
 
     def url_for(self, request: Request, name: str, **path_params: Any) -> str:
@@ -104,9 +184,695 @@ class VectorTilerFactory:
 
         return str(url_path.make_absolute_url(base_url=base_url))
 
+    def is_empty(
+        self,
+        request: Request,
+        layer: Layer,
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> bool:
+        """Check the application's tile occupancy indexes for known empty tiles.
+
+        Without change tracking (which updates the indexes), indexes are created again
+        when the table's version changes.
+
+        """
+        indexes = getattr(request.app.state, "tile_occupancy", None) or {}
+        if isinstance(indexes, TileOccupancyIndexes):
+            occupancy = None
+            if isinstance(layer, Table):
+                versions = getattr(request.app.state, "table_versions", None)
+                if getattr(request.app.state, "change_tracker", None) is not None:
+                    occupancy = indexes.index(layer)
+                elif versions is not None and versions.get(layer.id) is not None:
+                    occupancy = indexes.index(layer, versions.get(layer.id))
+        else:
+            occupancy = indexes.get(layer.id)
+
+        if occupancy is None:
+            return False
+
+        return occupancy.is_empty(tile, tms, geometry_column=kwargs.get("geom"))
+
+    def layer_version(self, request: Request, layer: Layer) -> Optional[str]:
+        """Return a token changing when the layer's data or configuration changes (None if unknown).
+
+        Archive versions come from the file's modification time and size, Table versions
+        from the application's table versions (`app.state.table_versions`). Versions
+        include the layer's fingerprint (configuration, tile settings and timvt version).
+
+        """
+        if isinstance(layer, Archive):
+            stat = os.stat(layer.path)
+            return f"{layer.fingerprint}-{stat.st_mtime_ns}-{stat.st_size}"
+
+        if isinstance(layer, Table):
+            versions = getattr(request.app.state, "table_versions", None)
+            if versions is None:
+                return None
+
+            tables = [layer.id, *[overview.table for overview in layer.overviews]]
+            tokens = [versions.get(table) for table in tables]
+            if any(token is None for token in tokens):
+                return None
+
+            return "/".join([layer.fingerprint, *tokens])  # type: ignore
+
+        return None
+
+    def cache_key(
+        self,
+        request: Request,
+        layer: Layer,
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> str:
+        """Return the tile cache key of a layer's tile.
+
+        The key includes the layer's version (see `layer_version`, or the layer's
+        fingerprint when unknown), so tiles cached before the layer changed are not
+        served under the new version's ETag.
+
+        """
+        key = tile_cache_key(layer.id, tms.identifier, tile, **kwargs)
+        version = self.layer_version(request, layer) or layer.fingerprint
+        return key + ("&" if "?" in key else "?") + urlencode({"@version": version})
+
+    def tile_etag(
+        self,
+        request: Request,
+        layers: Sequence[Layer],
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> Optional[str]:
+        """Return the ETag of a tile from the layers' versions, before rendering the tile."""
+        versions = [self.layer_version(request, layer) for layer in layers]
+        if any(version is None for version in versions):
+            return None
+
+        key = tile_cache_key(
+            ",".join(layer.id for layer in layers), tms.identifier, tile, **kwargs
+        )
+        return version_etag(",".join(versions), key)  # type: ignore
+
+    def not_modified(self, request: Request, etag: Optional[str]) -> Optional[Response]:
+        """Return a `304 Not Modified` response if the request's `If-None-Match` header matches the ETag.
+
+        The ETags of the content-encoded representations accepted by the client also match.
+
+        """
+        header = request.headers.get("If-None-Match")
+        if not etag or not header:
+            return None
+
+        accepted = accepted_encodings(request.headers.get("Accept-Encoding"))
+        for encoding in [None, *ENCODINGS]:
+            if encoding and accepted.get(encoding, accepted.get("*", 0.0)) <= 0:
+                continue
+
+            tag = encoded_etag(etag, encoding)
+            if if_none_match(header, tag):
+                return Response(
+                    status_code=304, headers={"ETag": tag, "Vary": "Accept-Encoding"}
+                )
+
+        return None
+
+    def compressor(self, request: Request) -> Compressor:
+        """Return the application's compressor (`app.state.compressor`)."""
+        return getattr(request.app.state, "compressor", None) or INLINE_COMPRESSOR
+
+    def debug(self, request: Request) -> bool:
+        """Check if the debug mode is enabled for the request.
+
+        The debug mode is enabled for all the requests of debug applications
+        (`TIMVT_DEBUG=TRUE`) and for the requests with the application's debug token
+        (`app.state.debug_token`) in a `X-Debug-Token` header.
+
+        """
+        if request.app.debug:
+            return True
+
+        token = getattr(request.app.state, "debug_token", None)
+        header = request.headers.get("X-Debug-Token")
+        if not token or not header:
+            return False
+
+        return secrets.compare_digest(header.encode(), token.encode())
+
+    def add_timing(
+        self,
+        request: Request,
+        name: str,
+        duration: float,
+        description: Optional[str] = None,
+    ) -> None:
+        """Add a `Server-Timing` entry (duration in seconds) to the response, in debug mode.
+
+        Entries are stored in the request's state (`server_timing`) and added to the
+        response headers by `timvt.middleware.TimingMiddleware`.
+
+        """
+        if not self.debug(request):
+            return
+
+        timings = getattr(request.state, "server_timing", None)
+        if timings is None:
+            timings = request.state.server_timing = []
+
+        entry = f'{name};desc="{description}"' if description else name
+        timings.append(f"{entry};dur={duration * 1000:.1f}")
+
+    @contextmanager
+    def timed(
+        self, request: Request, name: str, description: Optional[str] = None
+    ) -> Iterator[None]:
+        """Add the block's duration as a `Server-Timing` entry (see `add_timing`)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(request, name, time.perf_counter() - start, description)
+
+    async def tile_response(
+        self,
+        request: Request,
+        content: bytes,
+        etag: Optional[str] = None,
+        encoding: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """Create a tile response with an ETag (from the tile's content by default).
+
+        Tiles already compressed with `encoding` are sent as is when the client accepts
+        the encoding (and decompressed otherwise). Uncompressed tiles are compressed with
+        the client's preferred encoding. Returns a `304 Not Modified` response when the
+        ETag matches the request's `If-None-Match` header and a `204 No Content` response
+        for empty tiles.
+
+        """
+        headers = dict(headers or {})
+        if not content:
+            return Response(status_code=204, headers=headers)
+
+        etag = etag or content_etag(content)
+
+        accept_encoding = request.headers.get("Accept-Encoding")
+        if encoding and not negotiate(accept_encoding, [encoding]):
+            with self.timed(request, "decompress"):
+                content = await self.compressor(request).decompress(content, encoding)
+            encoding = None
+
+        compress_with = None if encoding else negotiate(accept_encoding)
+        etag = encoded_etag(etag, encoding or compress_with)
+        headers.update({"ETag": etag, "Vary": "Accept-Encoding"})
+        if if_none_match(request.headers.get("If-None-Match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        if compress_with:
+            with self.timed(request, "compress"):
+                content = await self.compressor(request).compress(
+                    content, compress_with
+                )
+            encoding = compress_with
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        return Response(content, media_type=MimeTypes.pbf.value, headers=headers)
+
+    def timeout_headers(self, layers: Sequence[Layer]) -> Dict[str, str]:
+        """Headers of the (partial or empty) tiles of layers exceeding their time budget.
+
+        The tiles are not complete, so they must not be cached.
+
+        """
+        return {
+            "X-Tile-Timeout": ",".join(layer.id for layer in layers),
+            "Cache-Control": "no-store",
+        }
+
+    async def layer_tile_response(
+        self,
+        request: Request,
+        layer: Layer,
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> Response:
+        """Return the response of a layer's tile.
+
+        The tile rendering is cancelled when the client disconnects (`499` response)
+        and an empty tile with an `X-Tile-Timeout` header is returned when the layer
+        exceeds its time budget.
+
+        """
+        etag = self.tile_etag(request, [layer], tile, tms, **kwargs)
+        not_modified = self.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            content, encoding = await cancel_on_disconnect(
+                request.receive,
+                self.get_encoded_tile(request, layer, tile, tms, **kwargs),
+            )
+        except TileQueryTimeout:
+            return await self.tile_response(
+                request, b"", headers=self.timeout_headers([layer])
+            )
+        except ClientDisconnected:
+            return Response(status_code=499)
+
+        return await self.tile_response(request, content, etag, encoding)
+
+    async def layers_tile_response(
+        self,
+        request: Request,
+        layers: Sequence[Layer],
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> Response:
+        """Return the response of a tile combining multiple layers.
+
+        The tile rendering is cancelled when the client disconnects (`499` response).
+        Layers exceeding their time budget are left out of the tile and listed in an
+        `X-Tile-Timeout` header.
+
+        """
+        etag = self.tile_etag(request, layers, tile, tms, **kwargs)
+        not_modified = self.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            content, timeouts = await cancel_on_disconnect(
+                request.receive,
+                self.get_layers_tile(request, layers, tile, tms, **kwargs),
+            )
+        except ClientDisconnected:
+            return Response(status_code=499)
+
+        if timeouts:
+            return await self.tile_response(
+                request, content, headers=self.timeout_headers(timeouts)
+            )
+
+        return await self.tile_response(request, content, etag)
+
+    def tile_pool(
+        self, request: Request, layer: Optional[Layer] = None
+    ) -> asyncpg.BuildPgPool:
+        """Return the application's pool for the tile queries (`app.state.tile_pool`, e.g read replicas).
+
+        Layers which must be queried on the primary database (`Layer.primary_only`, e.g
+        Function layers) use the primary's pool (`app.state.pool`).
+
+        """
+        if layer is not None and layer.primary_only:
+            return request.app.state.pool
+
+        return getattr(request.app.state, "tile_pool", None) or request.app.state.pool
+
+    @asynccontextmanager
+    async def admit(
+        self, request: Request, layer: Layer, zoom: int
+    ) -> AsyncIterator[None]:
+        """Wait for the application's admission controller (`app.state.admission`) before querying the layer.
+
+        Raises:
+            TileOverloaded: if the query can't be started soon enough.
+
+        """
+        admission = getattr(request.app.state, "admission", None)
+        if admission is None:
+            yield
+            return
+
+        async with admission.admit(layer.id, zoom):
+            yield
+
+    def metrics(self, request: Request) -> Optional[TileMetrics]:
+        """Return the application's metrics (`app.state.metrics`, None if disabled)."""
+        return getattr(request.app.state, "metrics", None)
+
+    def record_tile(
+        self,
+        request: Request,
+        layer: Layer,
+        tms: TileMatrixSet,
+        zoom: int,
+        source: str,
+        content: bytes,
+    ) -> None:
+        """Record a tile from `source` (skipped, archive, cache or rendered) in the application's metrics."""
+        metrics = self.metrics(request)
+        if metrics is None:
+            return
+
+        metrics.observe_tile(
+            layer.id,
+            tms.identifier,
+            zoom,
+            source,
+            empty=not content,
+            size=len(content) if source == "rendered" else None,
+        )
+
+    @asynccontextmanager
+    async def query_layer(
+        self, request: Request, layer: Layer, tms: TileMatrixSet, zoom: int
+    ) -> AsyncIterator[asyncpg.BuildPgPool]:
+        """Admit a layer query (see `admit`) and return the pool to query the layer with.
+
+        With metrics enabled, the admission wait, pool wait, query and whole rendering
+        durations are recorded, within an OpenTelemetry span when tracing is enabled.
+        In debug mode, they are added to the response's `Server-Timing` header.
+
+        """
+        metrics = self.metrics(request)
+        debug = self.debug(request)
+        if metrics is None and not debug:
+            async with self.admit(request, layer, zoom):
+                yield self.tile_pool(request, layer)
+            return
+
+        def observe(stage: str, duration: float) -> None:
+            if metrics is not None:
+                metrics.observe_stage(stage, duration, layer.id, tms.identifier, zoom)
+            if debug:
+                self.add_timing(request, stage, duration, layer.id)
+
+        span = (
+            metrics.span("timvt.tile", layer=layer.id, tms=tms.identifier, zoom=zoom)
+            if metrics is not None
+            else nullcontext()
+        )
+        with span:
+            start = time.perf_counter()
+            async with self.admit(request, layer, zoom):
+                admitted = time.perf_counter()
+                observe("admission_wait", admitted - start)
+                try:
+                    yield TimedPool(self.tile_pool(request, layer), observe)  # type: ignore
+                finally:
+                    observe("render", time.perf_counter() - admitted)
+
+    async def get_encoded_tile(
+        self,
+        request: Request,
+        layer: Layer,
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> Tuple[bytes, Optional[str]]:
+        """Return tile data and its content encoding (None if not compressed).
+
+        Archive tiles are returned as stored in the archive. Table and Function tiles
+        come from the application's tile cache (compressed with the cache's encoding)
+        or are rendered by the layer, compressed and cached.
+
+        """
+        if self.is_empty(request, layer, tile, tms, **kwargs):
+            self.record_tile(request, layer, tms, tile.z, "skipped", b"")
+            return b"", None
+
+        if isinstance(layer, Archive):
+            content, encoding = await layer.read_tile(tile, tms)
+            self.record_tile(request, layer, tms, tile.z, "archive", content)
+            return content, encoding
+
+        cache = getattr(request.app.state, "tile_cache", None)
+        encoding = cache.encoding if cache is not None else None
+        key = self.cache_key(request, layer, tile, tms, **kwargs)
+
+        if cache is not None:
+            with self.timed(request, "cache", layer.id):
+                content = await cache.get(key)
+            if content is not None:
+                self.record_tile(request, layer, tms, tile.z, "cache", content)
+                return content, encoding if content else None
+
+        async def _get_tile() -> bytes:
+            async with self.query_layer(request, layer, tms, tile.z) as pool:
+                content = await layer.get_tile(pool, tile, tms, **kwargs)
+
+            content = bytes(content)
+            self.record_tile(request, layer, tms, tile.z, "rendered", content)
+            if content and encoding:
+                with self.timed(request, "compress", layer.id):
+                    content = await self.compressor(request).compress(content, encoding)
+
+            if cache is not None:
+                await cache.set(key, content)
+
+            return content
+
+        if self.single_flight is not None:
+            content = await self.single_flight.do(key, _get_tile)
+        else:
+            content = await _get_tile()
+
+        return content, encoding if content else None
+
+    async def get_tile(
+        self,
+        request: Request,
+        layer: Layer,
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> bytes:
+        """Return (uncompressed) tile data from the application's tile cache or from the layer."""
+        content, encoding = await self.get_encoded_tile(
+            request, layer, tile, tms, **kwargs
+        )
+        if encoding:
+            return await self.compressor(request).decompress(content, encoding)
+
+        return content
+
+    async def get_layers_tile(
+        self,
+        request: Request,
+        layers: Sequence[Layer],
+        tile: Tile,
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> Tuple[bytes, List[Layer]]:
+        """Return (uncompressed) tile data combining multiple layers, fetched concurrently.
+
+        Layers exceeding their time budget are left out of the tile.
+
+        Returns:
+            tuple: Tile data and layers exceeding their time budget.
+
+        """
+        timeouts: List[Layer] = []
+
+        async def _get_tile(layer: Layer) -> bytes:
+            # Table layers are named after their id (Function and Archive layers
+            # name their own MVT layers)
+            options = (
+                {**kwargs, "layer_name": layer.id}
+                if isinstance(layer, Table)
+                else kwargs
+            )
+            try:
+                return await self.get_tile(request, layer, tile, tms, **options)
+            except TileQueryTimeout:
+                timeouts.append(layer)
+                return b""
+
+        contents = await asyncio.gather(*[_get_tile(layer) for layer in layers])
+
+        # MVT layers are protobuf repeated fields, so concatenated tiles
+        # are a valid tile
+        return b"".join(contents), timeouts
+
+    async def _render_tiles(
+        self,
+        request: Request,
+        layer: Layer,
+        tiles: Sequence[Tile],
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> Tuple[List[Tuple[Tile, bytes]], Optional[Exception]]:
+        """Render tiles with the layer, before sending them.
+
+        Tiles are sent once the query slot and connections are released, so that slow
+        clients don't hold them.
+
+        Returns:
+            tuple: Rendered tiles and the error (time budget exceeded or not admitted) which stopped the rendering, if any.
+
+        """
+        rendered: List[Tuple[Tile, bytes]] = []
+        zoom = min(tile.z for tile in tiles)
+        try:
+            async with self.query_layer(request, layer, tms, zoom) as pool:
+                async for tile, content in layer.get_tiles(pool, tiles, tms, **kwargs):
+                    content = bytes(content or b"")
+                    self.record_tile(request, layer, tms, tile.z, "rendered", content)
+                    rendered.append((tile, content))
+
+        except (TileQueryTimeout, TileOverloaded) as e:
+            return rendered, e
+
+        return rendered, None
+
+    async def get_tiles(
+        self,
+        request: Request,
+        layer: Layer,
+        tiles: Sequence[Tile],
+        tms: TileMatrixSet,
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[Tile, bytes]]:
+        """Return (uncompressed) data for multiple tiles from the application's tile cache or from the layer.
+
+        Known empty and cached tiles are returned first, the others are fetched from the
+        layer at once.
+
+        """
+        cache = getattr(request.app.state, "tile_cache", None)
+        encoding = cache.encoding if cache is not None else None
+        compressor = self.compressor(request)
+
+        missing: List[Tile] = []
+        for tile in tiles:
+            if self.is_empty(request, layer, tile, tms, **kwargs):
+                self.record_tile(request, layer, tms, tile.z, "skipped", b"")
+                yield tile, b""
+                continue
+
+            if cache is not None:
+                key = self.cache_key(request, layer, tile, tms, **kwargs)
+                content = await cache.get(key)
+                if content is not None:
+                    self.record_tile(request, layer, tms, tile.z, "cache", content)
+                    if content and encoding:
+                        content = await compressor.decompress(content, encoding)
+
+                    yield tile, content
+                    continue
+
+            missing.append(tile)
+
+        if not missing:
+            return
+
+        rendered, error = await self._render_tiles(
+            request, layer, missing, tms, **kwargs
+        )
+        for tile, content in rendered:
+            if cache is not None:
+                key = self.cache_key(request, layer, tile, tms, **kwargs)
+                if content and encoding:
+                    await cache.set(key, await compressor.compress(content, encoding))
+                else:
+                    await cache.set(key, content)
+
+            yield tile, content
+
+        if error is not None:
+            raise error
+
+    def register_explain(self):
+        """Register /tiles/.../explain endpoints (debug mode)."""
+
+        @self.router.get(
+            "/tiles/{TileMatrixSetId}/{layer}/{z}/{x}/{y}/explain",
+            responses={200: {"description": "Tile query and plan (debug mode)"}},
+        )
+        @self.router.get(
+            "/tiles/{layer}/{z}/{x}/{y}/explain",
+            responses={200: {"description": "Tile query and plan (debug mode)"}},
+        )
+        async def explain(
+            request: Request,
+            tile: Tile = Depends(TileParams),
+            TileMatrixSetId: Literal[tuple(self.supported_tms.list())] = Query(
+                self.default_tms,
+                description=f"TileMatrixSet Name (default: '{self.default_tms}')",
+            ),
+            layer=Depends(self.layer_dependency),
+        ):
+            """Return the tile's SQL query and its `EXPLAIN (ANALYZE, BUFFERS)` plan.
+
+            Only available in debug mode (`TIMVT_DEBUG` or `X-Debug-Token` header). The
+            query is executed (within the layer's time budget and admission control).
+            Query and plan are null for tiles not sent to the database.
+            """
+            if not self.debug(request):
+                raise DebugDisabled(
+                    "Tile query plans are only available in debug mode."
+                )
+
+            tms = self.supported_tms.get(TileMatrixSetId)
+
+            kwargs = queryparams_to_kwargs(
+                request.query_params, ignore_keys=["tilematrixsetid"]
+            )
+
+            query = layer.tile_query(tile, tms, **kwargs)
+            plan = None
+            if query is not None:
+                async with self.admit(request, layer, tile.z):
+                    with self.timed(request, "explain", layer.id):
+                        plan = await layer.explain(
+                            self.tile_pool(request, layer), tile, tms, **kwargs
+                        )
+
+            return JSONResponse(
+                jsonable_encoder(
+                    {
+                        "layer": layer.id,
+                        "tms": tms.identifier,
+                        "tile": {"z": tile.z, "x": tile.x, "y": tile.y},
+                        "query": query[0] if query else None,
+                        "params": query[1] if query else None,
+                        "plan": plan,
+                    }
+                ),
+                headers={"Cache-Control": "no-store"},
+            )
+
     def register_tiles(self):
         """Register /tiles endpoints."""
 
+        # Multi-layers routes need to be registered before the `tile` routes
+        @self.router.get(
+            "/tiles/{TileMatrixSetId}/{layers:layers}/{z}/{x}/{y}",
+            **TILE_RESPONSE_PARAMS,
+        )
+        @self.router.get("/tiles/{layers:layers}/{z}/{x}/{y}", **TILE_RESPONSE_PARAMS)
+        async def multilayers_tile(
+            request: Request,
+            tile: Tile = Depends(TileParams),
+            TileMatrixSetId: Literal[tuple(self.supported_tms.list())] = Query(
+                self.default_tms,
+                description=f"TileMatrixSet Name (default: '{self.default_tms}')",
+            ),
+            layers=Depends(self.layers_dependency),
+        ):
+            """Return one vector tile combining multiple layers.
+
+            Each layer is fetched concurrently. Table layers are named after the layer id
+            in the resulting tile.
+            """
+            tms = self.supported_tms.get(TileMatrixSetId)
+
+            kwargs = queryparams_to_kwargs(
+                request.query_params, ignore_keys=["tilematrixsetid"]
+            )
+
+            return await self.layers_tile_response(request, layers, tile, tms, **kwargs)
+
         @self.router.get(
             "/tiles/{TileMatrixSetId}/{layer}/{z}/{x}/{y}", **TILE_RESPONSE_PARAMS
         )
@@ -121,15 +887,67 @@ class VectorTilerFactory:
             layer=Depends(self.layer_dependency),
         ):
             """Return vector tile."""
-            pool = request.app.state.pool
             tms = self.supported_tms.get(TileMatrixSetId)
 
             kwargs = queryparams_to_kwargs(
                 request.query_params, ignore_keys=["tilematrixsetid"]
             )
-            content = await layer.get_tile(pool, tile, tms, **kwargs)
 
-            return Response(bytes(content), media_type=MimeTypes.pbf.value)
+            return await self.layer_tile_response(request, layer, tile, tms, **kwargs)
+
+        @self.router.post(
+            "/tiles/{TileMatrixSetId}/{layer}/batch",
+            responses={200: {"content": {MimeTypes.batch.value: {}}}},
+            response_class=StreamingResponse,
+        )
+        @self.router.post(
+            "/tiles/{layer}/batch",
+            responses={200: {"content": {MimeTypes.batch.value: {}}}},
+            response_class=StreamingResponse,
+        )
+        async def tiles_batch(
+            request: Request,
+            body: TileBatch,
+            TileMatrixSetId: Literal[tuple(self.supported_tms.list())] = Query(
+                self.default_tms,
+                description=f"TileMatrixSet Name (default: '{self.default_tms}')",
+            ),
+            layer=Depends(self.layer_dependency),
+        ):
+            """Return multiple vector tiles.
+
+            The response is a stream of records, one per tile (not necessarily in the
+            requested order), each made of a 16 bytes header (`z`, `x`, `y` and data
+            length as big-endian unsigned 32 bits integers) followed by the tile data.
+            When tiles are not rendered within the layer's time budget (or are rejected by
+            the admission control), the stream ends with an error record, whose `z` is
+            `4294967295` (`x` and `y` are 0) and data is the error message: the tiles
+            without a record are missing.
+            """
+            tms = self.supported_tms.get(TileMatrixSetId)
+
+            kwargs = queryparams_to_kwargs(
+                request.query_params, ignore_keys=["tilematrixsetid"]
+            )
+
+            # The stream (and its query) is cancelled when the client disconnects
+            async def _stream():
+                try:
+                    async for tile, content in self.get_tiles(
+                        request, layer, body.to_tiles(), tms, **kwargs
+                    ):
+                        yield struct.pack(">IIII", tile.z, tile.x, tile.y, len(content))
+                        yield content
+
+                # Tiles not rendered within the time budget (or not admitted) are left
+                # out of the stream, which ends with an error record
+                except (TileQueryTimeout, TileOverloaded) as e:
+                    logger.warning(e)
+                    message = str(e).encode()
+                    yield struct.pack(">IIII", BATCH_ERROR_ZOOM, 0, 0, len(message))
+                    yield message
+
+            return StreamingResponse(_stream(), media_type=MimeTypes.batch.value)
 
         @self.router.get(
             "/{TileMatrixSetId}/{layer}/tilejson.json",
@@ -216,8 +1034,8 @@ class VectorTilerFactory:
 
             table_catalog = getattr(request.app.state, "table_catalog", {})
             return [
-                Table(**table_info, tileurl=_get_tiles_url(table_id))
-                for table_id, table_info in table_catalog.items()
+                table.copy(update={"tileurl": _get_tiles_url(table_id)})
+                for table_id, table in table_catalog.items()
             ]
 
         @self.router.get(
@@ -240,8 +1058,8 @@ class VectorTilerFactory:
                 except NoMatchFound:
                     return None
 
-            layer.tileurl = _get_tiles_url(layer.id)
-            return layer
+            # Layers are shared across requests
+            return layer.copy(update={"tileurl": _get_tiles_url(layer.id)})
 
     def register_functions_metadata(self):  # noqa
         """Register function metadata endpoints."""
@@ -292,8 +1110,56 @@ class VectorTilerFactory:
                 except NoMatchFound:
                     return None
 
-            layer.tileurl = _get_tiles_url(layer.id)
-            return layer
+            return layer.copy(update={"tileurl": _get_tiles_url(layer.id)})
+
+    def register_archives_metadata(self):  # noqa
+        """Register archive metadata endpoints."""
+
+        @self.router.get(
+            "/archives.json",
+            response_model=List[Archive],
+            response_model_exclude_none=True,
+            response_model_exclude={"path"},
+        )
+        async def archives_index(request: Request):
+            """Index of archives."""
+            archive_catalog = getattr(request.app.state, "timvt_archive_catalog", {})
+
+            def _get_tiles_url(id) -> Optional[str]:
+                try:
+                    return self.url_for(
+                        request, "tile", layer=id, z="{z}", x="{x}", y="{y}"
+                    )
+                except NoMatchFound:
+                    return None
+
+            return [
+                archive.copy(update={"tileurl": _get_tiles_url(archive.id)})
+                for archive in archive_catalog.values()
+            ]
+
+        @self.router.get(
+            "/archive/{layer}.json",
+            response_model=Archive,
+            responses={200: {"description": "Return Archive metadata"}},
+            response_model_exclude_none=True,
+            response_model_exclude={"path"},
+        )
+        async def archive_metadata(
+            request: Request,
+            layer=Depends(self.layer_dependency),
+        ):
+            """Return archive metadata."""
+
+            def _get_tiles_url(id) -> Optional[str]:
+                try:
+                    return self.url_for(
+                        request, "tile", layer=id, z="{z}", x="{x}", y="{y}"
+                    )
+                except NoMatchFound:
+                    return None
+
+            return layer.copy(update={"tileurl": _get_tiles_url(layer.id)})
 
     def register_viewer(self):
         """Register viewer."""
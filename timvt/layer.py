@@ -1,26 +1,299 @@
 """timvt models."""
 
 import abc
+import asyncio
+import hashlib
+import itertools
 import json
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Any, ClassVar, Dict, List, Optional
+from functools import lru_cache
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    ClassVar,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 import morecantile
-from buildpg import Func
+from asyncpg.exceptions import QueryCanceledError, UndefinedFunctionError
+from buildpg import Empty, Func, RawDangerous
 from buildpg import Var as pg_variable
 from buildpg import asyncpg, clauses, funcs, render, select_fields
-from pydantic import BaseModel, root_validator
+from pydantic import BaseModel, PrivateAttr, root_validator
 
+from timvt import __version__, pmtiles
+from timvt.compression import decompress
+from timvt.dbmodel import GeometryColumn, Overview
 from timvt.dbmodel import Table as DBTable
 from timvt.errors import (
     InvalidGeometryColumnName,
+    InvalidTileMatrixSet,
     MissingEPSGCode,
     MissingGeometryColumn,
+    TileQueryTimeout,
 )
+from timvt.mbtiles import MBTiles
+from timvt.pmtiles import PMTilesReader
 from timvt.settings import TileSettings
 
+from starlette.concurrency import run_in_threadpool
+
 tile_settings = TileSettings()
 
+# Size (in bytes) of the compressed archive tiles decompressed in a thread (instead of
+# the event loop), tiles usually compress 2 to 5 times
+ARCHIVE_OFFLOAD_THRESHOLD = 16 * 1024
+
+TABLE_TILE_SQL = """
+    WITH
+    -- bounds (the tile envelope) in TMS's CRS (SRID)
+    bounds_tmscrs AS (
+        SELECT
+            ST_Segmentize(
+                ST_MakeEnvelope(
+                    :xmin,
+                    :ymin,
+                    :xmax,
+                    :ymax,
+                    -- If EPSG is null we set it to 0
+                    coalesce(:tms_srid, 0)
+                ),
+                :seg_size
+            ) AS geom
+    ),
+    bounds_geomcrs AS (
+        SELECT
+            geom,
+            -- Size of a tile pixel in table geometry's CRS
+            (ST_XMax(geom) - ST_XMin(geom)) / :tile_resolution AS pixel
+        FROM (
+            SELECT
+                CASE WHEN coalesce(:tms_srid, 0) != 0 THEN
+                    ST_Transform(bounds_tmscrs.geom, :geometry_srid)
+                ELSE
+                    ST_Transform(bounds_tmscrs.geom, :tms_proj, :geometry_srid)
+                END as geom
+            FROM bounds_tmscrs
+        ) AS b
+    ),
+    -- Features intersecting the tile (in table geometry's CRS)
+    features AS (
+        SELECT
+            -- Simplify geometries with a tolerance in tile pixels
+            CASE WHEN :simplify IS NULL THEN
+                :geometry::geometry
+            ELSE
+                ST_Simplify(:geometry::geometry, :simplify * bounds_geomcrs.pixel, true)
+            END AS :geometry_column,
+            :fields
+        FROM :tablename t, bounds_geomcrs
+        -- Find where geometries intersect with input Tile
+        -- Intersects test is made in table geometry's CRS (e.g WGS84),
+        -- or in TMS's CRS for transformed geometry columns/indexes
+        WHERE ST_Intersects(
+            :geometry, bounds_geomcrs.geom
+        )
+        -- Skip polygons smaller than `min_area` square pixels
+        AND (
+            :min_area IS NULL
+            OR ST_Dimension(:geometry::geometry) < 2
+            OR ST_Area(:geometry::geometry) >= :min_area * bounds_geomcrs.pixel ^ 2
+        )
+        :order_by
+        LIMIT :limit
+    ),
+    mvtgeom AS (
+        SELECT ST_AsMVTGeom(
+            CASE WHEN :tms_srid IS NOT NULL THEN
+                ST_Transform(t.:geometry_column, :tms_srid)
+            ELSE
+                ST_Transform(t.:geometry_column, :tms_proj)
+            END,
+            bounds_tmscrs.geom,
+            :tile_resolution,
+            :tile_buffer
+        ) AS geom, :fields
+        FROM features t, bounds_tmscrs
+    )
+    SELECT ST_AsMVT(mvtgeom.*, :layer_name) FROM mvtgeom
+"""
+
+
+TABLE_TILES_SQL = """
+    WITH
+    -- tiles envelopes in TMS's CRS (SRID)
+    tiles AS (
+        SELECT *
+        FROM unnest(
+            :xmins::float8[],
+            :ymins::float8[],
+            :xmaxs::float8[],
+            :ymaxs::float8[],
+            :seg_sizes::float8[]
+        ) WITH ORDINALITY AS tiles(xmin, ymin, xmax, ymax, seg_size, idx)
+    ),
+    bounds_tmscrs AS (
+        SELECT
+            idx,
+            ST_Segmentize(
+                ST_MakeEnvelope(xmin, ymin, xmax, ymax, coalesce(:tms_srid, 0)),
+                seg_size
+            ) AS geom
+        FROM tiles
+    ),
+    bounds AS (
+        SELECT
+            idx,
+            tmscrs,
+            geomcrs,
+            -- Size of a tile pixel in table geometry's CRS
+            (ST_XMax(geomcrs) - ST_XMin(geomcrs)) / :tile_resolution AS pixel
+        FROM (
+            SELECT
+                idx,
+                geom AS tmscrs,
+                CASE WHEN coalesce(:tms_srid, 0) != 0 THEN
+                    ST_Transform(geom, :geometry_srid)
+                ELSE
+                    ST_Transform(geom, :tms_proj, :geometry_srid)
+                END as geomcrs
+            FROM bounds_tmscrs
+        ) AS b
+    )
+    SELECT
+        bounds.idx,
+        (
+            SELECT ST_AsMVT(mvtgeom.*, :layer_name)
+            FROM (
+                SELECT ST_AsMVTGeom(
+                    CASE WHEN :tms_srid IS NOT NULL THEN
+                        ST_Transform(t.:geometry_column, :tms_srid)
+                    ELSE
+                        ST_Transform(t.:geometry_column, :tms_proj)
+                    END,
+                    bounds.tmscrs,
+                    :tile_resolution,
+                    :tile_buffer
+                ) AS geom, :fields
+                FROM (
+                    SELECT
+                        -- Simplify geometries with a tolerance in tile pixels
+                        CASE WHEN :simplify IS NULL THEN
+                            :geometry::geometry
+                        ELSE
+                            ST_Simplify(:geometry::geometry, :simplify * bounds.pixel, true)
+                        END AS :geometry_column,
+                        :fields
+                    FROM :tablename t
+                    WHERE ST_Intersects(:geometry, bounds.geomcrs)
+                    -- Skip polygons smaller than `min_area` square pixels
+                    AND (
+                        :min_area IS NULL
+                        OR ST_Dimension(:geometry::geometry) < 2
+                        OR ST_Area(:geometry::geometry) >= :min_area * bounds.pixel ^ 2
+                    )
+                    :order_by
+                    LIMIT :limit
+                ) AS t
+            ) AS mvtgeom
+        )
+    FROM bounds
+    ORDER BY bounds.idx
+"""
+
+TABLE_SQL_PARAMS = [
+    "xmin",
+    "ymin",
+    "xmax",
+    "ymax",
+    "seg_size",
+    "xmins",
+    "ymins",
+    "xmaxs",
+    "ymaxs",
+    "seg_sizes",
+    "tms_proj",
+    "tms_srid",
+    "tile_resolution",
+    "tile_buffer",
+    "limit",
+    "layer_name",
+]
+
+
+class _SQLParam:
+    """Placeholder for a query parameter, replaced by its value at execution time."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _TileSource(NamedTuple):
+    """Table and geometry to query for a tile."""
+
+    table: str
+    geometry_srid: int
+    # Column to read the geometries from
+    geometry: str
+    # SRID of an indexed `ST_Transform(geometry, srid)` expression to use
+    transform: Optional[int] = None
+
+
+@lru_cache(maxsize=512)
+def _table_tile_sql(
+    template: str,
+    table: str,
+    geometry_column: str,
+    columns: Tuple[str, ...],
+    order_by: Optional[str] = None,
+    source_column: Optional[str] = None,
+    transform: Optional[int] = None,
+) -> Tuple[str, Tuple[str, ...]]:
+    """Render a Table tile SQL query.
+
+    Returns:
+        tuple: SQL query and names of its positional parameters ($1, $2, ...).
+
+    """
+    order_clause: Any = Empty()
+    if order_by:
+        # `-{column}` for descending order
+        if order_by.startswith("-"):
+            column = pg_variable(f"t.{order_by[1:]}").desc().nulls_last()
+        else:
+            column = pg_variable(f"t.{order_by.lstrip('+')}").asc().nulls_last()
+        order_clause = clauses.OrderBy(column)
+
+    geometry: Any = pg_variable(f"t.{source_column or geometry_column}")
+    if transform:
+        # The SRID must be a literal for the planner to match the expression index
+        geometry = Func("ST_Transform", geometry, RawDangerous(str(int(transform))))
+
+    q, p = render(
+        template,
+        tablename=pg_variable(table),
+        geometry_column=pg_variable(geometry_column),
+        geometry=geometry,
+        # Qualified, so that columns can't collide with the helper CTEs' columns (e.g `pixel`)
+        fields=select_fields(*[f"t.{column}" for column in columns]),
+        order_by=order_clause,
+        geometry_srid=funcs.cast(_SQLParam("geometry_srid"), "int"),
+        simplify=funcs.cast(_SQLParam("simplify"), "float8"),
+        min_area=funcs.cast(_SQLParam("min_area"), "float8"),
+        **{name: _SQLParam(name) for name in TABLE_SQL_PARAMS},
+    )
+
+    return q, tuple(param.name for param in p)
+
 
 class Layer(BaseModel, metaclass=abc.ABCMeta):
     """Layer's Abstract BaseClass.
@@ -32,6 +305,7 @@ class Layer(BaseModel, metaclass=abc.ABCMeta):
         maxzoom (int): Layer's max zoom level.
         default_tms (str): TileMatrixSet name for the min/max zoom.
         tileurl (str, optional): Layer's tiles url.
+        statement_timeout (float, optional): Maximum duration (in seconds) of the layer's tile queries.
 
     """
 
@@ -44,6 +318,47 @@ class Layer(BaseModel, metaclass=abc.ABCMeta):
     maxzoom: int = tile_settings.default_maxzoom
     default_tms: str = tile_settings.default_tms
     tileurl: Optional[str]
+    statement_timeout: Optional[float]
+
+    # Whether the layer's queries must run on the primary database (e.g not on read replicas)
+    primary_only: ClassVar[bool] = False
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of the layer's configuration, the tile settings and timvt's version, which all change the tiles."""
+        digest = hashlib.blake2b(digest_size=8)
+        for config in (
+            self.json(exclude={"tileurl"}),
+            tile_settings.json(),
+            __version__,
+        ):
+            digest.update(config.encode())
+
+        return digest.hexdigest()
+
+    @property
+    def query_timeout(self) -> Optional[float]:
+        """Timeout (in seconds) of the tile queries (defaults to `TIMVT_STATEMENT_TIMEOUT`)."""
+        if self.statement_timeout is not None:
+            return self.statement_timeout
+
+        return tile_settings.statement_timeout
+
+    @contextmanager
+    def query_budget(self) -> Iterator[None]:
+        """Raise `TileQueryTimeout` for queries exceeding the timeout.
+
+        Queries exceeding `query_timeout` (asyncpg's `timeout`) are cancelled by asyncpg,
+        which also raises `asyncio.TimeoutError`. Queries cancelled by Postgres (e.g
+        database's `statement_timeout`) raise `QueryCanceledError`.
+
+        """
+        try:
+            yield
+        except (asyncio.TimeoutError, QueryCanceledError) as e:
+            raise TileQueryTimeout(
+                f"Tile query for layer '{self.id}' exceeded its time budget."
+            ) from e
 
     @abc.abstractmethod
     async def get_tile(
@@ -67,6 +382,87 @@ class Layer(BaseModel, metaclass=abc.ABCMeta):
         """
         ...
 
+    async def get_tiles(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tiles: Sequence[morecantile.Tile],
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[morecantile.Tile, bytes]]:
+        """Return Data for multiple tiles.
+
+        Args:
+            pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+            tiles (list of morecantile.Tile): Tile objects with X,Y,Z indices.
+            tms (morecantile.TileMatrixSet): Tile Matrix Set.
+            kwargs (any, optiona): Optional parameters to forward to the SQL function.
+
+        Yields:
+            tuple: Tile and Mapbox Vector Tile, in the `tiles` order.
+
+        """
+        for tile in tiles:
+            yield tile, await self.get_tile(pool, tile, tms, **kwargs)
+
+    def tile_query(
+        self,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> Optional[Tuple[str, List[Any]]]:
+        """Return the SQL query and parameters rendering a tile.
+
+        Returns None for layers not backed by a SQL query and for tiles known to be
+        empty (not sent to the database).
+
+        """
+        return None
+
+    async def explain(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Run the tile query with `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`.
+
+        Args:
+            pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+            tile (morecantile.Tile): Tile object with X,Y,Z indices.
+            tms (morecantile.TileMatrixSet): Tile Matrix Set.
+            kwargs (any, optiona): Optional parameters to forward to the SQL function.
+
+        Returns:
+            list: Query plan, with actual timings and buffers usage (None if the tile isn't queried).
+
+        """
+        query = self.tile_query(tile, tms, **kwargs)
+        if query is None:
+            return None
+
+        sql_query, params = query
+        with self.query_budget():
+            async with pool.acquire() as conn:
+                plan = await self._call(
+                    conn,
+                    conn.fetchval,
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql_query}",
+                    params,
+                )
+
+        return json.loads(plan)
+
+    async def _call(
+        self,
+        conn: asyncpg.BuildPgConnection,
+        method: Callable[..., Awaitable[Any]],
+        query: str,
+        params: List[Any],
+    ) -> Any:
+        """Execute a tile query."""
+        return await method(query, *params, timeout=self.query_timeout)
+
 
 class Table(Layer, DBTable):
     """Table Reader.
@@ -84,10 +480,63 @@ class Table(Layer, DBTable):
         id_column (str): name of id column
         geometry_columns (list): List of geometry columns.
         properties (list): List of property columns.
+        simplify (float, optional): Geometry simplification tolerance, in tile pixels.
+        min_area (float, optional): Minimum area of polygons, in square tile pixels.
+        order_by (str, optional): Column used to select the features first (`-{column}` for descending order).
+        overviews (list): Pre-processed tables used in place of the Table for ranges of zoom levels.
+
+    Tables are immutable (use `copy(update=...)`) so the table catalog can share them
+    across requests, with their tile columns and SQL queries computed once.
 
     """
 
     type: str = "Table"
+    simplify: Optional[float]
+    min_area: Optional[float]
+    order_by: Optional[str]
+
+    # Default tile columns (all the properties but the geometry), by geometry column
+    _tile_columns: Dict[str, Tuple[str, ...]] = PrivateAttr(default_factory=dict)
+    # Rendered tile SQL queries with the default tile columns
+    _tile_sql: Dict[Tuple[Any, ...], Tuple[str, Tuple[str, ...]]] = PrivateAttr(
+        default_factory=dict
+    )
+    _fingerprint: Optional[str] = PrivateAttr(default=None)
+
+    class Config:
+        """model config"""
+
+        allow_mutation = False
+
+    def __init__(self, **data: Any):
+        """Init Table and compute the default tile columns."""
+        super().__init__(**data)
+        self._tile_columns = self._default_tile_columns()
+
+    def _default_tile_columns(self) -> Dict[str, Tuple[str, ...]]:
+        """Return the default tile columns, by geometry column."""
+        names = [p.name for p in self.properties]
+        return {
+            col.name: tuple(n for n in names if n != col.name)
+            for col in self.geometry_columns
+        }
+
+    def copy(self, **kwargs: Any) -> "Table":
+        """Copy Table (e.g `table.copy(update={"simplify": 4.0})`)."""
+        table = super().copy(**kwargs)
+        # Updated fields might change the tile columns and SQL queries
+        table._tile_columns = table._default_tile_columns()
+        table._tile_sql = {}
+        table._fingerprint = None
+        return table
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of the table's configuration, the tile settings and timvt's version (computed once)."""
+        if self._fingerprint is None:
+            self._fingerprint = super().fingerprint
+
+        return self._fingerprint
 
     @root_validator
     def bounds_default(cls, values):
@@ -101,16 +550,10 @@ class Table(Layer, DBTable):
 
         return values
 
-    async def get_tile(
-        self,
-        pool: asyncpg.BuildPgPool,
-        tile: morecantile.Tile,
-        tms: morecantile.TileMatrixSet,
-        **kwargs: Any,
-    ):
-        """Get Tile Data."""
-        bbox = tms.xy_bounds(tile)
-
+    def _tile_query_options(
+        self, tms: morecantile.TileMatrixSet, **kwargs: Any
+    ) -> Tuple[GeometryColumn, Tuple[str, ...], Dict[str, Any]]:
+        """Return geometry column, columns and SQL parameters shared by all tiles."""
         limit = kwargs.get(
             "limit", str(tile_settings.max_features_per_tile)
         )  # Number of features to write to a tile.
@@ -127,6 +570,8 @@ class Table(Layer, DBTable):
         buffer = kwargs.get(
             "buffer", str(tile_settings.tile_buffer)
         )  # Size of extra data to add for a tile.
+        # Name of the MVT layer (set by the application for multi-layers tiles)
+        layer_name = kwargs.get("layer_name", "default")
 
         if not self.geometry_columns:
             raise MissingGeometryColumn(
@@ -138,86 +583,235 @@ class Table(Layer, DBTable):
         if not geometry_column:
             raise InvalidGeometryColumnName(f"Invalid Geometry Column: {geom}.")
 
-        geometry_srid = geometry_column.srid
-
         # create list of columns to return
-        cols = [p.name for p in self.properties if p.name != geometry_column.name]
+        cols = self._tile_columns[geometry_column.name]
         if columns is not None:
             include_cols = [c.strip() for c in columns.split(",")]
-            cols = [c for c in cols if c in include_cols]
+            cols = tuple(c for c in cols if c in include_cols)
 
-        segSize = bbox.right - bbox.left
+        params = {
+            "geometry_srid": geometry_column.srid,
+            "tms_proj": tms.crs.to_proj4(),
+            "tms_srid": tms.crs.to_epsg(),
+            "tile_resolution": int(resolution),
+            "tile_buffer": int(buffer),
+            "limit": limit,
+            "layer_name": layer_name,
+            "simplify": self.simplify,
+            "min_area": self.min_area,
+        }
 
+        return geometry_column, cols, params
+
+    def _outside_bounds(
+        self,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        geometry_column: GeometryColumn,
+    ) -> bool:
+        """Check if a tile is outside the geometry column's extent.
+
+        The extent (from `ST_EstimatedExtent`) is approximate, so we expand it by
+        `tile_settings.bounds_check_margin`.
+
+        """
+        if not tile_settings.bounds_check:
+            return False
+
+        # Geographic bounds of tiles in other CRS might not cover the tile's content
+        if not (tms.crs.is_geographic or tms.crs.to_epsg() == 3857):
+            return False
+
+        minx, miny, maxx, maxy = geometry_column.bounds
+        dx = (maxx - minx) * tile_settings.bounds_check_margin
+        dy = (maxy - miny) * tile_settings.bounds_check_margin
+
+        bbox = tms.bounds(tile)
+        return (
+            bbox.left > maxx + dx
+            or bbox.right < minx - dx
+            or bbox.bottom > maxy + dy
+            or bbox.top < miny - dy
+        )
+
+    def _overview(
+        self, tms: morecantile.TileMatrixSet, zoom: int, geometry_column: str
+    ) -> Optional[Overview]:
+        """Return the overview for a zoom level, if any."""
+        for overview in self.overviews:
+            if (
+                overview.tms == tms.identifier
+                and overview.geometry_column == geometry_column
+                and overview.minzoom <= zoom <= overview.maxzoom
+            ):
+                return overview
+
+        return None
+
+    def _tile_source(
+        self,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        geometry_column: GeometryColumn,
+    ) -> Optional[_TileSource]:
+        """Return table and geometry to query for a tile (None if the tile is empty)."""
+        if self._outside_bounds(tile, tms, geometry_column):
+            return None
+
+        overview = self._overview(tms, tile.z, geometry_column.name)
+        if overview:
+            return _TileSource(overview.table, overview.srid, overview.geometry_column)
+
+        # Use geometries already in TMS's CRS to avoid transforming each feature
         tms_srid = tms.crs.to_epsg()
-        tms_proj = tms.crs.to_proj4()
+        if tms_srid and tms_srid != geometry_column.srid:
+            if tms_srid in geometry_column.transforms:
+                name = geometry_column.transforms[tms_srid]
+                if name:
+                    return _TileSource(self.id, tms_srid, name)
 
-        async with pool.acquire() as conn:
-            sql_query = """
-                WITH
-                -- bounds (the tile envelope) in TMS's CRS (SRID)
-                bounds_tmscrs AS (
-                    SELECT
-                        ST_Segmentize(
-                            ST_MakeEnvelope(
-                                :xmin,
-                                :ymin,
-                                :xmax,
-                                :ymax,
-                                -- If EPSG is null we set it to 0
-                                coalesce(:tms_srid, 0)
-                            ),
-                            :seg_size
-                        ) AS geom
-                ),
-                bounds_geomcrs AS (
-                    SELECT
-                        CASE WHEN coalesce(:tms_srid, 0) != 0 THEN
-                            ST_Transform(bounds_tmscrs.geom, :geometry_srid)
-                        ELSE
-                            ST_Transform(bounds_tmscrs.geom, :tms_proj, :geometry_srid)
-                        END as geom
-                    FROM bounds_tmscrs
-                ),
-                mvtgeom AS (
-                    SELECT ST_AsMVTGeom(
-                        CASE WHEN :tms_srid IS NOT NULL THEN
-                            ST_Transform(t.:geometry_column, :tms_srid)
-                        ELSE
-                            ST_Transform(t.:geometry_column, :tms_proj)
-                        END,
-                        bounds_tmscrs.geom,
-                        :tile_resolution,
-                        :tile_buffer
-                    ) AS geom, :fields
-                    FROM :tablename t, bounds_tmscrs, bounds_geomcrs
-                    -- Find where geometries intersect with input Tile
-                    -- Intersects test is made in table geometry's CRS (e.g WGS84)
-                    WHERE ST_Intersects(
-                        t.:geometry_column, bounds_geomcrs.geom
-                    ) LIMIT :limit
+                return _TileSource(
+                    self.id, tms_srid, geometry_column.name, transform=tms_srid
                 )
-                SELECT ST_AsMVT(mvtgeom.*) FROM mvtgeom
-            """
 
-            q, p = render(
-                sql_query,
-                tablename=pg_variable(self.id),
-                geometry_column=pg_variable(geometry_column.name),
-                fields=select_fields(*cols),
-                xmin=bbox.left,
-                ymin=bbox.bottom,
-                xmax=bbox.right,
-                ymax=bbox.top,
-                geometry_srid=funcs.cast(geometry_srid, "int"),
-                tms_proj=tms_proj,
-                tms_srid=tms_srid,
-                seg_size=segSize,
-                tile_resolution=int(resolution),
-                tile_buffer=int(buffer),
-                limit=limit,
+        return _TileSource(self.id, geometry_column.srid, geometry_column.name)
+
+    def _render_tile_sql(
+        self,
+        template: str,
+        source: _TileSource,
+        geometry_column: str,
+        cols: Tuple[str, ...],
+    ) -> Tuple[str, Tuple[str, ...]]:
+        """Return the rendered tile SQL query and names of its positional parameters."""
+        key = (template, source, geometry_column, cols)
+        sql = self._tile_sql.get(key)
+        if sql is not None:
+            return sql
+
+        sql = _table_tile_sql(
+            template,
+            source.table,
+            geometry_column,
+            cols,
+            self.order_by,
+            source.geometry,
+            source.transform,
+        )
+        # Only the queries with the default columns, the `columns` option is unbounded
+        if cols == self._tile_columns.get(geometry_column):
+            self._tile_sql[key] = sql
+
+        return sql
+
+    def tile_query(
+        self,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> Optional[Tuple[str, List[Any]]]:
+        """Return the SQL query and parameters rendering a tile (None if the tile is outside the table's extent)."""
+        geometry_column, cols, params = self._tile_query_options(tms, **kwargs)
+        source = self._tile_source(tile, tms, geometry_column)
+        if source is None:
+            return None
+
+        params["geometry_srid"] = source.geometry_srid
+
+        bbox = tms.xy_bounds(tile)
+        params.update(
+            {
+                "xmin": bbox.left,
+                "ymin": bbox.bottom,
+                "xmax": bbox.right,
+                "ymax": bbox.top,
+                "seg_size": bbox.right - bbox.left,
+            }
+        )
+
+        sql_query, sql_params = self._render_tile_sql(
+            TABLE_TILE_SQL, source, geometry_column.name, cols
+        )
+
+        return sql_query, [params[p] for p in sql_params]
+
+    async def get_tile(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ):
+        """Get Tile Data."""
+        query = self.tile_query(tile, tms, **kwargs)
+        if query is None:
+            return b""
+
+        sql_query, params = query
+        with self.query_budget():
+            async with pool.acquire() as conn:
+                # asyncpg keeps a per-connection cache of prepared statements keyed by
+                # the SQL text, which is stable for a (table, geometry, columns) set.
+                return await self._call(conn, conn.fetchval, sql_query, params)
+
+    async def get_tiles(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tiles: Sequence[morecantile.Tile],
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[morecantile.Tile, bytes]]:
+        """Get Data for multiple tiles, using one SQL query per table (Table or overview)."""
+        if not tiles:
+            return
+
+        geometry_column, cols, params = self._tile_query_options(tms, **kwargs)
+
+        # Tiles outside the table's extent are not sent to the database
+        sources = [self._tile_source(tile, tms, geometry_column) for tile in tiles]
+        if all(source is None for source in sources):
+            for tile in tiles:
+                yield tile, b""
+            return
+
+        # consecutive tiles using the same table are rendered by the same query
+        for source, group in itertools.groupby(
+            zip(tiles, sources), key=lambda item: item[1]
+        ):
+            query_tiles = [tile for tile, _ in group]
+            if source is None:
+                for tile in query_tiles:
+                    yield tile, b""
+                continue
+
+            params["geometry_srid"] = source.geometry_srid
+
+            bboxes = [tms.xy_bounds(tile) for tile in query_tiles]
+            params.update(
+                {
+                    "xmins": [bbox.left for bbox in bboxes],
+                    "ymins": [bbox.bottom for bbox in bboxes],
+                    "xmaxs": [bbox.right for bbox in bboxes],
+                    "ymaxs": [bbox.top for bbox in bboxes],
+                    "seg_sizes": [bbox.right - bbox.left for bbox in bboxes],
+                }
+            )
+
+            sql_query, sql_params = self._render_tile_sql(
+                TABLE_TILES_SQL, source, geometry_column.name, cols
             )
 
-            return await conn.fetchval(q, *p)
+            # The tiles of a group are fetched in one round trip, within the time
+            # budget, and sent back once the connection is released (the client
+            # might be slower than the database).
+            with self.query_budget():
+                async with pool.acquire() as conn:
+                    rows = await self._call(
+                        conn, conn.fetch, sql_query, [params[p] for p in sql_params]
+                    )
+
+            for row in rows:
+                yield query_tiles[row[0] - 1], row[1]
 
 
 class Function(Layer):
@@ -241,6 +835,13 @@ class Function(Layer):
     function_name: Optional[str]
     options: Optional[List[Dict[str, Any]]]
 
+    # The SQL function is created by the tile queries, which read replicas reject
+    primary_only: ClassVar[bool] = True
+
+    # SQL (digest) of the functions created in the temporary schema of each Postgres
+    # backend (PID), shared by the layers to detect functions created by other layers
+    _registered: ClassVar[Dict[Tuple[int, str], str]] = {}
+
     @root_validator
     def function_name_default(cls, values):
         """Define default function's name to be same as id."""
@@ -257,6 +858,76 @@ class Function(Layer):
 
         return cls(id=id, sql=sql, **kwargs)
 
+    @property
+    def qualified_name(self) -> str:
+        """Name of the SQL function in the connection's temporary schema."""
+        return f"pg_temp.{self.function_name}"
+
+    async def register(self, conn: asyncpg.BuildPgConnection) -> None:
+        """Create the SQL function, once per database connection.
+
+        The function is created in the connection's temporary schema (`pg_temp`), so
+        it's private to the connection and dropped with it. It's created again when
+        the function created on the connection is from another layer's SQL (e.g layers
+        with the same `function_name`).
+
+        Args:
+            conn (asyncpg.BuildPgConnection): AsyncPG database connection.
+
+        """
+        key = (conn.get_server_pid(), self.function_name)
+        digest = hashlib.sha1(self.sql.encode()).hexdigest()
+        if self._registered.get(key) == digest:
+            return
+
+        async with conn.transaction():
+            # Unqualified functions are created in the first schema of the search path
+            await conn.execute(
+                "SELECT set_config('search_path', 'pg_temp,' || current_setting('search_path'), true)"
+            )
+            await conn.execute(self.sql)
+
+        self._registered[key] = digest
+
+    def tile_query(
+        self,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> Tuple[str, List[Any]]:
+        """Return the SQL query calling the function for a tile and its parameters."""
+        # We only support TMS with valid EPSG code
+        if not tms.crs.to_epsg():
+            raise MissingEPSGCode(
+                f"{tms.identifier}'s CRS does not have a valid EPSG code."
+            )
+
+        bbox = tms.xy_bounds(tile)
+
+        # Build the query
+        sql_query = clauses.Select(
+            Func(
+                self.qualified_name,
+                ":xmin",
+                ":ymin",
+                ":xmax",
+                ":ymax",
+                ":epsg",
+                ":query_params::text::json",
+            ),
+        )
+        q, p = render(
+            str(sql_query),
+            xmin=bbox.left,
+            ymin=bbox.bottom,
+            xmax=bbox.right,
+            ymax=bbox.top,
+            epsg=tms.crs.to_epsg(),
+            query_params=json.dumps(kwargs),
+        )
+
+        return q, p
+
     async def get_tile(
         self,
         pool: asyncpg.BuildPgPool,
@@ -265,49 +936,226 @@ class Function(Layer):
         **kwargs: Any,
     ):
         """Get Tile Data."""
+        q, p = self.tile_query(tile, tms, **kwargs)
+
+        with self.query_budget():
+            async with pool.acquire() as conn:
+                return await self._call(conn, conn.fetchval, q, p)
+
+    async def get_tiles(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tiles: Sequence[morecantile.Tile],
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[morecantile.Tile, bytes]]:
+        """Get Data for multiple tiles, using one SQL query."""
         # We only support TMS with valid EPSG code
         if not tms.crs.to_epsg():
             raise MissingEPSGCode(
                 f"{tms.identifier}'s CRS does not have a valid EPSG code."
             )
 
-        bbox = tms.xy_bounds(tile)
+        if not tiles:
+            return
 
-        async with pool.acquire() as conn:
-            transaction = conn.transaction()
-            await transaction.start()
-            # Register the custom function
-            await conn.execute(self.sql)
+        bboxes = [tms.xy_bounds(tile) for tile in tiles]
 
-            # Build the query
-            sql_query = clauses.Select(
-                Func(
-                    self.function_name,
-                    ":xmin",
-                    ":ymin",
-                    ":xmax",
-                    ":ymax",
-                    ":epsg",
-                    ":query_params::text::json",
-                ),
-            )
-            q, p = render(
-                str(sql_query),
-                xmin=bbox.left,
-                ymin=bbox.bottom,
-                xmax=bbox.right,
-                ymax=bbox.top,
-                epsg=tms.crs.to_epsg(),
-                query_params=json.dumps(kwargs),
+        q, p = render(
+            """
+            SELECT
+                :function_name(
+                    t.xmin, t.ymin, t.xmax, t.ymax, :epsg, :query_params::text::json
+                )
+            FROM unnest(
+                :xmins::float8[], :ymins::float8[], :xmaxs::float8[], :ymaxs::float8[]
+            ) WITH ORDINALITY AS t(xmin, ymin, xmax, ymax, idx)
+            ORDER BY t.idx
+            """,
+            function_name=pg_variable(self.qualified_name),
+            xmins=[bbox.left for bbox in bboxes],
+            ymins=[bbox.bottom for bbox in bboxes],
+            xmaxs=[bbox.right for bbox in bboxes],
+            ymaxs=[bbox.top for bbox in bboxes],
+            epsg=tms.crs.to_epsg(),
+            query_params=json.dumps(kwargs),
+        )
+
+        with self.query_budget():
+            async with pool.acquire() as conn:
+                rows = await self._call(conn, conn.fetch, q, p)
+
+        for tile, row in zip(tiles, rows):
+            yield tile, row[0]
+
+    async def _call(
+        self,
+        conn: asyncpg.BuildPgConnection,
+        method: Callable[..., Awaitable[Any]],
+        query: str,
+        params: List[Any],
+    ) -> Any:
+        """Execute a query calling the SQL function (registered if needed)."""
+        await self.register(conn)
+
+        try:
+            return await method(query, *params, timeout=self.query_timeout)
+
+        # The function might have been dropped since it was registered
+        except UndefinedFunctionError:
+            self._registered.pop((conn.get_server_pid(), self.function_name), None)
+            await self.register(conn)
+            return await method(query, *params, timeout=self.query_timeout)
+
+
+class Archive(Layer):
+    """MBTiles/PMTiles Archive Reader.
+
+    Tiles are read from a local `.mbtiles` or `.pmtiles` file (memory-mapped), the
+    database is not used.
+
+    Attributes:
+        id (str): Layer's name.
+        bounds (list): Layer's bounds (left, bottom, right, top).
+        minzoom (int): Layer's min zoom level.
+        maxzoom (int): Layer's max zoom level.
+        default_tms (str): TileMatrixSet of the archive's tiles.
+        tileurl (str, optional): Layer's tiles url.
+        type (str): Layer's type.
+        path (str): Archive path.
+
+    """
+
+    type: str = "Archive"
+    path: str
+
+    _reader: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def from_file(cls, id: str, path: str, **kwargs: Any):
+        """Create Archive layer with the bounds, zooms and TMS from the archive metadata."""
+        archive = cls(id=id, path=path, default_tms="WebMercatorQuad")
+        reader = archive._open()
+
+        if isinstance(reader, PMTilesReader):
+            header = reader.header
+            compression = header["tile_compression"]
+            if compression != pmtiles.UNKNOWN and compression not in (
+                pmtiles.CONTENT_ENCODINGS
+            ):
+                reader.close()
+                raise ValueError(
+                    f"Archive '{path}' has an unsupported tile compression ({compression})."
+                )
+
+            metadata = reader.metadata
+            info = {
+                "bounds": [
+                    header["min_lon"],
+                    header["min_lat"],
+                    header["max_lon"],
+                    header["max_lat"],
+                ],
+                "minzoom": header["min_zoom"],
+                "maxzoom": header["max_zoom"],
+            }
+        else:
+            metadata = reader.metadata
+            info = {
+                k: metadata[k]
+                for k in ["bounds", "minzoom", "maxzoom"]
+                if k in metadata
+            }
+            if "bounds" in info:
+                info["bounds"] = info["bounds"].split(",")
+
+        if metadata.get("description"):
+            info["description"] = metadata["description"]
+
+        if metadata.get("tilematrixset"):
+            info["default_tms"] = metadata["tilematrixset"]
+
+        archive = cls(id=id, path=path, **{**info, **kwargs})
+        reader.close()
+
+        return archive
+
+    def _open(self):
+        if self.path.endswith(".pmtiles"):
+            return PMTilesReader(self.path)
+
+        tms = morecantile.tms.get(self.default_tms)
+        return MBTiles(self.path, tms, readonly=True)
+
+    def close(self) -> None:
+        """Close the archive."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def get_tile_data(
+        self, tile: morecantile.Tile, tms: morecantile.TileMatrixSet
+    ) -> Tuple[bytes, Optional[str]]:
+        """Get the tile data as stored in the archive and its content encoding (`gzip`, `br`, `zstd` or None)."""
+        if tms.identifier != self.default_tms:
+            raise InvalidTileMatrixSet(
+                f"Archive '{self.id}' is only available in '{self.default_tms}' TileMatrixSet."
             )
 
-            # execute the query
-            content = await conn.fetchval(q, *p)
+        if self._reader is None:
+            self._reader = self._open()
 
-            # rollback
-            await transaction.rollback()
+        if isinstance(self._reader, PMTilesReader):
+            data = self._reader.get_tile(tile.z, tile.x, tile.y)
+            compression = self._reader.header["tile_compression"]
+            if data and compression != pmtiles.UNKNOWN:
+                return bytes(data), pmtiles.CONTENT_ENCODINGS[compression]
+        else:
+            data = self._reader.read_tile(tile)
 
-        return content
+        if not data:
+            return b"", None
+
+        # MBTiles (and PMTiles with an unknown compression) tiles are usually gzip compressed
+        if data[:2] == b"\x1f\x8b":
+            return bytes(data), "gzip"
+
+        return bytes(data), None
+
+    async def read_tile(
+        self, tile: morecantile.Tile, tms: morecantile.TileMatrixSet
+    ) -> Tuple[bytes, Optional[str]]:
+        """Get the tile data as stored in the archive and its content encoding, without blocking the event loop.
+
+        MBTiles reads (SQLite queries) run in a thread, PMTiles reads are served from
+        memory-mapped pages in the event loop.
+
+        """
+        if self._reader is None:
+            self._reader = self._open()
+
+        if isinstance(self._reader, PMTilesReader):
+            return self.get_tile_data(tile, tms)
+
+        return await run_in_threadpool(self.get_tile_data, tile, tms)
+
+    async def get_tile(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        **kwargs: Any,
+    ) -> bytes:
+        """Get Tile Data."""
+        data, encoding = await self.read_tile(tile, tms)
+        if not encoding:
+            return data
+
+        # cramjam releases the GIL
+        if len(data) >= ARCHIVE_OFFLOAD_THRESHOLD:
+            return await run_in_threadpool(decompress, data, encoding)
+
+        return decompress(data, encoding)
 
 
 @dataclass
@@ -331,3 +1179,26 @@ class FunctionRegistry:
     def values(cls):
         """get all values."""
         return cls.funcs.values()
+
+
+@dataclass
+class ArchiveRegistry:
+    """archive registry"""
+
+    archives: ClassVar[Dict[str, Archive]] = {}
+
+    @classmethod
+    def get(cls, key: str):
+        """lookup archive by name"""
+        return cls.archives.get(key)
+
+    @classmethod
+    def register(cls, *args: Archive):
+        """register archive(s)"""
+        for archive in args:
+            cls.archives[archive.id] = archive
+
+    @classmethod
+    def values(cls):
+        """get all values."""
+        return cls.archives.values()
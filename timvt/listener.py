@@ -0,0 +1,111 @@
+"""timvt.listener: LISTEN to notifications on a dedicated, reconnecting connection."""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from buildpg import asyncpg
+
+logger = logging.getLogger(__name__)
+
+Connect = Callable[[], Awaitable[asyncpg.BuildPgConnection]]
+
+
+class Listener:
+    """Listen to a channel on a dedicated connection (not a pool's connection).
+
+    When the connection is lost, the listener reconnects every `retry_interval` seconds
+    until it succeeds and then calls `on_reconnect` with the new connection: the
+    notifications sent while disconnected are lost, `on_reconnect` should catch up.
+
+    Attributes:
+        connect (callable): Open a new connection.
+        channel (str): Notification channel.
+        callback (callable): asyncpg notification callback (`connection, pid, channel, payload`).
+        on_reconnect (callable, optional): Awaited with the connection after a reconnection.
+        retry_interval (float): Time (in seconds) between the reconnection attempts.
+        stats (dict): Number of connection losses and reconnections.
+
+    """
+
+    def __init__(
+        self,
+        connect: Connect,
+        channel: str,
+        callback: Callable[[Any, int, str, str], None],
+        on_reconnect: Optional[
+            Callable[[asyncpg.BuildPgConnection], Awaitable[None]]
+        ] = None,
+        retry_interval: float = 5.0,
+    ):
+        """Init listener."""
+        self.connect = connect
+        self.channel = channel
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self.retry_interval = retry_interval
+
+        self.stats = {"disconnections": 0, "reconnections": 0}
+
+        self._conn: Optional[asyncpg.BuildPgConnection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    async def _subscribe(self) -> asyncpg.BuildPgConnection:
+        conn = await self.connect()
+        try:
+            await conn.add_listener(self.channel, self.callback)
+        except BaseException:
+            await conn.close()
+            raise
+
+        conn.add_termination_listener(self._on_termination)
+        self._conn = conn
+        return conn
+
+    def _on_termination(self, conn: Any) -> None:
+        if self._stopped or conn is not self._conn:
+            return
+
+        self._conn = None
+        self.stats["disconnections"] += 1
+        logger.warning(f"Lost the connection listening to '{self.channel}'.")
+        self._task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._stopped:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                conn = await self._subscribe()
+            except Exception as e:  # noqa
+                logger.warning(f"Could not listen to '{self.channel}': {e}")
+                continue
+
+            self.stats["reconnections"] += 1
+            if self.on_reconnect is not None:
+                try:
+                    await self.on_reconnect(conn)
+                except Exception as e:  # noqa
+                    logger.error(f"Could not catch up on '{self.channel}': {e}")
+            return
+
+    async def start(self) -> None:
+        """Connect and listen to the channel."""
+        self._stopped = False
+        await self._subscribe()
+
+    async def stop(self) -> None:
+        """Stop listening and close the connection."""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            conn.remove_termination_listener(self._on_termination)
+            await conn.close()
@@ -2,18 +2,38 @@
 
 import pathlib
 
+from morecantile import tms as morecantile_tms
+
 from timvt import __version__ as timvt_version
+from timvt.admission import register_admission_controller
+from timvt.cache import create_tile_cache
+from timvt.changes import register_change_tracker
+from timvt.compression import create_compressor
 from timvt.db import close_db_connection, connect_to_db, register_table_catalog
 from timvt.errors import DEFAULT_STATUS_CODES, add_exception_handlers
+from timvt.etag import register_table_versions
 from timvt.factory import TMSFactory, VectorTilerFactory
-from timvt.layer import Function, FunctionRegistry
-from timvt.middleware import CacheControlMiddleware
-from timvt.settings import ApiSettings, PostgresSettings, TileSettings
+from timvt.layer import Archive, ArchiveRegistry, Function, FunctionRegistry
+from timvt.metrics import MetricsMiddleware, register_metrics
+from timvt.middleware import CacheControlMiddleware, ETagMiddleware, TimingMiddleware
+from timvt.occupancy import register_tile_occupancy
+from timvt.resources.enums import MimeTypes
+from timvt.settings import (
+    AdmissionSettings,
+    ApiSettings,
+    CacheSettings,
+    CatalogSettings,
+    ChangesSettings,
+    CompressionSettings,
+    MetricsSettings,
+    PostgresSettings,
+    TileSettings,
+)
 
 from fastapi import FastAPI, Request
 
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, Response
 from starlette.templating import Jinja2Templates
 from starlette_cramjam.middleware import CompressionMiddleware
 
@@ -27,6 +47,12 @@ templates = Jinja2Templates(directory=str(resources_files(__package__) / "templa
 settings = ApiSettings()
 postgres_settings = PostgresSettings()
 tile_settings = TileSettings()
+cache_settings = CacheSettings()
+catalog_settings = CatalogSettings()
+changes_settings = ChangesSettings()
+compression_settings = CompressionSettings()
+admission_settings = AdmissionSettings()
+metrics_settings = MetricsSettings()
 
 # Create TiVTiler Application.
 app = FastAPI(
@@ -42,15 +68,29 @@ if settings.cors_origins:
         CORSMiddleware,
         allow_origins=settings.cors_origins,
         allow_credentials=True,
-        allow_methods=["GET"],
+        allow_methods=["GET", "POST"],
         allow_headers=["*"],
     )
 
 
 app.add_middleware(CacheControlMiddleware, cachecontrol=settings.cachecontrol)
-app.add_middleware(CompressionMiddleware, minimum_size=0)
+# ETags of the metadata responses (tiles have their own ETags)
+app.add_middleware(ETagMiddleware)
+# Tiles are compressed by the tile endpoints (see `VectorTilerFactory.tile_response`)
+# and empty (204/304) responses must not have a body
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=1,
+    exclude_mediatype={MimeTypes.pbf.value},
+)
+app.add_middleware(TimingMiddleware)
+app.add_middleware(MetricsMiddleware)
 add_exception_handlers(app, DEFAULT_STATUS_CODES)
 
+# Requests with a `X-Debug-Token: {TIMVT_DEBUG_TOKEN}` header get the debug mode
+# (tile rendering phases in `Server-Timing` headers, tile query plans)
+app.state.debug_token = settings.debug_token
+
 # We add the function registry to the application state
 app.state.timvt_function_catalog = FunctionRegistry()
 if settings.functions_directory:
@@ -63,6 +103,27 @@ if settings.functions_directory:
             Function.from_file(id=name, infile=str(func))
         )
 
+# We add the archive (MBTiles/PMTiles) registry to the application state
+app.state.timvt_archive_catalog = ArchiveRegistry()
+if settings.archives_directory:
+    for archive in sorted(pathlib.Path(settings.archives_directory).iterdir()):
+        if archive.suffix in [".mbtiles", ".pmtiles"]:
+            app.state.timvt_archive_catalog.register(
+                Archive.from_file(id=archive.stem, path=str(archive))
+            )
+
+# Optional Tile Cache (e.g `TIMVT_CACHE_BACKEND=memory`)
+app.state.tile_cache = create_tile_cache(cache_settings)
+
+# Large tiles are compressed in a thread pool (`TIMVT_COMPRESSION_EXECUTOR`)
+app.state.compressor = create_compressor(compression_settings)
+
+# Optional concurrency limits of the tile queries (`TIMVT_ADMISSION_ENABLED=TRUE`)
+register_admission_controller(app, settings=admission_settings)
+
+# Optional Prometheus metrics of the tile pipeline (`TIMVT_METRICS_ENABLED=TRUE`)
+register_metrics(app, settings=metrics_settings)
+
 
 # Register Start/Stop application event handler to setup/stop the database connection
 @app.on_event("startup")
@@ -71,15 +132,33 @@ async def startup_event():
     await connect_to_db(app, settings=postgres_settings)
     await register_table_catalog(
         app,
+        settings=catalog_settings,
         schemas=postgres_settings.db_schemas,
         tables=postgres_settings.db_tables,
     )
+    await register_table_versions(app, interval=settings.table_versions_interval)
+    await register_change_tracker(app, settings=changes_settings)
+    # Occupancy indexes follow the changes tracked or the table versions
+    await register_tile_occupancy(
+        app, tms=morecantile_tms.get(tile_settings.default_tms)
+    )
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Application shutdown: de-register the database connection."""
+    if app.state.change_tracker is not None:
+        await app.state.change_tracker.stop()
+    if app.state.table_versions is not None:
+        await app.state.table_versions.stop()
+    if app.state.tile_occupancy is not None:
+        await app.state.tile_occupancy.close()
     await close_db_connection(app)
+    for archive in app.state.timvt_archive_catalog.values():
+        archive.close()
+    if app.state.tile_cache is not None:
+        await app.state.tile_cache.close()
+    app.state.compressor.close()
 
 
 # Register endpoints.
@@ -87,6 +166,7 @@ mvt_tiler = VectorTilerFactory(
     default_tms=tile_settings.default_tms,
     with_tables_metadata=True,
     with_functions_metadata=True,
+    with_archives_metadata=True,
     with_viewer=True,
 )
 app.include_router(mvt_tiler.router)
@@ -110,3 +190,44 @@ async def index(request: Request):
 def ping():
     """Health check."""
     return {"ping": "pong!"}
+
+
+if changes_settings.enabled:
+
+    @app.get(
+        "/changes",
+        description="Change tracking statistics",
+        tags=["Health Check"],
+    )
+    def changes(request: Request):
+        """Number of change notifications and invalidated tiles."""
+        return request.app.state.change_tracker.stats
+
+
+if admission_settings.enabled:
+
+    @app.get(
+        "/admission",
+        description="Admission control statistics",
+        tags=["Health Check"],
+    )
+    def admission(request: Request):
+        """Active, waiting and rejected tile queries per layer and zoom band."""
+        return request.app.state.admission.stats
+
+
+if metrics_settings.enabled:
+
+    @app.get(
+        "/metrics",
+        description="Prometheus metrics",
+        tags=["Health Check"],
+        response_class=Response,
+    )
+    def metrics(request: Request):
+        """Tile pipeline, database pools, compression and admission control metrics."""
+        metrics = request.app.state.metrics
+        return Response(
+            metrics.latest(),
+            headers={"Content-Type": metrics.content_type, "Cache-Control": "no-store"},
+        )
@@ -0,0 +1,141 @@
+"""timvt.mbtiles: MBTiles archives."""
+
+import gzip
+import json
+import pathlib
+import sqlite3
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from morecantile import Tile, TileMatrixSet
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (name text, value text, UNIQUE (name));
+    CREATE TABLE IF NOT EXISTS tiles (
+        zoom_level integer,
+        tile_column integer,
+        tile_row integer,
+        tile_data blob,
+        UNIQUE (zoom_level, tile_column, tile_row)
+    );
+    -- Seeding checkpoint: {z}/{x}/{y} indices of the processed tiles (empty or not)
+    CREATE TABLE IF NOT EXISTS timvt_seeded (
+        z integer,
+        x integer,
+        y integer,
+        UNIQUE (z, x, y)
+    );
+"""
+
+# Max number of bytes memory-mapped when reading archives
+MMAP_SIZE = 1 << 40
+
+
+class MBTiles:
+    """MBTiles (SQLite) archive of gzip compressed Mapbox Vector Tiles.
+
+    Tiles are stored with the `TMS` row scheme (`tile_row = matrixHeight - 1 - y`).
+
+    """
+
+    def __init__(self, path: str, tms: TileMatrixSet, readonly: bool = False):
+        """Open (or create) an MBTiles archive.
+
+        Args:
+            path (str): archive path.
+            tms (morecantile.TileMatrixSet): Tile Matrix Set of the tiles.
+            readonly (bool): Open an existing archive in read-only mode, using memory-mapped I/O.
+
+        """
+        self.path = path
+        self.tms = tms
+        if readonly:
+            self.db = sqlite3.connect(
+                f"{pathlib.Path(path).absolute().as_uri()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            self.db.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        else:
+            # Written by one thread at a time, not necessarily the one opening it
+            # (e.g `timvt.seed.seed`'s writer thread)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        """Support using with Context Managers."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit changes and close the archive."""
+        self.close()
+
+    def _row(self, tile: Tile) -> int:
+        return self.tms.matrix(tile.z).matrixHeight - 1 - tile.y
+
+    def write_tile(self, tile: Tile, data: bytes) -> None:
+        """Add a tile to the archive and mark it as seeded.
+
+        Empty tiles are only marked as seeded.
+
+        """
+        if data:
+            self.db.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (tile.z, tile.x, self._row(tile), gzip.compress(data, mtime=0)),
+            )
+
+        self.db.execute(
+            "INSERT OR IGNORE INTO timvt_seeded VALUES (?, ?, ?)",
+            (tile.z, tile.x, tile.y),
+        )
+
+    def seeded(self) -> Set[Tuple[int, int, int]]:
+        """Return (z, x, y) indices of the tiles already seeded."""
+        return set(self.db.execute("SELECT z, x, y FROM timvt_seeded"))
+
+    def tiles(self) -> Iterator[Tile]:
+        """Iterate over the archive's tiles."""
+        for z, x, row in self.db.execute(
+            "SELECT zoom_level, tile_column, tile_row FROM tiles"
+        ):
+            yield Tile(x, self.tms.matrix(z).matrixHeight - 1 - row, z)
+
+    def read_tile(self, tile: Tile) -> Optional[bytes]:
+        """Return tile data (gzip compressed) or None."""
+        row = self.db.execute(
+            "SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (tile.z, tile.x, self._row(tile)),
+        ).fetchone()
+
+        return row[0] if row else None
+
+    @property
+    def metadata(self) -> Dict[str, str]:
+        """Return archive's metadata."""
+        return dict(self.db.execute("SELECT name, value FROM metadata"))
+
+    def set_metadata(self, metadata: Dict[str, Any]) -> None:
+        """Update archive's metadata."""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            [
+                (k, v if isinstance(v, str) else json.dumps(v))
+                for k, v in metadata.items()
+            ],
+        )
+
+    def commit(self) -> None:
+        """Commit changes."""
+        self.db.commit()
+
+    def finalize(self) -> None:
+        """Remove the seeding checkpoint and compact the archive."""
+        self.db.execute("DROP TABLE IF EXISTS timvt_seeded")
+        self.db.commit()
+        self.db.execute("VACUUM")
+
+    def close(self) -> None:
+        """Commit changes and close the archive."""
+        self.db.commit()
+        self.db.close()
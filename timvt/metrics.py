@@ -0,0 +1,393 @@
+"""timvt.metrics: Prometheus metrics and OpenTelemetry spans of the tile pipeline."""
+
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from timvt.settings import MetricsSettings
+
+from fastapi import FastAPI
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import prometheus_client
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # pragma: nocover
+    prometheus_client = None  # type: ignore
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: nocover
+    trace = None  # type: ignore
+
+DURATION_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+SIZE_BUCKETS = (
+    0,
+    1024,
+    4 * 1024,
+    16 * 1024,
+    64 * 1024,
+    256 * 1024,
+    1024 * 1024,
+    4 * 1024 * 1024,
+)
+
+
+class TimedPool:
+    """Connection pool wrapper reporting the time spent waiting for a connection (`pool_wait`) and holding it (`query`)."""
+
+    def __init__(self, pool: Any, observe: Callable[[str, float], None]):
+        """Init TimedPool.
+
+        Args:
+            pool (asyncpg.BuildPgPool): Connection pool (or `timvt.db.PoolBalancer`).
+            observe (callable): Called with the stage name and its duration (in seconds).
+
+        """
+        self.pool = pool
+        self.observe = observe
+
+    @asynccontextmanager
+    async def acquire(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        """Acquire a connection from the pool."""
+        start = time.perf_counter()
+        async with self.pool.acquire(*args, **kwargs) as conn:
+            acquired = time.perf_counter()
+            self.observe("pool_wait", acquired - start)
+            try:
+                yield conn
+            finally:
+                self.observe("query", time.perf_counter() - acquired)
+
+
+class ApplicationCollector:
+    """Prometheus collector of the application's state, read at scrape time.
+
+    Reports the database pools saturation, the compression, admission control, change
+    tracking and table catalog statistics.
+
+    """
+
+    def __init__(self, app: FastAPI):
+        """Init collector."""
+        self.app = app
+
+    def collect(self) -> Iterator[Any]:
+        """Collect metrics."""
+        state = self.app.state
+
+        connections = GaugeMetricFamily(
+            "timvt_db_pool_connections",
+            "Database pool connections.",
+            labels=["pool", "state"],
+        )
+        pool = getattr(state, "pool", None)
+        if pool is not None:
+            connections.add_metric(["primary", "open"], pool.get_size())
+            connections.add_metric(["primary", "idle"], pool.get_idle_size())
+            connections.add_metric(["primary", "max"], pool.get_max_size())
+
+        tile_pool = getattr(state, "tile_pool", None)
+        replicas = getattr(tile_pool, "pools", [])
+        for name, replica in zip(getattr(tile_pool, "names", []), replicas):
+            connections.add_metric([name, "open"], replica.get_size())
+            connections.add_metric([name, "idle"], replica.get_idle_size())
+            connections.add_metric([name, "max"], replica.get_max_size())
+        yield connections
+
+        if replicas:
+            healthy = GaugeMetricFamily(
+                "timvt_db_replica_healthy",
+                "Read replica health (1 if used for the tile queries).",
+                labels=["pool"],
+            )
+            outstanding = GaugeMetricFamily(
+                "timvt_db_replica_outstanding_connections",
+                "Read replica outstanding connections.",
+                labels=["pool"],
+            )
+            for stats in tile_pool.stats:
+                healthy.add_metric([stats["name"]], int(stats["healthy"]))
+                outstanding.add_metric([stats["name"]], stats["outstanding"])
+            yield healthy
+            yield outstanding
+
+        compressor = getattr(state, "compressor", None)
+        if compressor is not None:
+            calls = CounterMetricFamily(
+                "timvt_compression_calls",
+                "Compression calls, in the event loop (`inline`) or in the executor (`offloaded`).",
+                labels=["mode"],
+            )
+            for mode, count in compressor.stats.items():
+                calls.add_metric([mode], count)
+            yield calls
+
+        admission = getattr(state, "admission", None)
+        if admission is not None:
+            queries = GaugeMetricFamily(
+                "timvt_admission_queries",
+                "Active and waiting tile queries.",
+                labels=["layer", "band", "state"],
+            )
+            decisions = CounterMetricFamily(
+                "timvt_admission_decisions",
+                "Admitted and rejected tile queries.",
+                labels=["layer", "band", "decision"],
+            )
+            wait = CounterMetricFamily(
+                "timvt_admission_wait_seconds",
+                "Time spent by the tile queries waiting for admission.",
+                labels=["layer", "band"],
+            )
+            for layer, bands in admission.stats.items():
+                for band, stats in bands.items():
+                    queries.add_metric([layer, band, "active"], stats["active"])
+                    queries.add_metric([layer, band, "waiting"], stats["waiting"])
+                    decisions.add_metric([layer, band, "admitted"], stats["admitted"])
+                    decisions.add_metric([layer, band, "rejected"], stats["rejected"])
+                    wait.add_metric([layer, band], stats["wait_time_total"])
+            yield queries
+            yield decisions
+            yield wait
+
+        tracker = getattr(state, "change_tracker", None)
+        if tracker is not None:
+            changes = CounterMetricFamily(
+                "timvt_changes",
+                "Change tracking notifications, invalidations, tiles and errors.",
+                labels=["kind"],
+            )
+            for kind, count in tracker.stats.items():
+                changes.add_metric([kind], count)
+            yield changes
+
+        yield from self._catalog(getattr(state, "table_catalog", None))
+
+    def _catalog(self, catalog: Any) -> Iterator[Any]:
+        """Collect table catalog metrics."""
+        if catalog is not None:
+            tables = GaugeMetricFamily(
+                "timvt_catalog_tables", "Tables loaded in the table catalog."
+            )
+            tables.add_metric([], len(catalog))
+            yield tables
+
+        stats = getattr(catalog, "stats", None)
+        if stats is not None:
+            events = CounterMetricFamily(
+                "timvt_catalog_events",
+                "Table catalog refreshes, loaded tables, DDL notifications and errors.",
+                labels=["kind"],
+            )
+            for kind, count in stats.items():
+                events.add_metric([kind], count)
+            yield events
+
+
+class TileMetrics:
+    """Prometheus metrics (and optional OpenTelemetry spans) of the tile pipeline.
+
+    Attributes:
+        registry (prometheus_client.CollectorRegistry): Metrics registry.
+        tracer (opentelemetry.trace.Tracer, optional): Tracer of the tile spans.
+
+    """
+
+    def __init__(
+        self,
+        app: Optional[FastAPI] = None,
+        registry: Optional[Any] = None,
+        tracing: bool = False,
+    ):
+        """Init metrics.
+
+        Args:
+            app (FastAPI, optional): Application whose state (pools, admission control...) is reported.
+            registry (prometheus_client.CollectorRegistry, optional): Metrics registry (a new one by default).
+            tracing (bool): Create OpenTelemetry spans (requires `opentelemetry-api`).
+
+        """
+        assert (
+            prometheus_client is not None
+        ), "'prometheus-client' must be installed to use TileMetrics"
+
+        self.registry = registry or prometheus_client.CollectorRegistry()
+        if app is not None:
+            self.registry.register(ApplicationCollector(app))
+
+        self.stage_duration = prometheus_client.Histogram(
+            "timvt_tile_stage_duration_seconds",
+            "Duration of the tile rendering stages (admission_wait, pool_wait, query, render).",
+            ["layer", "tms", "zoom", "stage"],
+            buckets=DURATION_BUCKETS,
+            registry=self.registry,
+        )
+        self.tile_size = prometheus_client.Histogram(
+            "timvt_tile_size_bytes",
+            "Size of the rendered tiles (before compression).",
+            ["layer", "tms", "zoom"],
+            buckets=SIZE_BUCKETS,
+            registry=self.registry,
+        )
+        self.tiles = prometheus_client.Counter(
+            "timvt_tiles",
+            "Tiles by source (skipped, archive, cache, rendered) and emptiness.",
+            ["layer", "tms", "zoom", "source", "empty"],
+            registry=self.registry,
+        )
+        self.request_duration = prometheus_client.Histogram(
+            "timvt_http_request_duration_seconds",
+            "Duration of the HTTP requests, until the response's headers are sent.",
+            ["handler", "method", "status"],
+            buckets=DURATION_BUCKETS,
+            registry=self.registry,
+        )
+        self.response_write = prometheus_client.Histogram(
+            "timvt_http_response_write_seconds",
+            "Duration of the HTTP responses' body write.",
+            ["handler"],
+            buckets=DURATION_BUCKETS,
+            registry=self.registry,
+        )
+        self.catalog_refresh = prometheus_client.Histogram(
+            "timvt_catalog_refresh_duration_seconds",
+            "Duration of the table catalog refreshes.",
+            buckets=DURATION_BUCKETS,
+            registry=self.registry,
+        )
+
+        self.tracer = None
+        if tracing:
+            assert (
+                trace is not None
+            ), "'opentelemetry-api' must be installed to create spans"
+            self.tracer = trace.get_tracer("timvt")
+
+    def observe_stage(
+        self, stage: str, duration: float, layer: str, tms: str, zoom: int
+    ) -> None:
+        """Record the duration (in seconds) of a tile rendering stage."""
+        self.stage_duration.labels(layer, tms, str(zoom), stage).observe(duration)
+
+    def observe_tile(
+        self,
+        layer: str,
+        tms: str,
+        zoom: int,
+        source: str,
+        empty: bool,
+        size: Optional[int] = None,
+    ) -> None:
+        """Record a tile, from `source` (skipped, archive, cache or rendered), and its size."""
+        self.tiles.labels(layer, tms, str(zoom), source, str(empty).lower()).inc()
+        if size is not None:
+            self.tile_size.labels(layer, tms, str(zoom)).observe(size)
+
+    def observe_request(
+        self, handler: str, method: str, status: int, duration: float
+    ) -> None:
+        """Record the duration (in seconds) of an HTTP request."""
+        self.request_duration.labels(handler, method, str(status)).observe(duration)
+
+    def observe_response_write(self, handler: str, duration: float) -> None:
+        """Record the duration (in seconds) of an HTTP response's body write."""
+        self.response_write.labels(handler).observe(duration)
+
+    def observe_catalog_refresh(self, duration: float) -> None:
+        """Record the duration (in seconds) of a table catalog refresh."""
+        self.catalog_refresh.observe(duration)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[None]:
+        """Create an OpenTelemetry span (if tracing is enabled)."""
+        if self.tracer is None:
+            yield
+            return
+
+        with self.tracer.start_as_current_span(name, attributes=attributes):
+            yield
+
+    def latest(self) -> bytes:
+        """Return the metrics in Prometheus text format."""
+        return prometheus_client.generate_latest(self.registry)
+
+    @property
+    def content_type(self) -> str:
+        """Prometheus text format media type."""
+        return prometheus_client.CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """MiddleWare recording the HTTP requests and response writes durations in the application's metrics (`app.state.metrics`).
+
+    Requests are labelled with the name of their endpoint (e.g `tile`).
+
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Init Middleware."""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Record durations."""
+        app = scope.get("app")
+        metrics = getattr(app.state, "metrics", None) if app is not None else None
+        if scope["type"] != "http" or metrics is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        started = start
+
+        def _handler() -> str:
+            endpoint = scope.get("endpoint")
+            return getattr(endpoint, "__name__", "unknown")
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal started
+
+            if message["type"] == "http.response.start":
+                started = time.perf_counter()
+                metrics.observe_request(
+                    _handler(), scope["method"], message["status"], started - start
+                )
+
+            await send(message)
+
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                metrics.observe_response_write(
+                    _handler(), time.perf_counter() - started
+                )
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def register_metrics(app: FastAPI, settings: Optional[MetricsSettings] = None) -> None:
+    """Add the tile pipeline metrics (`app.state.metrics`) if enabled in the settings."""
+    if not settings:
+        settings = MetricsSettings()
+
+    if not settings.enabled:
+        app.state.metrics = None
+        return
+
+    app.state.metrics = TileMetrics(app, tracing=settings.tracing)
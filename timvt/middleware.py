@@ -1,21 +1,38 @@
-"""timvt middlewares."""
+"""timvt middlewares.
+
+Middlewares are pure ASGI middlewares: they only modify the response's start
+message (and buffer the response body when needed), without the task and streams
+overhead of Starlette's `BaseHTTPMiddleware`.
+
+"""
 
 import re
-from typing import Optional, Set
+import time
+from typing import Iterable, List, Optional, Pattern
+
+from timvt.etag import content_etag, if_none_match
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.types import ASGIApp
 
+def compile_paths(paths: Optional[Iterable[str]]) -> Optional[Pattern]:
+    """Compile path regular expressions in one pattern (None if there is no path)."""
+    paths = list(paths or [])
+    if not paths:
+        return None
 
-class CacheControlMiddleware(BaseHTTPMiddleware):
+    return re.compile("|".join(f"(?:{path})" for path in paths))
+
+
+class CacheControlMiddleware:
     """MiddleWare to add CacheControl in response headers."""
 
     def __init__(
         self,
         app: ASGIApp,
         cachecontrol: Optional[str] = None,
-        exclude_path: Optional[Set[str]] = None,
+        exclude_path: Optional[Iterable[str]] = None,
     ) -> None:
         """Init Middleware.
 
@@ -25,19 +42,177 @@ class CacheControlMiddleware(BaseHTTPMiddleware):
             exclude_path (set): Set of regex expression to use to filter the path.
 
         """
-        super().__init__(app)
+        self.app = app
         self.cachecontrol = cachecontrol
-        self.exclude_path = exclude_path or set()
+        self.exclude_path = compile_paths(exclude_path)
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Add cache-control."""
-        response = await call_next(request)
-        if self.cachecontrol and not response.headers.get("Cache-Control"):
-            for path in self.exclude_path:
-                if re.match(path, request.url.path):
-                    return response
+        if (
+            scope["type"] != "http"
+            or not self.cachecontrol
+            or scope["method"] not in ["HEAD", "GET"]
+            or (self.exclude_path and self.exclude_path.match(scope["path"]))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 500:
+                headers = MutableHeaders(scope=message)
+                if "Cache-Control" not in headers:
+                    headers["Cache-Control"] = self.cachecontrol  # type: ignore
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class TimingMiddleware:
+    """MiddleWare to add the request processing time in a `Server-Timing` response header.
+
+    The duration (in milliseconds) is measured until the response's headers are sent.
+    Entries added by the application to the request's state (`server_timing` list,
+    e.g the tile rendering phases in debug mode) are sent in the header too.
+
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        metric: str = "total",
+        exclude_path: Optional[Iterable[str]] = None,
+    ) -> None:
+        """Init Middleware.
+
+        Args:
+            app (ASGIApp): starlette/FastAPI application.
+            metric (str): Server-Timing metric name.
+            exclude_path (set): Set of regex expression to use to filter the path.
+
+        """
+        self.app = app
+        self.metric = metric
+        self.exclude_path = compile_paths(exclude_path)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Add Server-Timing."""
+        if scope["type"] != "http" or (
+            self.exclude_path and self.exclude_path.match(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                duration = (time.perf_counter() - start) * 1000
+                timings = scope.get("state", {}).get("server_timing", [])
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    ", ".join([*timings, f"{self.metric};dur={duration:.1f}"]),
+                )
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class ETagMiddleware:
+    """MiddleWare to add an ETag to `GET` responses without one and answer `If-None-Match` requests.
+
+    The ETag is a (weak) hash of the response body, so the body is buffered: responses
+    larger than `max_size` bytes and responses already having an ETag (e.g tiles) are
+    streamed without ETag.
+
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_size: int = 1024 * 1024,
+        exclude_path: Optional[Iterable[str]] = None,
+    ) -> None:
+        """Init Middleware.
+
+        Args:
+            app (ASGIApp): starlette/FastAPI application.
+            max_size (int): Maximum size (in bytes) of the buffered responses.
+            exclude_path (set): Set of regex expression to use to filter the path.
+
+        """
+        self.app = app
+        self.max_size = max_size
+        self.exclude_path = compile_paths(exclude_path)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Add ETag."""
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or (self.exclude_path and self.exclude_path.match(scope["path"]))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match_header = Headers(scope=scope).get("If-None-Match")
+
+        start: Optional[Message] = None
+        body: List[bytes] = []
+        size = 0
+        buffering = False
+
+        async def flush(more_body: bool) -> None:
+            nonlocal buffering
+            buffering = False
+            await send(start)  # type: ignore
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": b"".join(body),
+                    "more_body": more_body,
+                }
+            )
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, size, buffering
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if message["status"] == 200 and "ETag" not in headers:
+                    start, buffering = message, True
+                    return
+
+            elif message["type"] == "http.response.body" and buffering:
+                chunk = message.get("body", b"")
+                body.append(chunk)
+                size += len(chunk)
+
+                if message.get("more_body", False):
+                    # Too large, send the response without ETag
+                    if size > self.max_size:
+                        await flush(more_body=True)
+                    return
+
+                content = b"".join(body)
+                etag = "W/" + content_etag(content)
+                headers = MutableHeaders(scope=start)  # type: ignore
+                headers["ETag"] = etag
+                if if_none_match(if_none_match_header, etag):
+                    for name in ["Content-Length", "Content-Type"]:
+                        if name in headers:
+                            del headers[name]
+
+                    start["status"] = 304  # type: ignore
+                    body.clear()
+                    await flush(more_body=False)
+                    return
+
+                await flush(more_body=False)
+                return
 
-            if request.method in ["HEAD", "GET"] and response.status_code < 500:
-                response.headers["Cache-Control"] = self.cachecontrol
+            await send(message)
 
-        return response
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,44 @@
+"""Batch requests models."""
+
+from typing import List
+
+from morecantile import Tile
+from pydantic import BaseModel, constr, validator
+
+from timvt.settings import TileSettings
+
+tile_settings = TileSettings()
+
+TileIndex = constr(regex=r"^\d+/\d+/\d+$")
+
+
+class TileBatch(BaseModel):
+    """List of tiles to fetch at once.
+
+    Tiles are defined as `{z}/{x}/{y}` strings (e.g `{"tiles": ["1/0/0", "1/1/0"]}`).
+
+    """
+
+    tiles: List[TileIndex]  # type: ignore
+
+    @validator("tiles")
+    def check_size(cls, v):
+        """Check the number of tiles."""
+        if not v:
+            raise ValueError("At least one tile is required.")
+
+        if len(v) > tile_settings.max_tiles_per_batch:
+            raise ValueError(
+                f"Maximum number of tiles per batch is {tile_settings.max_tiles_per_batch}."
+            )
+
+        return v
+
+    def to_tiles(self) -> List[Tile]:
+        """Return list of morecantile Tiles."""
+        tiles = []
+        for t in self.tiles:
+            z, x, y = map(int, str(t).split("/"))
+            tiles.append(Tile(x, y, z))
+
+        return tiles
@@ -0,0 +1,359 @@
+"""timvt.occupancy: in-memory index of the non-empty tiles of a Table layer."""
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import morecantile
+from buildpg import Var as pg_variable
+from buildpg import asyncpg, funcs, render
+from morecantile.utils import check_quadkey_support
+
+from timvt.dbmodel import Table
+from timvt.settings import TableConfig, TableSettings
+
+from fastapi import FastAPI
+
+logger = logging.getLogger(__name__)
+
+OCCUPANCY_SQL = """
+    WITH
+    -- TMS's bounds in table geometry's CRS
+    bounds AS (
+        SELECT
+            CASE WHEN coalesce(:tms_srid, 0) != 0 THEN
+                ST_Transform(
+                    ST_Segmentize(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, :tms_srid), :seg_size),
+                    :geometry_srid
+                )
+            ELSE
+                ST_Transform(
+                    ST_Segmentize(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 0), :seg_size),
+                    :tms_proj,
+                    :geometry_srid
+                )
+            END AS geom
+    ),
+    -- Envelopes of each geometry parts, in TMS's CRS
+    boxes AS (
+        SELECT
+            CASE WHEN :tms_srid IS NOT NULL THEN
+                ST_Transform(ST_ClipByBox2D(part, bounds.geom::box2d), :tms_srid)
+            ELSE
+                ST_Transform(ST_ClipByBox2D(part, bounds.geom::box2d), :tms_proj)
+            END AS geom
+        FROM (
+            SELECT ST_Envelope((ST_Dump(t.:geometry_column::geometry)).geom) AS part
+            FROM :tablename t, bounds
+            WHERE t.:geometry_column::geometry && bounds.geom
+        ) AS parts, bounds
+    )
+    SELECT DISTINCT x, y
+    FROM
+        boxes,
+        generate_series(
+            greatest(floor((ST_XMin(geom) - :xmin) / :tile_width)::int - :padding, 0),
+            least(floor((ST_XMax(geom) - :xmin) / :tile_width)::int + :padding, :matrix_width - 1)
+        ) AS x,
+        generate_series(
+            greatest(floor((:ymax - ST_YMax(geom)) / :tile_height)::int - :padding, 0),
+            least(floor((:ymax - ST_YMin(geom)) / :tile_height)::int + :padding, :matrix_height - 1)
+        ) AS y
+    WHERE NOT ST_IsEmpty(geom)
+"""
+
+
+class TileOccupancy:
+    """Set of the tiles which (may) contain features, for each zoom level.
+
+    The index is built for one geometry column and one quadtree TileMatrixSet, from the
+    envelopes of the geometries at a given zoom level, and is propagated to the lower
+    zoom levels. Tiles at higher zoom levels are checked against their parent.
+
+    Tiles reported as empty are guaranteed to be empty (at the time the index was built),
+    the opposite is not true.
+
+    """
+
+    def __init__(
+        self,
+        tms: morecantile.TileMatrixSet,
+        zoom: int,
+        tiles: Set[Tuple[int, int]],
+        geometry_column: str,
+    ):
+        """Init index from the non-empty tiles at `zoom` level.
+
+        Args:
+            tms (morecantile.TileMatrixSet): Tile Matrix Set (must be a quadtree).
+            zoom (int): zoom level of `tiles`.
+            tiles (set): (x, y) indices of the non-empty tiles.
+            geometry_column (str): Table's geometry column used to create the index.
+
+        """
+        if not check_quadkey_support(tms.tileMatrix):
+            raise ValueError(
+                f"Occupancy index needs a quadtree TileMatrixSet, got '{tms.identifier}'."
+            )
+
+        self.tms = tms
+        self.zoom = zoom
+        self.geometry_column = geometry_column
+
+        self.levels: List[Set[Tuple[int, int]]] = [set(tiles)]
+        for _ in range(zoom):
+            self.levels.insert(0, {(x >> 1, y >> 1) for x, y in self.levels[0]})
+
+    def __len__(self) -> int:
+        """Number of non-empty tiles at the index zoom level."""
+        return len(self.levels[-1])
+
+    def is_empty(
+        self,
+        tile: morecantile.Tile,
+        tms: morecantile.TileMatrixSet,
+        geometry_column: Optional[str] = None,
+    ) -> bool:
+        """Check if a tile is known to be empty.
+
+        Args:
+            tile (morecantile.Tile): Tile object with X,Y,Z indices.
+            tms (morecantile.TileMatrixSet): Tile Matrix Set of the tile.
+            geometry_column (str, optional): Geometry column of the tile request.
+
+        Returns:
+            bool: True if the tile has no features.
+
+        """
+        if tms.identifier != self.tms.identifier:
+            return False
+
+        if geometry_column is not None and geometry_column != self.geometry_column:
+            return False
+
+        if tile.z <= self.zoom:
+            return (tile.x, tile.y) not in self.levels[tile.z]
+
+        shift = tile.z - self.zoom
+        return (tile.x >> shift, tile.y >> shift) not in self.levels[self.zoom]
+
+    def add(self, bboxes: Sequence[Sequence[float]], max_tiles: int = 100000) -> bool:
+        """Mark the tiles intersecting bounding boxes (e.g of new features) as non-empty.
+
+        Args:
+            bboxes (list): Bounding boxes (west, south, east, north) in WGS84.
+            max_tiles (int): Maximum number of tiles to add, at the index zoom level.
+
+        Returns:
+            bool: False if the bounding boxes cover more than `max_tiles` tiles (the
+                index was not updated and can't be used anymore).
+
+        """
+        bbox: morecantile.BoundingBox = self.tms.bbox  # type: ignore
+        matrix = self.tms.matrix(self.zoom)
+
+        tiles: Set[Tuple[int, int]] = set()
+        for west, south, east, north in bboxes:
+            west, east = max(west, bbox.left), min(east, bbox.right)
+            south, north = max(south, bbox.bottom), min(north, bbox.top)
+            if west > east or south > north:
+                continue
+
+            # Neighbouring tiles, as for reprojected envelopes (see `create`)
+            ul = self.tms.tile(west, north, self.zoom)
+            lr = self.tms.tile(east, south, self.zoom)
+            minx, maxx = max(ul.x - 1, 0), min(lr.x + 1, matrix.matrixWidth - 1)
+            miny, maxy = max(ul.y - 1, 0), min(lr.y + 1, matrix.matrixHeight - 1)
+            if len(tiles) + (maxx - minx + 1) * (maxy - miny + 1) > max_tiles:
+                return False
+
+            tiles.update(
+                (x, y) for x in range(minx, maxx + 1) for y in range(miny, maxy + 1)
+            )
+
+        for zoom in range(self.zoom, -1, -1):
+            shift = self.zoom - zoom
+            self.levels[zoom].update((x >> shift, y >> shift) for x, y in tiles)
+
+        return True
+
+    @classmethod
+    async def create(
+        cls,
+        pool: asyncpg.BuildPgPool,
+        table: Table,
+        tms: morecantile.TileMatrixSet,
+        zoom: int,
+        geometry_column: Optional[str] = None,
+    ) -> "TileOccupancy":
+        """Create the occupancy index of a table.
+
+        Note: this scans the whole table.
+
+        Args:
+            pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+            table (timvt.dbmodel.Table): Table.
+            tms (morecantile.TileMatrixSet): Tile Matrix Set (must be a quadtree).
+            zoom (int): zoom level of the index.
+            geometry_column (str, optional): geometry column name. Defaults to table's default geometry column.
+
+        Returns:
+            TileOccupancy: occupancy index.
+
+        """
+        column = table.get_geometry_column(geometry_column)
+        if not column:
+            raise ValueError(f"Invalid Geometry Column: {geometry_column}.")
+
+        bbox = tms.xy_bbox
+        first = tms.xy_bounds(morecantile.Tile(0, 0, zoom))
+        matrix = tms.matrix(zoom)
+        tms_srid = tms.crs.to_epsg()
+
+        q, p = render(
+            OCCUPANCY_SQL,
+            tablename=pg_variable(table.id),
+            geometry_column=pg_variable(column.name),
+            geometry_srid=funcs.cast(column.srid, "int"),
+            tms_srid=tms_srid,
+            tms_proj=tms.crs.to_proj4(),
+            xmin=bbox.left,
+            ymin=bbox.bottom,
+            xmax=bbox.right,
+            ymax=bbox.top,
+            seg_size=(bbox.right - bbox.left) / 64,
+            tile_width=first.right - first.left,
+            tile_height=first.top - first.bottom,
+            matrix_width=matrix.matrixWidth,
+            matrix_height=matrix.matrixHeight,
+            # Envelopes reprojected from another CRS might not exactly cover
+            # the geometries, we add the neighbouring tiles to be safe.
+            padding=0 if tms_srid and tms_srid == column.srid else 1,
+        )
+
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(q, *p)
+
+        return cls(tms, zoom, {(row[0], row[1]) for row in rows}, column.name)
+
+
+class TileOccupancyIndexes(Dict[str, TileOccupancy]):
+    """Occupancy indexes of the Tables with an `occupancy_zoom` configuration (by table id).
+
+    Indexes are created in the background when a table is first requested (`index`),
+    and created again when the table is reloaded by the table catalog (e.g with
+    `TIMVT_CATALOG_LAZY=TRUE` or after a schema change) or, when given, when the
+    table's version changes (e.g without change tracking updating the indexes).
+
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.BuildPgPool,
+        tms: morecantile.TileMatrixSet,
+        table_config: Optional[Dict[str, TableConfig]] = None,
+    ):
+        """Init indexes.
+
+        Args:
+            pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+            tms (morecantile.TileMatrixSet): Tile Matrix Set of the indexes (must be a quadtree).
+            table_config (dict, optional): Tables configuration (see `timvt.settings.TableSettings`).
+
+        """
+        super().__init__()
+        self.pool = pool
+        self.tms = tms
+        self.table_config = table_config or {}
+
+        # Tables (and their versions) the indexes were created from
+        self._tables: Dict[str, Table] = {}
+        self._versions: Dict[str, Optional[str]] = {}
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+    def zoom(self, table_id: str) -> Optional[int]:
+        """Return the `occupancy_zoom` configuration of a table."""
+        return self.table_config.get(table_id.replace(".", "_"), {}).get(
+            "occupancy_zoom"
+        )
+
+    async def create(self, table: Table, version: Optional[str] = None) -> None:
+        """Create the occupancy index of a table (if configured), at the table's `version`."""
+        zoom = self.zoom(table.id)
+        if zoom is None:
+            return
+
+        self[table.id] = await TileOccupancy.create(self.pool, table, self.tms, zoom)
+        self._tables[table.id] = table
+        self._versions[table.id] = version
+
+    def index(
+        self, table: Table, version: Optional[str] = None
+    ) -> Optional[TileOccupancy]:
+        """Return the occupancy index of a table (None until created, or created again for a new `version`, in the background)."""
+        if (
+            self._tables.get(table.id) is table
+            and table.id in self
+            and (version is None or self._versions.get(table.id) == version)
+        ):
+            return self[table.id]
+
+        if self.zoom(table.id) is not None and table.id not in self._tasks:
+
+            async def _create() -> None:
+                try:
+                    await self.create(table, version)
+                except Exception as e:  # noqa
+                    logger.warning(
+                        f"Could not create occupancy index of {table.id}: {e}"
+                    )
+                finally:
+                    self._tasks.pop(table.id, None)
+
+            self._tasks[table.id] = asyncio.create_task(_create())
+
+        return None
+
+    async def close(self) -> None:
+        """Cancel the indexes being created."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+async def register_tile_occupancy(app: FastAPI, tms: morecantile.TileMatrixSet) -> None:
+    """Create occupancy indexes of the Tables with an `occupancy_zoom` configuration.
+
+    Indexes (`app.state.tile_occupancy`) of the tables already in the table catalog are
+    created at startup, the others on their first request.
+
+    Indexes are only created when they can follow the tables' changes: with change
+    tracking (`app.state.change_tracker`), which updates them, or with table versions
+    (`app.state.table_versions`), which make them created again. Otherwise, tiles of the
+    features added in new areas would be skipped as empty.
+
+    """
+    indexes = TileOccupancyIndexes(app.state.pool, tms, TableSettings().table_config)
+
+    tracker = getattr(app.state, "change_tracker", None)
+    versions = getattr(app.state, "table_versions", None)
+    if tracker is None and versions is None:
+        if any(
+            config.get("occupancy_zoom") is not None
+            for config in indexes.table_config.values()
+        ):
+            logger.warning(
+                "Tile occupancy indexes are disabled: `occupancy_zoom` needs change "
+                "tracking (TIMVT_CHANGES_ENABLED) or table versions (TIMVT_TABLE_VERSIONS_INTERVAL)."
+            )
+        app.state.tile_occupancy = None
+        return
+
+    tables: Iterable[Table] = getattr(app.state, "table_catalog", {}).values()
+    for table in tables:
+        await indexes.create(table, versions.get(table.id) if tracker is None else None)
+
+    app.state.tile_occupancy = indexes
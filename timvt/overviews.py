@@ -0,0 +1,238 @@
+"""timvt.overviews: pre-processed geometry tables for ranges of zoom levels."""
+
+from typing import List, Optional, Sequence, Tuple
+
+import morecantile
+from buildpg import Var as pg_variable
+from buildpg import asyncpg, funcs, select_fields
+
+from timvt.dbmodel import OVERVIEWS_REGISTRY, Overview, Table
+from timvt.errors import MissingEPSGCode, MissingGeometryColumn
+from timvt.settings import TileSettings
+
+tile_settings = TileSettings()
+
+REGISTRY_SQL = """
+    CREATE TABLE IF NOT EXISTS :registry (
+        source text NOT NULL,
+        geometry_column text NOT NULL,
+        tms text NOT NULL,
+        minzoom int NOT NULL,
+        maxzoom int NOT NULL,
+        overview text NOT NULL,
+        srid int NOT NULL,
+        PRIMARY KEY (source, geometry_column, tms, minzoom)
+    )
+"""
+
+REGISTER_SQL = """
+    INSERT INTO :registry (source, geometry_column, tms, minzoom, maxzoom, overview, srid)
+    VALUES (:source, :geometry_column, :tms, :minzoom, :maxzoom, :overview, :srid)
+    ON CONFLICT (source, geometry_column, tms, minzoom) DO UPDATE
+    SET maxzoom = EXCLUDED.maxzoom, overview = EXCLUDED.overview, srid = EXCLUDED.srid
+"""
+
+OVERVIEW_TABLE_SQL = """
+    CREATE TABLE :overview AS
+    SELECT :fields, NULL::geometry(Geometry, {srid}) AS :geometry_column
+    FROM :tablename
+    WITH NO DATA
+"""
+
+OVERVIEW_SQL = """
+    INSERT INTO :overview (:fields, :geometry_column)
+    WITH
+    -- TMS's bounds in table geometry's CRS
+    bounds AS (
+        SELECT
+            ST_Transform(
+                ST_Segmentize(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, :tms_srid), :seg_size),
+                :geometry_srid
+            ) AS bbox
+    ),
+    -- Geometries clipped to the TMS's bounds, reprojected to TMS's CRS and simplified
+    features AS (
+        SELECT
+            :fields,
+            ST_Simplify(
+                ST_Transform(
+                    ST_ClipByBox2D(t.:geometry_column::geometry, bounds.bbox::box2d),
+                    :tms_srid
+                ),
+                :tolerance,
+                true
+            ) AS :geometry_column
+        FROM :tablename t, bounds
+        WHERE t.:geometry_column::geometry && bounds.bbox
+    )
+    SELECT :fields, :geometry_column
+    FROM features
+    WHERE
+        NOT ST_IsEmpty(:geometry_column)
+        -- Skip polygons smaller than `min_area`
+        AND (
+            :min_area IS NULL
+            OR ST_Dimension(:geometry_column) < 2
+            OR ST_Area(:geometry_column) >= :min_area
+        )
+"""
+
+
+def overview_name(
+    table: Table, tms: morecantile.TileMatrixSet, minzoom: int, maxzoom: int
+) -> str:
+    """Return overview table id (e.g `public.parcels_ovr_webmercatorquad_0_4`)."""
+    name = f"{table.table}_ovr_{tms.identifier.lower()}_{minzoom}_{maxzoom}"
+    if len(name) > 63:
+        raise ValueError(f"Overview name '{name}' is longer than 63 characters.")
+
+    return f"{table.dbschema}.{name}"
+
+
+async def create_overview(
+    conn: asyncpg.BuildPgConnection,
+    table: Table,
+    tms: morecantile.TileMatrixSet,
+    minzoom: int,
+    maxzoom: int,
+    simplify: float = 1.0,
+    min_area: Optional[float] = None,
+    cluster: bool = False,
+    geometry_column: Optional[str] = None,
+) -> Overview:
+    """Create (or replace) an overview table and add it to the schema's overviews registry.
+
+    Geometries are reprojected to the TMS's CRS and simplified with a tolerance of
+    `simplify` pixels of the `maxzoom` tiles. Polygons smaller than `min_area` square
+    pixels are skipped.
+
+    Args:
+        conn (asyncpg.BuildPgConnection): AsyncPG database connection.
+        table (timvt.dbmodel.Table): Source Table.
+        tms (morecantile.TileMatrixSet): Tile Matrix Set.
+        minzoom (int): Min zoom level of the overview.
+        maxzoom (int): Max zoom level of the overview.
+        simplify (float): Simplification tolerance, in tile pixels.
+        min_area (float, optional): Minimum area of polygons, in square tile pixels.
+        cluster (bool): Physically reorder the overview table on its spatial index.
+        geometry_column (str, optional): geometry column name. Defaults to table's default geometry column.
+
+    Returns:
+        Overview: overview model.
+
+    """
+    column = table.get_geometry_column(geometry_column)
+    if not column:
+        raise MissingGeometryColumn(
+            f"Could not find geometry column {geometry_column} for Table {table.id}"
+        )
+
+    tms_srid = tms.crs.to_epsg()
+    if not tms_srid:
+        raise MissingEPSGCode(f"Could not find EPSG code for TMS {tms.identifier}")
+
+    bbox = tms.xy_bbox
+    tile = tms.xy_bounds(morecantile.Tile(0, 0, maxzoom))
+    pixel = (tile.right - tile.left) / tile_settings.tile_resolution
+
+    overview = Overview(
+        table=overview_name(table, tms, minzoom, maxzoom),
+        geometry_column=column.name,
+        srid=tms_srid,
+        tms=tms.identifier,
+        minzoom=minzoom,
+        maxzoom=maxzoom,
+    )
+    registry = f"{table.dbschema}.{OVERVIEWS_REGISTRY}"
+
+    identifiers = {
+        "overview": pg_variable(overview.table),
+        "tablename": pg_variable(table.id),
+        "geometry_column": pg_variable(column.name),
+        # Same properties as the Table's tiles (other geometry columns included)
+        "fields": select_fields(
+            *[p.name for p in table.properties if p.name != column.name]
+        ),
+    }
+
+    async with conn.transaction():
+        await conn.execute_b(REGISTRY_SQL, registry=pg_variable(registry))
+        await conn.execute_b(
+            "DROP TABLE IF EXISTS :overview", overview=identifiers["overview"]
+        )
+        await conn.execute_b(
+            OVERVIEW_TABLE_SQL.format(srid=int(tms_srid)), **identifiers
+        )
+        await conn.execute_b(
+            OVERVIEW_SQL,
+            xmin=bbox.left,
+            ymin=bbox.bottom,
+            xmax=bbox.right,
+            ymax=bbox.top,
+            seg_size=(bbox.right - bbox.left) / 64,
+            tms_srid=tms_srid,
+            geometry_srid=funcs.cast(column.srid, "int"),
+            tolerance=simplify * pixel,
+            min_area=funcs.cast(
+                min_area * pixel**2 if min_area is not None else None, "float8"
+            ),
+            **identifiers,
+        )
+        await conn.execute_b(
+            "CREATE INDEX ON :overview USING GIST (:geometry_column)", **identifiers
+        )
+        if cluster:
+            index = await conn.fetchval(
+                "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = $1::regclass",
+                overview.table,
+            )
+            await conn.execute_b(
+                "CLUSTER :overview USING :index",
+                overview=identifiers["overview"],
+                index=pg_variable(index),
+            )
+
+        await conn.execute_b(
+            REGISTER_SQL,
+            registry=pg_variable(registry),
+            source=table.id,
+            geometry_column=column.name,
+            tms=tms.identifier,
+            minzoom=minzoom,
+            maxzoom=maxzoom,
+            overview=overview.table,
+            srid=tms_srid,
+        )
+        await conn.execute_b("ANALYZE :overview", overview=identifiers["overview"])
+
+    return overview
+
+
+async def create_overviews(
+    pool: asyncpg.BuildPgPool,
+    table: Table,
+    tms: morecantile.TileMatrixSet,
+    zooms: Sequence[Tuple[int, int]],
+    **kwargs,
+) -> List[Overview]:
+    """Create overview tables for multiple ranges of zoom levels.
+
+    Args:
+        pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+        table (timvt.dbmodel.Table): Source Table.
+        tms (morecantile.TileMatrixSet): Tile Matrix Set.
+        zooms (list): (minzoom, maxzoom) ranges.
+        kwargs (any, optional): Optional parameters to forward to `create_overview`.
+
+    Returns:
+        list: overview models.
+
+    """
+    overviews = []
+    async with pool.acquire() as conn:
+        for minzoom, maxzoom in zooms:
+            overviews.append(
+                await create_overview(conn, table, tms, minzoom, maxzoom, **kwargs)
+            )
+
+    return overviews
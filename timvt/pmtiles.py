@@ -0,0 +1,481 @@
+"""timvt.pmtiles: PMTiles (v3) archives.
+
+Specification: https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+
+"""
+
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from timvt import compression
+
+HEADER_SIZE = 127
+ROOT_DIRECTORY_MAX_SIZE = 16384 - HEADER_SIZE
+
+# Compression
+UNKNOWN = 0
+NONE = 1
+GZIP = 2
+BROTLI = 3
+ZSTD = 4
+
+# HTTP content encodings of the compressions
+CONTENT_ENCODINGS: Dict[int, Optional[str]] = {
+    NONE: None,
+    GZIP: "gzip",
+    BROTLI: "br",
+    ZSTD: "zstd",
+}
+
+# Tile types
+MVT = 1
+
+
+def compress(data: bytes, compression_type: int) -> bytes:
+    """Compress data (directories, metadata) with a PMTiles compression."""
+    if compression_type == NONE:
+        return data
+
+    if compression_type == GZIP:
+        return gzip.compress(data, mtime=0)
+
+    if compression_type not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported PMTiles compression ({compression_type}).")
+
+    return compression.compress(data, CONTENT_ENCODINGS[compression_type])  # type: ignore
+
+
+def decompress(data: bytes, compression_type: int) -> bytes:
+    """Decompress data (directories, metadata) with a PMTiles compression."""
+    if compression_type not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported PMTiles compression ({compression_type}).")
+
+    encoding = CONTENT_ENCODINGS[compression_type]
+    return compression.decompress(data, encoding) if encoding else bytes(data)
+
+
+class Entry(NamedTuple):
+    """Directory entry."""
+
+    tile_id: int
+    offset: int
+    length: int
+    run_length: int
+
+
+def zxy_to_tileid(z: int, x: int, y: int) -> int:
+    """Return the Hilbert curve tile id of a z/x/y tile."""
+    acc = ((1 << (2 * z)) - 1) // 3  # number of tiles in the lower zoom levels
+    d = 0
+    s = 1 << z >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+
+    return acc + d
+
+
+def _write_varint(buf: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def serialize_directory(
+    entries: Sequence[Entry], compression_type: int = GZIP
+) -> bytes:
+    """Serialize and compress a directory."""
+    buf = bytearray()
+    _write_varint(buf, len(entries))
+
+    last_id = 0
+    for e in entries:
+        _write_varint(buf, e.tile_id - last_id)
+        last_id = e.tile_id
+
+    for e in entries:
+        _write_varint(buf, e.run_length)
+
+    for e in entries:
+        _write_varint(buf, e.length)
+
+    for i, e in enumerate(entries):
+        if i > 0 and e.offset == entries[i - 1].offset + entries[i - 1].length:
+            _write_varint(buf, 0)
+        else:
+            _write_varint(buf, e.offset + 1)
+
+    return compress(bytes(buf), compression_type)
+
+
+def deserialize_directory(data: bytes, compression_type: int = GZIP) -> List[Entry]:
+    """Decompress and deserialize a directory."""
+    data = decompress(data, compression_type)
+
+    n, pos = _read_varint(data, 0)
+
+    tile_ids = []
+    last_id = 0
+    for _ in range(n):
+        delta, pos = _read_varint(data, pos)
+        last_id += delta
+        tile_ids.append(last_id)
+
+    run_lengths = []
+    for _ in range(n):
+        v, pos = _read_varint(data, pos)
+        run_lengths.append(v)
+
+    lengths = []
+    for _ in range(n):
+        v, pos = _read_varint(data, pos)
+        lengths.append(v)
+
+    entries: List[Entry] = []
+    for i in range(n):
+        v, pos = _read_varint(data, pos)
+        if v == 0 and i > 0:
+            offset = entries[i - 1].offset + entries[i - 1].length
+        else:
+            offset = v - 1
+        entries.append(Entry(tile_ids[i], offset, lengths[i], run_lengths[i]))
+
+    return entries
+
+
+def find_entry(entries: Sequence[Entry], tile_id: int) -> Optional[Entry]:
+    """Find the directory entry of a tile id (binary search)."""
+    lo, hi = 0, len(entries) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if tile_id > entries[mid].tile_id:
+            lo = mid + 1
+        elif tile_id < entries[mid].tile_id:
+            hi = mid - 1
+        else:
+            return entries[mid]
+
+    # Entries with run_length == 0 point to leaf directories
+    if hi >= 0:
+        entry = entries[hi]
+        if entry.run_length == 0:
+            return entry
+        if tile_id - entry.tile_id < entry.run_length:
+            return entry
+
+    return None
+
+
+def build_directories(
+    entries: Sequence[Entry], compression_type: int = GZIP
+) -> Tuple[bytes, bytes]:
+    """Return root and leaf directories, splitting entries in leaves if needed."""
+    root = serialize_directory(entries, compression_type)
+    if len(root) <= ROOT_DIRECTORY_MAX_SIZE:
+        return root, b""
+
+    leaf_size = 4096
+    while True:
+        root_entries = []
+        leaves = bytearray()
+        for i in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[i : i + leaf_size], compression_type)
+            root_entries.append(Entry(entries[i].tile_id, len(leaves), len(leaf), 0))
+            leaves += leaf
+
+        root = serialize_directory(root_entries, compression_type)
+        if len(root) <= ROOT_DIRECTORY_MAX_SIZE:
+            return root, bytes(leaves)
+
+        leaf_size *= 2
+
+
+def serialize_header(header: Dict[str, Any]) -> bytes:
+    """Serialize PMTiles header."""
+    return b"PMTiles" + struct.pack(
+        "<B11Q6B4iBii",
+        3,
+        header["root_offset"],
+        header["root_length"],
+        header["metadata_offset"],
+        header["metadata_length"],
+        header["leaf_directory_offset"],
+        header["leaf_directory_length"],
+        header["tile_data_offset"],
+        header["tile_data_length"],
+        header["addressed_tiles_count"],
+        header["tile_entries_count"],
+        header["tile_contents_count"],
+        header["clustered"],
+        header["internal_compression"],
+        header["tile_compression"],
+        header["tile_type"],
+        header["min_zoom"],
+        header["max_zoom"],
+        int(header["min_lon"] * 10_000_000),
+        int(header["min_lat"] * 10_000_000),
+        int(header["max_lon"] * 10_000_000),
+        int(header["max_lat"] * 10_000_000),
+        header["center_zoom"],
+        int(header["center_lon"] * 10_000_000),
+        int(header["center_lat"] * 10_000_000),
+    )
+
+
+def deserialize_header(data: bytes) -> Dict[str, Any]:
+    """Deserialize PMTiles header."""
+    if data[:7] != b"PMTiles":
+        raise ValueError("Invalid PMTiles archive.")
+
+    values = struct.unpack("<B11Q6B4iBii", data[7:HEADER_SIZE])
+    if values[0] != 3:
+        raise ValueError(f"Unsupported PMTiles version: {values[0]}.")
+
+    keys = [
+        "root_offset",
+        "root_length",
+        "metadata_offset",
+        "metadata_length",
+        "leaf_directory_offset",
+        "leaf_directory_length",
+        "tile_data_offset",
+        "tile_data_length",
+        "addressed_tiles_count",
+        "tile_entries_count",
+        "tile_contents_count",
+        "clustered",
+        "internal_compression",
+        "tile_compression",
+        "tile_type",
+        "min_zoom",
+        "max_zoom",
+        "min_lon",
+        "min_lat",
+        "max_lon",
+        "max_lat",
+        "center_zoom",
+        "center_lon",
+        "center_lat",
+    ]
+    header = dict(zip(keys, values[1:]))
+    for key in ["min_lon", "min_lat", "max_lon", "max_lat", "center_lon", "center_lat"]:
+        header[key] /= 10_000_000
+
+    return header
+
+
+class PMTilesWriter:
+    """Write Mapbox Vector Tiles to a PMTiles archive.
+
+    Tile data is written to a temporary file, the archive is assembled on `close()`.
+    Identical tiles (e.g oceans) are stored once.
+
+    """
+
+    def __init__(
+        self, path: str, tile_compression: int = GZIP, internal_compression: int = GZIP
+    ):
+        """Init writer.
+
+        Args:
+            path (str): archive path.
+            tile_compression (int): compression of the tile data (e.g `pmtiles.GZIP`).
+            internal_compression (int): compression of the directories and metadata.
+
+        """
+        self.path = path
+        self.tile_compression = tile_compression
+        self.internal_compression = internal_compression
+        self.entries: List[Entry] = []
+        self.addressed_tiles = 0
+        self.clustered = True
+        self._contents: Dict[bytes, Tuple[int, int]] = {}
+        self._offset = 0
+        self._data = tempfile.TemporaryFile()
+
+    def __enter__(self):
+        """Support using with Context Managers."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Discard the temporary data on error."""
+        if exc_type is not None:
+            self._data.close()
+
+    def write_tile(self, z: int, x: int, y: int, data: bytes) -> None:
+        """Add a tile to the archive."""
+        tile_id = zxy_to_tileid(z, x, y)
+        if self.entries and tile_id <= self.entries[-1].tile_id:
+            self.clustered = False
+
+        digest = hashlib.sha256(data).digest()
+        if digest in self._contents:
+            offset, length = self._contents[digest]
+        else:
+            offset, length = self._offset, len(data)
+            self._data.write(data)
+            self._offset += length
+            self._contents[digest] = (offset, length)
+
+        self.addressed_tiles += 1
+
+        last = self.entries[-1] if self.entries else None
+        if (
+            last is not None
+            and last.offset == offset
+            and tile_id == last.tile_id + last.run_length
+        ):
+            self.entries[-1] = last._replace(run_length=last.run_length + 1)
+        else:
+            self.entries.append(Entry(tile_id, offset, length, 1))
+
+    def close(self, header: Dict[str, Any], metadata: Dict[str, Any]) -> None:
+        """Assemble the archive.
+
+        Args:
+            header (dict): min/max zooms, bounds and center of the archive.
+            metadata (dict): JSON metadata.
+
+        """
+        entries = sorted(self.entries, key=lambda e: e.tile_id)
+        root, leaves = build_directories(entries, self.internal_compression)
+        meta = compress(json.dumps(metadata).encode(), self.internal_compression)
+
+        metadata_offset = HEADER_SIZE + len(root)
+        leaf_directory_offset = metadata_offset + len(meta)
+        tile_data_offset = leaf_directory_offset + len(leaves)
+
+        header = {
+            **header,
+            "root_offset": HEADER_SIZE,
+            "root_length": len(root),
+            "metadata_offset": metadata_offset,
+            "metadata_length": len(meta),
+            "leaf_directory_offset": leaf_directory_offset,
+            "leaf_directory_length": len(leaves),
+            "tile_data_offset": tile_data_offset,
+            "tile_data_length": self._offset,
+            "addressed_tiles_count": self.addressed_tiles,
+            "tile_entries_count": len(entries),
+            "tile_contents_count": len(self._contents),
+            "clustered": int(self.clustered),
+            "internal_compression": self.internal_compression,
+            "tile_compression": self.tile_compression,
+            "tile_type": MVT,
+        }
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(serialize_header(header))
+            f.write(root)
+            f.write(meta)
+            f.write(leaves)
+            self._data.seek(0)
+            shutil.copyfileobj(self._data, f)
+
+        self._data.close()
+        os.replace(tmp, self.path)
+
+
+class PMTilesReader:
+    """Read tiles from a memory-mapped PMTiles archive."""
+
+    def __init__(self, path: str):
+        """Open a PMTiles archive.
+
+        Args:
+            path (str): archive path.
+
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header = deserialize_header(self._mmap[:HEADER_SIZE])
+        if self.header["internal_compression"] not in CONTENT_ENCODINGS:
+            self._mmap.close()
+            raise ValueError(
+                f"Archive '{path}' has an unsupported internal compression ({self.header['internal_compression']})."
+            )
+
+        self._root = self._directory(
+            self.header["root_offset"], self.header["root_length"]
+        )
+        self._leaf = lru_cache(maxsize=64)(self._directory)
+
+    def __enter__(self):
+        """Support using with Context Managers."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the archive."""
+        self.close()
+
+    def _directory(self, offset: int, length: int) -> List[Entry]:
+        return deserialize_directory(
+            self._mmap[offset : offset + length], self.header["internal_compression"]
+        )
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Return archive's JSON metadata."""
+        offset = self.header["metadata_offset"]
+        data = decompress(
+            self._mmap[offset : offset + self.header["metadata_length"]],
+            self.header["internal_compression"],
+        )
+
+        return json.loads(data) if data else {}
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """Return tile data (as stored in the archive) or None."""
+        tile_id = zxy_to_tileid(z, x, y)
+
+        entries = self._root
+        # leaf directories are at most 3 levels deep
+        for _ in range(4):
+            entry = find_entry(entries, tile_id)
+            if entry is None:
+                return None
+
+            if entry.run_length > 0:
+                offset = self.header["tile_data_offset"] + entry.offset
+                return self._mmap[offset : offset + entry.length]
+
+            entries = self._leaf(
+                self.header["leaf_directory_offset"] + entry.offset, entry.length
+            )
+
+        return None
+
+    def close(self) -> None:
+        """Close the archive."""
+        self._mmap.close()
@@ -20,3 +20,4 @@ class MimeTypes(str, Enum):
     text = "text/plain"
     pbf = "application/x-protobuf"
     mvt = "application/x-protobuf"
+    batch = "application/vnd.timvt.tile-batch"
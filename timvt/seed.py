@@ -0,0 +1,262 @@
+"""timvt.seed: pre-render layers in MBTiles/PMTiles archives."""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from buildpg import asyncpg
+from morecantile import Tile, TileMatrixSet
+
+from timvt import pmtiles
+from timvt.layer import Layer
+from timvt.mbtiles import MBTiles
+
+
+@dataclass
+class SeedStats:
+    """Seeding statistics."""
+
+    tiles: int = 0
+    empty: int = 0
+    skipped: int = 0
+    size: int = 0
+    start: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        """Elapsed time (in seconds)."""
+        return time.monotonic() - self.start
+
+    @property
+    def throughput(self) -> float:
+        """Rendered tiles per second."""
+        return self.tiles / self.elapsed if self.elapsed else 0.0
+
+    def add(self, content: bytes) -> None:
+        """Record a rendered tile."""
+        self.tiles += 1
+        self.size += len(content)
+        if not content:
+            self.empty += 1
+
+    def __str__(self) -> str:
+        """Return summary."""
+        return (
+            f"{self.tiles} tiles rendered ({self.empty} empty, {self.skipped} skipped) "
+            f"in {self.elapsed:.1f}s ({self.throughput:.1f} tiles/s, "
+            f"{self.size / 1024 / 1024:.1f} MiB)"
+        )
+
+
+def _write_batch(archive: MBTiles, tiles: List[Tuple[Tile, bytes]]) -> None:
+    for tile, content in tiles:
+        archive.write_tile(tile, content)
+
+    # Commit after each batch so we can resume from there
+    archive.commit()
+
+
+async def seed(
+    pool: asyncpg.BuildPgPool,
+    layer: Layer,
+    tms: TileMatrixSet,
+    archive: MBTiles,
+    bbox: Sequence[float],
+    minzoom: int,
+    maxzoom: int,
+    concurrency: int = 4,
+    batch_size: int = 64,
+    progress: Optional[Callable[[SeedStats], None]] = None,
+    **kwargs: Any,
+) -> SeedStats:
+    """Render a pyramid of tiles into an MBTiles archive.
+
+    Tiles already recorded in the archive's checkpoint are skipped, so an interrupted
+    seeding can be resumed by calling `seed` again with the same archive. Rendered
+    batches are written (and committed) by a single writer thread, so that the SQLite
+    writes don't block the rendering of the other batches.
+
+    Args:
+        pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+        layer (timvt.layer.Layer): Layer to render.
+        tms (morecantile.TileMatrixSet): Tile Matrix Set.
+        archive (timvt.mbtiles.MBTiles): Output archive.
+        bbox (list): Bounding box (in TMS's geographic CRS) of the tiles to render.
+        minzoom (int): Min zoom level.
+        maxzoom (int): Max zoom level.
+        concurrency (int): Number of tile batches to render concurrently.
+        batch_size (int): Number of tiles rendered per database query.
+        progress (callable, optional): Function called with the stats after each batch.
+        kwargs (any, optional): Optional parameters to forward to `Layer.get_tiles`.
+
+    Returns:
+        SeedStats: seeding statistics.
+
+    """
+    stats = SeedStats()
+    seeded = archive.seeded()
+
+    queue: "asyncio.Queue[Optional[List[Tile]]]" = asyncio.Queue(maxsize=concurrency)
+
+    loop = asyncio.get_running_loop()
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timvt-seed")
+
+    async def worker() -> None:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+
+            rendered = [
+                (tile, bytes(content or b""))
+                async for tile, content in layer.get_tiles(pool, batch, tms, **kwargs)
+            ]
+            await loop.run_in_executor(writer, _write_batch, archive, rendered)
+            for _, content in rendered:
+                stats.add(content)
+
+            if progress:
+                progress(stats)
+
+    async def producer() -> None:
+        batch: List[Tile] = []
+        west, south, east, north = bbox
+        zooms = list(range(minzoom, maxzoom + 1))
+        for tile in tms.tiles(west, south, east, north, zooms=zooms):
+            if (tile.z, tile.x, tile.y) in seeded:
+                stats.skipped += 1
+            else:
+                batch.append(tile)
+
+            if len(batch) == batch_size:
+                await queue.put(batch)
+                batch = []
+
+        await queue.put(batch)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    tasks = [asyncio.ensure_future(producer())]
+    tasks += [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        # After the pending writes
+        await loop.run_in_executor(writer, archive.commit)
+        writer.shutdown()
+
+    return stats
+
+
+def mbtiles_to_pmtiles(src: MBTiles, dst: str) -> None:
+    """Convert an MBTiles archive to PMTiles.
+
+    Args:
+        src (timvt.mbtiles.MBTiles): Source archive.
+        dst (str): PMTiles archive path.
+
+    """
+    metadata = src.metadata
+    bounds = [float(v) for v in metadata["bounds"].split(",")]
+    center = [float(v) for v in metadata["center"].split(",")]
+
+    # Write tiles in Hilbert (tile id) order to get a clustered archive
+    tiles = sorted(
+        (pmtiles.zxy_to_tileid(tile.z, tile.x, tile.y), tile) for tile in src.tiles()
+    )
+
+    writer = pmtiles.PMTilesWriter(dst, tile_compression=pmtiles.GZIP)
+    with writer:
+        for _, tile in tiles:
+            writer.write_tile(tile.z, tile.x, tile.y, src.read_tile(tile))
+
+        writer.close(
+            header={
+                "min_zoom": int(metadata["minzoom"]),
+                "max_zoom": int(metadata["maxzoom"]),
+                "min_lon": bounds[0],
+                "min_lat": bounds[1],
+                "max_lon": bounds[2],
+                "max_lat": bounds[3],
+                "center_lon": center[0],
+                "center_lat": center[1],
+                "center_zoom": int(center[2]),
+            },
+            metadata={
+                k: v
+                for k, v in metadata.items()
+                if k not in ["bounds", "center", "minzoom", "maxzoom"]
+            },
+        )
+
+
+async def seed_archive(
+    pool: asyncpg.BuildPgPool,
+    layer: Layer,
+    tms: TileMatrixSet,
+    output: str,
+    bbox: Optional[Sequence[float]] = None,
+    minzoom: Optional[int] = None,
+    maxzoom: Optional[int] = None,
+    **kwargs: Any,
+) -> SeedStats:
+    """Seed a layer into an MBTiles (`.mbtiles`) or PMTiles (`.pmtiles`) archive.
+
+    PMTiles archives are assembled from an intermediate `{output}.mbtiles` file, which
+    is also used as checkpoint when resuming.
+
+    Args:
+        pool (asyncpg.BuildPgPool): AsyncPG database connection pool.
+        layer (timvt.layer.Layer): Layer to render.
+        tms (morecantile.TileMatrixSet): Tile Matrix Set.
+        output (str): Output archive path.
+        bbox (list, optional): Bounding box of the tiles to render. Defaults to the layer's bounds.
+        minzoom (int, optional): Min zoom level. Defaults to the layer's minzoom.
+        maxzoom (int, optional): Max zoom level. Defaults to the layer's maxzoom.
+        kwargs (any, optional): Optional parameters to forward to `timvt.seed.seed`.
+
+    Returns:
+        SeedStats: seeding statistics.
+
+    """
+    bbox = bbox or layer.bounds
+    minzoom = minzoom if minzoom is not None else layer.minzoom
+    maxzoom = maxzoom if maxzoom is not None else layer.maxzoom
+
+    is_pmtiles = output.endswith(".pmtiles")
+    path = output + ".mbtiles" if is_pmtiles else output
+
+    with MBTiles(path, tms) as archive:
+        archive.set_metadata(
+            {
+                "name": layer.id,
+                "format": "pbf",
+                "type": "overlay",
+                "bounds": ",".join(map(str, bbox)),
+                "center": "{},{},{}".format(
+                    (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2, minzoom
+                ),
+                "minzoom": str(minzoom),
+                "maxzoom": str(maxzoom),
+                "tilematrixset": tms.identifier,
+                **({"description": layer.description} if layer.description else {}),
+            }
+        )
+        stats = await seed(pool, layer, tms, archive, bbox, minzoom, maxzoom, **kwargs)
+
+        if is_pmtiles:
+            mbtiles_to_pmtiles(archive, output)
+        else:
+            archive.finalize()
+
+    if is_pmtiles:
+        os.remove(path)
+
+    return stats
@@ -7,7 +7,7 @@ see: https://pydantic-docs.helpmanual.io/usage/settings/
 """
 import sys
 from functools import lru_cache
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 import pydantic
 
@@ -26,6 +26,11 @@ class TableConfig(TypedDict, total=False):
     datetimecol: Optional[str]
     pk: Optional[str]
     properties: Optional[List[str]]
+    occupancy_zoom: Optional[int]
+    simplify: Optional[float]
+    min_area: Optional[float]
+    order_by: Optional[str]
+    statement_timeout: Optional[float]
 
 
 class TableSettings(pydantic.BaseSettings):
@@ -48,8 +53,11 @@ class _ApiSettings(pydantic.BaseSettings):
     name: str = "TiMVT"
     cors_origins: str = "*"
     cachecontrol: str = "public, max-age=3600"
+    table_versions_interval: Optional[float]
     debug: bool = False
+    debug_token: Optional[str]
     functions_directory: Optional[str]
+    archives_directory: Optional[str]
 
     @pydantic.validator("cors_origins")
     def parse_cors_origin(cls, v):
@@ -85,6 +93,10 @@ class _TileSettings(pydantic.BaseSettings):
     default_tms: str = "WebMercatorQuad"
     default_minzoom: int = 0
     default_maxzoom: int = 22
+    max_tiles_per_batch: int = 1000
+    bounds_check: bool = False
+    bounds_check_margin: float = 0.1
+    statement_timeout: Optional[float]
 
     class Config:
         """model config"""
@@ -99,6 +111,167 @@ def TileSettings() -> _TileSettings:
     return _TileSettings()
 
 
+class CacheSettings(pydantic.BaseSettings):
+    """Tile cache settings.
+
+    Attributes:
+        backend: cache type (`memory`, `file` or `redis`). Defaults to no cache.
+        ttl: time to live (in seconds) of the cached tiles.
+        max_size: maximum size (in bytes) of the `memory` cache.
+        directory: root directory of the `file` cache.
+        redis_url: url of the `redis` server.
+        encoding: content encoding (`gzip`, `br` or `zstd`) of the cached tiles. Set to `none` to store uncompressed tiles.
+    """
+
+    backend: Optional[Literal["memory", "file", "redis"]] = None
+    ttl: Optional[int] = 3600
+    max_size: int = 256 * 1024 * 1024
+    directory: Optional[str]
+    redis_url: Optional[str]
+    encoding: Optional[Literal["gzip", "br", "zstd"]] = "gzip"
+
+    @pydantic.validator("encoding", pre=True)
+    def parse_encoding(cls, v):
+        """Parse `none` encoding."""
+        if isinstance(v, str) and v.lower() in ["", "none"]:
+            return None
+        return v
+
+    class Config:
+        """model config"""
+
+        env_prefix = "TIMVT_CACHE_"
+        env_file = ".env"
+
+
+class CompressionSettings(pydantic.BaseSettings):
+    """Tile compression settings.
+
+    Attributes:
+        executor: where large tiles are compressed (`thread` or `process` pool). Set to `none` to compress all the tiles in the event loop.
+        max_workers: number of workers of the pool (defaults to the executor's default).
+        offload_threshold: size (in bytes) from which tiles are compressed in the pool, smaller tiles are compressed in the event loop.
+    """
+
+    executor: Optional[Literal["thread", "process"]] = "thread"
+    max_workers: Optional[int]
+    offload_threshold: int = 64 * 1024
+
+    @pydantic.validator("executor", pre=True)
+    def parse_executor(cls, v):
+        """Parse `none` executor."""
+        if isinstance(v, str) and v.lower() in ["", "none"]:
+            return None
+        return v
+
+    class Config:
+        """model config"""
+
+        env_prefix = "TIMVT_COMPRESSION_"
+        env_file = ".env"
+
+
+class ChangesSettings(pydantic.BaseSettings):
+    """Table change tracking settings.
+
+    Attributes:
+        enabled: listen to the tables' changes (sent by the `timvt triggers` triggers).
+        tms: TileMatrixSets of the invalidated tiles.
+        minzoom: min zoom level of the invalidated tiles.
+        maxzoom: max zoom level of the invalidated tiles.
+        max_tiles: maximum number of tiles for one change, above which all the layer's tiles are invalidated.
+        log_file: file where invalidated tiles are appended.
+        purge_url: url where invalidated tiles are sent (POST).
+    """
+
+    enabled: bool = False
+    tms: List[str] = ["WebMercatorQuad"]
+    minzoom: int = 0
+    maxzoom: int = 16
+    max_tiles: int = 10000
+    log_file: Optional[str]
+    purge_url: Optional[str]
+
+    class Config:
+        """model config"""
+
+        env_prefix = "TIMVT_CHANGES_"
+        env_file = ".env"
+
+
+class AdmissionSettings(pydantic.BaseSettings):
+    """Tile queries admission control settings.
+
+    Attributes:
+        enabled: limit the number of concurrent tile queries per layer and zoom band.
+        max_concurrency: maximum number of concurrent queries per layer and zoom band.
+        layers: maximum number of concurrent queries for specific layers (e.g `{"public.heavy_function": 1}`).
+        zoom_bands: first zoom level of each zoom band (e.g `[0, 8, 14]`).
+        max_queue: maximum number of queries waiting for each layer and zoom band, above which requests are rejected.
+        queue_timeout: maximum time (in seconds) a query waits before being rejected.
+        retry_after: `Retry-After` header (in seconds) of the rejected requests.
+    """
+
+    enabled: bool = False
+    max_concurrency: int = 4
+    layers: Dict[str, int] = {}
+    zoom_bands: List[int] = [0]
+    max_queue: int = 32
+    queue_timeout: float = 5.0
+    retry_after: int = 1
+
+    class Config:
+        """model config"""
+
+        env_prefix = "TIMVT_ADMISSION_"
+        env_file = ".env"
+
+
+class MetricsSettings(pydantic.BaseSettings):
+    """Metrics settings.
+
+    Attributes:
+        enabled: expose Prometheus metrics of the tile pipeline at `/metrics` (requires `prometheus-client`).
+        tracing: create OpenTelemetry spans of the tile queries (requires `opentelemetry-api`).
+    """
+
+    enabled: bool = False
+    tracing: bool = False
+
+    class Config:
+        """model config"""
+
+        env_prefix = "TIMVT_METRICS_"
+        env_file = ".env"
+
+
+class CatalogSettings(pydantic.BaseSettings):
+    """Table catalog settings.
+
+    Attributes:
+        lazy: load the tables in the background (and on first access) instead of at startup.
+        refresh_interval: interval (in seconds) between the catalog refreshes (new, modified and dropped tables). Defaults to no refresh.
+        listen: reload the tables notified by the DDL event triggers (created with `timvt catalog-triggers`).
+        missing_ttl: time (in seconds) during which tables not found are not looked up again.
+        max_missing: max number of tables not found remembered.
+
+    Tables not in the catalog are only looked up (on first access) when the catalog is
+    lazy, refreshed or listening to the DDL changes.
+    """
+
+    lazy: bool = False
+    refresh_interval: Optional[float]
+    listen: bool = False
+    missing_ttl: float = 60
+    max_missing: int = 10000
+
+    class Config:
+        """model config"""
+
+        env_prefix = "TIMVT_CATALOG_"
+        env_file = ".env"
+
+
 class PostgresSettings(pydantic.BaseSettings):
     """Postgres-specific API settings.
 
@@ -108,6 +281,9 @@ class PostgresSettings(pydantic.BaseSettings):
         postgres_host: hostname for the connection.
         postgres_port: database port.
         postgres_dbname: database name.
+        database_replica_urls: read replicas urls, used for the tile queries.
+        db_replica_check_interval: interval (in seconds) between the read replicas health checks.
+        db_replica_max_lag: maximum replication lag (in seconds) of the read replicas used for the tile queries.
     """
 
     postgres_user: Optional[str]
@@ -117,11 +293,15 @@ class PostgresSettings(pydantic.BaseSettings):
     postgres_dbname: Optional[str]
 
     database_url: Optional[pydantic.PostgresDsn] = None
+    database_replica_urls: List[pydantic.PostgresDsn] = []
 
     db_min_conn_size: int = 1
     db_max_conn_size: int = 10
     db_max_queries: int = 50000
     db_max_inactive_conn_lifetime: float = 300
+    db_statement_cache_size: int = 100
+    db_replica_check_interval: float = 10
+    db_replica_max_lag: Optional[float]
 
     db_schemas: List[str] = ["public"]
     db_tables: Optional[List[str]]